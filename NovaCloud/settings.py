@@ -148,3 +148,61 @@ AUTHENTICATION_BACKENDS = [
 NOVA_TCP_SERVER_HOST = '0.0.0.0'  # 监听所有网络接口
 NOVA_TCP_SERVER_PORT = 8100  # TCP服务器端口
 NOVA_TCP_SERVER_AUTOSTART = True  # 是否在Django启动时自动启动TCP服务器
+
+# TCP服务器数据写入配置
+NOVA_TCP_INGEST_BATCH_SIZE = 500  # 传感器数据批量写入的最大记录数
+NOVA_TCP_INGEST_FLUSH_INTERVAL = 0.05  # 传感器数据批量写入的最长等待时间（秒）
+NOVA_TCP_REGISTRY_TTL = 60  # TCP服务器设备注册表条目的过期时间（秒），用于感知Web进程中的设备修改
+NOVA_TCP_PRESENCE_FLUSH_INTERVAL = 5.0  # 设备最后在线时间和状态批量写入的周期（秒）
+NOVA_TCP_DB_WORKERS = 1  # TCP服务器数据库工作线程数，SQLite写入是串行的，使用PostgreSQL时可按CPU核数调大
+NOVA_TCP_DB_QUEUE_SIZE = 1000  # TCP服务器数据库任务队列上限，队满时暂停读取设备数据
+NOVA_TCP_WORKERS = 1  # TCP服务器工作进程数，大于1时多个进程共享监听端口（需要支持fork的平台）
+NOVA_TCP_STATS_INTERVAL = 60  # TCP服务器输出运行统计的周期（秒），0表示不输出
+NOVA_TCP_METRICS_ADDRESS = ''  # 提供Prometheus指标（GET /metrics）的HTTP地址，如 127.0.0.1:9108，多进程模式下由主进程提供，空字符串表示不启用
+NOVA_TCP_JSON_CODEC = 'auto'  # 设备协议JSON编解码器：auto/orjson/ujson/json
+NOVA_TCP_EVENT_LOOP = 'auto'  # TCP服务器事件循环：auto/uvloop/asyncio
+NOVA_TCP_LOG_LEVEL = 'INFO'  # TCP服务器日志级别，DEBUG会记录每条消息
+NOVA_TCP_LOG_FORMAT = 'text'  # TCP服务器日志格式：text/json
+NOVA_TCP_LOG_SAMPLE_RATE = 0.0  # INFO级别下记录原始设备数据的采样比例（0~1）
+NOVA_TCP_LOG_SUMMARY_INTERVAL = 60  # 按设备汇总活动日志的周期（秒）
+NOVA_TCP_MAX_BATCH_SAMPLES = 1000  # data_batch 消息允许携带的最大样本数
+NOVA_TCP_LATE_SAMPLE_SECONDS = 300  # 早于此秒数的补传样本只存储，不触发策略引擎
+NOVA_TCP_AUTH_TIMEOUT = 10  # 连接建立后等待认证消息的最长时间（秒），0表示不限制
+NOVA_TCP_IDLE_TIMEOUT = 300  # 认证后连续多长时间没有收到消息即断开（秒），0表示不限制
+NOVA_TCP_HEARTBEAT_MISSES = 3  # 设备声明了心跳间隔时，连续错过多少个心跳间隔即断开
+NOVA_TCP_MAX_LINE_SIZE = 262144  # 单条消息（JSON行或二进制帧）的最大字节数
+NOVA_TCP_MAX_CONNECTIONS = 10000  # 每个工作进程的最大连接数，0表示不限制
+NOVA_TCP_MAX_CONNECTIONS_PER_IP = 0  # 每个工作进程中同一IP的最大连接数，0表示不限制（设备常位于同一NAT之后）
+NOVA_TCP_DEVICE_RATE_LIMIT = 100  # 每个设备每秒最多处理的消息数，0表示不限制，项目中的配置优先
+NOVA_TCP_DEVICE_RATE_BURST = 200  # 每个设备可以超出速率上限连续发送的消息数，0表示等于每秒速率
+NOVA_TCP_PROJECT_RATE_LIMIT = 0  # 每个项目的设备合计每秒最多处理的消息数（每个工作进程分别计算），0表示不限制，项目中的配置优先
+NOVA_TCP_PROJECT_RATE_BURST = 0  # 每个项目可以超出速率上限连续发送的消息数，0表示等于每秒速率
+NOVA_TCP_RATE_LIMIT_ACTION = 'defer'  # 超过速率上限时的处理方式：defer 延后处理，drop 丢弃并回复限流响应
+NOVA_TCP_AUTH_CACHE_TTL = 300  # 设备认证缓存的过期时间（秒），Web进程中修改的设备密钥在此时间与NOVA_TCP_REGISTRY_TTL中较短者之后生效
+NOVA_TCP_AUTH_NEGATIVE_TTL = 30  # 不存在的设备ID在认证缓存中的保留时间（秒）
+NOVA_TCP_PRELOAD_DEVICES = True  # TCP服务器启动时批量加载所有设备的认证信息和传感器
+NOVA_TCP_HANDSHAKE_CONCURRENCY = 100  # 每个工作进程同时进行的需要访问数据库的设备认证数，0表示不限制
+NOVA_TCP_HANDSHAKE_MAX_WAIT = 2.0  # 设备认证排队的最长等待时间（秒）
+NOVA_TCP_HANDSHAKE_QUEUE_SIZE = 5000  # 设备认证的最大排队数
+NOVA_TCP_RETRY_AFTER_MS = 1000  # 握手被拒绝时建议设备重试的基准间隔（毫秒）
+NOVA_TCP_DRAIN_TIMEOUT = 10.0  # 停止服务器时等待连接处理完已收到数据的最长时间（秒）
+NOVA_TCP_RECONNECT_SPREAD_MS = 10000  # 停止服务器时建议设备重连的随机分散范围（毫秒）
+NOVA_TCP_CONTROL_ADDRESS = '127.0.0.1:8101'  # 命令推送控制通道的本机地址，host:port 或 unix:路径，空字符串表示不启用
+NOVA_TCP_CONTROL_TIMEOUT = 2.0  # Web进程和策略引擎等待控制通道响应的最长时间（秒）
+NOVA_TCP_COMMAND_WINDOW = 8  # 每个设备同时等待响应的最大命令数
+NOVA_TCP_COMMAND_ACK_TIMEOUT = 5.0  # 等待设备响应命令的初始超时时间（秒），每次重试加倍
+NOVA_TCP_COMMAND_MAX_RETRIES = 3  # 设备未响应时命令的最大重发次数
+NOVA_TCP_COMMAND_TTL = 300  # 命令的有效期（秒），超过后不再发送并标记为超时，0表示不过期
+NOVA_TCP_BUS_QUEUE_SIZE = 10000  # 消息总线每个消费者的最大积压事件数，超过时丢弃最旧的事件
+NOVA_TCP_BUS_ADAPTERS = []  # 外部消息代理适配器（BrokerAdapter 子类）的导入路径列表
+
+# SensorData分区存储配置，运行 python manage.py sensor_data_partitions enable 后生效
+NOVA_SENSOR_DATA_PARTITION_INTERVAL = 'month'  # 新建分区的时间粒度：day/month
+NOVA_SENSOR_DATA_PARTITIONS_AHEAD = 3  # 在当前周期之后预先创建的分区数
+
+# 传感器数据保留与汇总配置，由Celery任务 iot_devices.tasks.compact_sensor_data 定期执行，项目和传感器中的配置优先
+NOVA_SENSOR_DATA_RAW_RETENTION_DAYS = 0  # 原始读数的保留天数，0表示永久保留
+NOVA_SENSOR_DATA_MINUTE_ROLLUP_RETENTION_DAYS = 0  # 分钟汇总的保留天数，0表示永久保留
+NOVA_SENSOR_DATA_HOUR_ROLLUP_RETENTION_DAYS = 0  # 小时汇总的保留天数，0表示永久保留
+NOVA_SENSOR_DATA_ROLLUP_LOOKBACK = 3600  # 每次汇总重新计算最近多少秒的时间段，用于计入补传的读数
+NOVA_SENSOR_DATA_PURGE_BATCH_SIZE = 5000  # 删除过期数据时每批的最大记录数
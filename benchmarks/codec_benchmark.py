@@ -0,0 +1,180 @@
+#!/usr/bin/env python
+"""
+NovaCloud 设备协议编解码基准测试
+对比各JSON编解码器与事件循环组合下，设备协议的解析/序列化开销和回环吞吐量（消息/秒）
+
+不访问数据库：服务端只做与 run_tcp_server 相同的逐行读取、解析、生成确认并drain。
+
+使用方法:
+python benchmarks/codec_benchmark.py [--messages 20000] [--connections 4] [--json results.json]
+"""
+
+import argparse
+import asyncio
+import json
+import sys
+import time
+from pathlib import Path
+
+# 将项目根目录添加到Python路径，以便导入 communication_handler
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from communication_handler.codec import CODEC_PREFERENCE, get_codec  # noqa: E402
+
+SAMPLE_MESSAGE = {
+    "type": "data",
+    "timestamp": 1700000000,
+    "payload": {
+        "temperature": 23.4,
+        "humidity": 51.2,
+        "light_level": 734,
+        "motion_detected": False,
+        "status_message": "正常运行",
+    },
+}
+SAMPLE_ACK = {"status": "ok", "message": "数据已接收并存储，处理了5个传感器读数"}
+
+
+def parse_args():
+    """解析命令行参数"""
+    parser = argparse.ArgumentParser(description='NovaCloud 设备协议编解码基准测试')
+    parser.add_argument('--iterations', type=int, default=100000,
+                        help='纯编解码测试的循环次数 (默认: 100000)')
+    parser.add_argument('--messages', type=int, default=20000,
+                        help='回环测试中每个连接发送的消息数 (默认: 20000)')
+    parser.add_argument('--connections', type=int, default=4,
+                        help='回环测试的并发连接数 (默认: 4)')
+    parser.add_argument('--json', type=str, default=None,
+                        help='将结果以JSON格式写入指定文件')
+    return parser.parse_args()
+
+
+def available_codecs():
+    """返回已安装的编解码器名称"""
+    names = []
+    for name in CODEC_PREFERENCE:
+        codec = get_codec(name)
+        if codec.name == name:
+            names.append(name)
+    return names
+
+
+def available_loops():
+    """返回可用的事件循环名称"""
+    loops = ['asyncio']
+    try:
+        import uvloop  # noqa: F401
+        loops.append('uvloop')
+    except ImportError:
+        pass
+    return loops
+
+
+def set_loop_policy(loop_name):
+    """切换事件循环策略"""
+    if loop_name == 'uvloop':
+        import uvloop
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    else:
+        asyncio.set_event_loop_policy(None)
+
+
+def bench_codec(codec, iterations):
+    """测量单条消息的解析和确认序列化耗时"""
+    line = codec.dumps(SAMPLE_MESSAGE)
+
+    start = time.perf_counter()
+    for _ in range(iterations):
+        codec.loads(line)
+    loads_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for _ in range(iterations):
+        codec.dumps(SAMPLE_ACK) + b'\n'
+    dumps_seconds = time.perf_counter() - start
+
+    return {
+        'codec': codec.name,
+        'loads_us': round(loads_seconds / iterations * 1e6, 3),
+        'dumps_us': round(dumps_seconds / iterations * 1e6, 3),
+    }
+
+
+async def run_loopback(codec, messages, connections):
+    """在回环地址上启动最小化的协议服务端并测量吞吐量"""
+
+    async def handle(reader, writer):
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            payload = codec.loads(line)
+            if payload.get("type") == "data":
+                writer.write(codec.dumps(SAMPLE_ACK) + b'\n')
+                await writer.drain()
+        writer.close()
+
+    server = await asyncio.start_server(handle, '127.0.0.1', 0)
+    port = server.sockets[0].getsockname()[1]
+    line = codec.dumps(SAMPLE_MESSAGE) + b'\n'
+
+    async def client():
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        # 每批发送后等待对应数量的确认，模拟设备端的有限流水线
+        window = 100
+        sent = 0
+        while sent < messages:
+            count = min(window, messages - sent)
+            writer.write(line * count)
+            await writer.drain()
+            for _ in range(count):
+                await reader.readline()
+            sent += count
+        writer.close()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(connections)))
+    elapsed = time.perf_counter() - start
+
+    server.close()
+    await server.wait_closed()
+    return messages * connections / elapsed
+
+
+def main():
+    """主函数"""
+    args = parse_args()
+    codecs = available_codecs()
+    loops = available_loops()
+
+    print(f"可用编解码器: {', '.join(codecs)}；可用事件循环: {', '.join(loops)}")
+    print("\n===== 编解码开销（微秒/条） =====")
+    codec_results = []
+    for name in codecs:
+        result = bench_codec(get_codec(name), args.iterations)
+        codec_results.append(result)
+        print(f"{name:<8} 解析: {result['loads_us']:>8.3f}  确认序列化: {result['dumps_us']:>8.3f}")
+
+    print(f"\n===== 回环吞吐量（{args.connections} 个连接 × {args.messages} 条消息） =====")
+    loopback_results = []
+    for loop_name in loops:
+        for name in codecs:
+            set_loop_policy(loop_name)
+            rate = asyncio.run(run_loopback(get_codec(name), args.messages, args.connections))
+            loopback_results.append({'loop': loop_name, 'codec': name, 'messages_per_sec': round(rate)})
+            print(f"{loop_name:<8} + {name:<8} {rate:>12,.0f} 消息/秒")
+    set_loop_policy('asyncio')
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({
+                'benchmark': 'codec',
+                'python': sys.version.split()[0],
+                'codec': codec_results,
+                'loopback': loopback_results,
+            }, f, ensure_ascii=False, indent=2)
+        print(f"\n结果已写入 {args.json}")
+
+
+if __name__ == "__main__":
+    main()
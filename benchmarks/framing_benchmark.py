@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+"""
+NovaCloud 设备协议帧格式基准测试
+对比换行分隔JSON与长度前缀 MessagePack/CBOR 帧的每个样本字节数和解析开销
+
+JSON帧以 value_key 作为读数的键；二进制帧以传感器序号作为键，与 run_tcp_server 的处理方式一致，
+解析开销包含二进制帧的序号到 value_key 的转换。
+
+使用方法:
+python benchmarks/framing_benchmark.py [--iterations 20000] [--batch-size 100] [--json results.json]
+"""
+
+import argparse
+import json
+import sys
+import time
+from pathlib import Path
+
+# 将项目根目录添加到Python路径，以便导入 communication_handler
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from communication_handler.codec import get_codec  # noqa: E402
+from communication_handler.framing import (  # noqa: E402
+    BINARY_FRAMING_CLASSES, FRAMING_JSON, LineFraming, available_framings
+)
+from communication_handler.protocol import resolve_batch_samples, resolve_sensor_keys  # noqa: E402
+
+SENSOR_KEYS = ("temperature", "humidity", "light_level", "motion_detected")
+SAMPLE_READINGS = (23.4, 51.2, 734, False)
+
+
+def parse_args():
+    """解析命令行参数"""
+    parser = argparse.ArgumentParser(description='NovaCloud 设备协议帧格式基准测试')
+    parser.add_argument('--iterations', type=int, default=20000,
+                        help='每种消息的解析循环次数 (默认: 20000)')
+    parser.add_argument('--batch-size', type=int, default=100,
+                        help='data_batch 消息中的样本数 (默认: 100)')
+    parser.add_argument('--json', type=str, default=None,
+                        help='将结果以JSON格式写入指定文件')
+    return parser.parse_args()
+
+
+def build_messages(binary, batch_size):
+    """构造单条 data 消息和 data_batch 消息，二进制帧以传感器序号为键"""
+    keys = range(len(SENSOR_KEYS)) if binary else SENSOR_KEYS
+    payload = dict(zip(keys, SAMPLE_READINGS))
+    data = {"type": "data", "timestamp": 1700000000, "payload": payload}
+    batch = {
+        "type": "data_batch",
+        "samples": [{"timestamp": 1700000000 + i, "payload": payload} for i in range(batch_size)],
+    }
+    return data, batch
+
+
+def bench_framing(framing, iterations, batch_size):
+    """测量帧大小和 解析 + 键转换 的耗时"""
+    data, batch = build_messages(framing.binary, batch_size)
+    results = {'framing': framing.name}
+    for label, message, samples in (('data', data, 1), ('data_batch', batch, batch_size)):
+        frame = framing.encode(message)
+        body = frame if not framing.binary else frame[4:]
+        batch_iterations = max(1, iterations // samples)
+
+        start = time.perf_counter()
+        for _ in range(batch_iterations):
+            decoded = framing.decode(body)
+            if framing.binary:
+                if label == 'data':
+                    resolve_sensor_keys(decoded["payload"], SENSOR_KEYS)
+                else:
+                    resolve_batch_samples(decoded["samples"], SENSOR_KEYS)
+        elapsed = time.perf_counter() - start
+
+        results[label] = {
+            'frame_bytes': len(frame),
+            'bytes_per_sample': round(len(frame) / samples, 1),
+            'parse_us_per_sample': round(elapsed / batch_iterations / samples * 1e6, 3),
+        }
+    return results
+
+
+def main():
+    """主函数"""
+    args = parse_args()
+    codec = get_codec('auto')
+    framings = [LineFraming(codec)]
+    framings += [BINARY_FRAMING_CLASSES[name]() for name in available_framings() if name != FRAMING_JSON]
+
+    print(f"JSON编解码器: {codec.name}；可用帧格式: {', '.join(framing.name for framing in framings)}")
+    print(f"\n===== 每个样本的字节数 / 解析开销（微秒），data_batch 含 {args.batch_size} 个样本 =====")
+    results = []
+    for framing in framings:
+        result = bench_framing(framing, args.iterations, args.batch_size)
+        results.append(result)
+        for label in ('data', 'data_batch'):
+            item = result[label]
+            print(f"{framing.name:<8} {label:<11} {item['bytes_per_sample']:>8.1f} 字节/样本  "
+                  f"{item['parse_us_per_sample']:>8.3f} 微秒/样本")
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({
+                'benchmark': 'framing',
+                'python': sys.version.split()[0],
+                'json_codec': codec.name,
+                'results': results,
+            }, f, ensure_ascii=False, indent=2)
+        print(f"\n结果已写入 {args.json}")
+
+
+if __name__ == "__main__":
+    main()
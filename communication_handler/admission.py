@@ -0,0 +1,64 @@
+"""
+握手准入控制模块 - 限制同时进行的设备认证数量，服务器重启后设备集中重连时平滑恢复
+"""
+
+import asyncio
+import contextlib
+import random
+
+
+class HandshakeRejected(Exception):
+    """握手排队已满或等待超时，设备应在 retry_after_ms 毫秒后重试"""
+
+    def __init__(self, retry_after_ms):
+        super().__init__(f"服务器繁忙，请在{retry_after_ms}毫秒后重试")
+        self.retry_after_ms = retry_after_ms
+
+
+class HandshakeAdmission:
+    """
+    握手准入控制器
+
+    最多允许 max_concurrent 个需要访问数据库的认证同时进行，其余的排队等待；
+    排队数超过 max_waiting 或等待超过 max_wait 秒时拒绝，并给出带随机抖动的重试间隔，
+    使被拒绝的设备错开重连时间。max_concurrent 为0时不限制。
+    """
+
+    def __init__(self, max_concurrent=100, max_wait=2.0, max_waiting=5000, retry_after_ms=1000):
+        self.max_concurrent = max_concurrent
+        self.max_wait = max_wait
+        self.max_waiting = max_waiting
+        self.retry_after_ms = retry_after_ms
+        self.waiting = 0
+        self._semaphore = asyncio.Semaphore(max_concurrent) if max_concurrent else None
+
+    def retry_after(self):
+        """返回建议的重试间隔（毫秒），在基准值的1~2倍之间随机"""
+        return int(self.retry_after_ms * random.uniform(1, 2))
+
+    @contextlib.asynccontextmanager
+    async def slot(self):
+        """
+        占用一个握手名额
+
+        Raises:
+            HandshakeRejected: 排队已满或等待超时
+        """
+        if self._semaphore is None:
+            yield
+            return
+
+        if self._semaphore.locked() and self.waiting >= self.max_waiting:
+            raise HandshakeRejected(self.retry_after())
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), self.max_wait)
+        except asyncio.TimeoutError:
+            raise HandshakeRejected(self.retry_after())
+        finally:
+            self.waiting -= 1
+
+        try:
+            yield
+        finally:
+            self._semaphore.release()
@@ -17,6 +17,9 @@ class CommunicationHandlerConfig(AppConfig):
         注意：Django开发服务器会调用ready()两次，一次是检查模型，一次是实际启动
         所以需要检查是否是主进程
         """
+        # 导入信号模块以注册设备注册表的失效处理器
+        import communication_handler.signals
+
         # 检查是否是Django的主进程
         if os.environ.get('RUN_MAIN') != 'true' and 'runserver' in sys.argv:
             return
@@ -0,0 +1,127 @@
+"""
+设备认证缓存模块 - 在TCP服务器进程内缓存设备密钥摘要，设备重连时无需逐个查询数据库
+
+缓存只保存以 SECRET_KEY 为密钥的 HMAC-SHA256 摘要，不保存明文密钥；比较使用恒定时间算法。
+"""
+
+import hashlib
+import hmac
+import logging
+import threading
+import time
+
+from django.conf import settings
+
+from iot_devices.models import Device
+
+# 配置日志记录器
+logger = logging.getLogger(__name__)
+
+# 预加载时每次从数据库读取的设备数
+PRELOAD_CHUNK_SIZE = 2000
+
+
+def key_digest(device_key):
+    """计算设备密钥的HMAC摘要"""
+    return hmac.new(settings.SECRET_KEY.encode(), str(device_key).encode(), hashlib.sha256).digest()
+
+
+class AuthCache:
+    """
+    进程内的设备认证缓存
+
+    device_id -> (密钥摘要, 缓存时间)。不存在的设备ID以较短的 negative_ttl 缓存，
+    避免错误配置的设备反复重连时每次都查询数据库。
+    Device 的 post_save/post_delete 信号会使对应条目失效，Web进程中的修改依靠 ttl 过期；
+    TCP服务器在设备注册表条目过期、重新加载设备时会用最新的密钥更新缓存，旧密钥实际最多在注册表的 ttl 内有效。
+    已经认证的连接不受密钥变化影响，直到断开。
+    """
+
+    def __init__(self, ttl=300, negative_ttl=30, max_negative=10000):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_negative = max_negative
+        self._digests = {}
+        self._missing = {}
+        self._lock = threading.Lock()
+
+    def verify(self, device_id, device_key):
+        """
+        使用缓存验证设备凭据，不访问数据库
+
+        Returns:
+            bool: 缓存命中时返回验证结果；未缓存或已过期时返回None，需要查询数据库
+        """
+        key = str(device_id)
+        candidate = key_digest(device_key)
+        now = time.monotonic()
+        with self._lock:
+            cached = self._digests.get(key)
+            if cached is not None:
+                digest, cached_at = cached
+                if not self.ttl or now - cached_at <= self.ttl:
+                    return hmac.compare_digest(digest, candidate)
+                del self._digests[key]
+                return None
+            missing_at = self._missing.get(key)
+            if missing_at is not None:
+                if now - missing_at <= self.negative_ttl:
+                    return False
+                del self._missing[key]
+        return None
+
+    def store(self, device_id, device_key):
+        """缓存设备密钥摘要"""
+        key = str(device_id)
+        digest = key_digest(device_key)
+        with self._lock:
+            self._digests[key] = (digest, time.monotonic())
+            self._missing.pop(key, None)
+
+    def store_missing(self, device_id):
+        """记录不存在的设备ID"""
+        with self._lock:
+            if len(self._missing) >= self.max_negative:
+                # 防止大量随机设备ID导致内存增长
+                self._missing.clear()
+            self._missing[str(device_id)] = time.monotonic()
+
+    def preload(self, queryset=None):
+        """
+        批量加载设备密钥摘要，用于服务器启动时应对大量设备同时重连
+
+        Args:
+            queryset: 要加载的设备，默认为全部设备
+
+        Returns:
+            int: 加载的设备数
+        """
+        queryset = Device.objects.all() if queryset is None else queryset
+        count = 0
+        for device_id, device_key in queryset.values_list('device_id', 'device_key').iterator(chunk_size=PRELOAD_CHUNK_SIZE):
+            self.store(device_id, device_key)
+            count += 1
+        return count
+
+    def invalidate(self, device_id):
+        """使单个设备的条目失效"""
+        key = str(device_id)
+        with self._lock:
+            self._digests.pop(key, None)
+            self._missing.pop(key, None)
+
+    def clear(self):
+        """清空缓存"""
+        with self._lock:
+            self._digests.clear()
+            self._missing.clear()
+
+    def __len__(self):
+        return len(self._digests)
+
+
+# 进程级单例，供TCP服务器和信号处理器共享
+auth_cache = AuthCache(
+    ttl=getattr(settings, 'NOVA_TCP_AUTH_CACHE_TTL', 300),
+    negative_ttl=getattr(settings, 'NOVA_TCP_AUTH_NEGATIVE_TTL', 30),
+)
@@ -0,0 +1,268 @@
+"""
+进程内消息总线模块 - TCP服务器写入传感器数据后发布读数事件，由各消费者按批异步处理
+
+每个消费者有独立的有界队列和处理任务：发布只是把事件追加到队列中，从不等待消费者；
+可以容忍丢失的消费者处理不过来时丢弃最旧的事件并计数，因此慢消费者不会拖慢设备数据的读取和写入。
+不能丢失事件的消费者（lossless为True，如派发post_save信号的消费者）的队列不丢弃事件，
+积压达到上限时由写入方通过 wait_for_capacity() 等待，背压最终传递到设备的确认上。
+外部消息代理（如MQTT、Kafka、Redis Streams）通过实现 BrokerAdapter 接入，
+在 settings.NOVA_TCP_BUS_ADAPTERS 中配置适配器类的路径即可。
+"""
+
+import asyncio
+import collections
+import logging
+from typing import Any, NamedTuple
+
+from django.core.cache import cache
+from django.utils.module_loading import import_string
+
+# 配置日志记录器
+logger = logging.getLogger(__name__)
+
+# 最新值缓存的键，值为 (时间戳, 读数)
+LATEST_VALUE_CACHE_KEY = 'nova:sensor_latest:{sensor_id}'
+
+
+class SensorEvent(NamedTuple):
+    """一条已写入数据库的传感器读数"""
+
+    sensor_id: int
+    timestamp: Any  # datetime
+    value: Any
+    # 是否为实时数据；补传的历史数据为False，不触发策略引擎
+    live: bool = True
+    # 进程内的SensorData实例，不会发送给外部代理
+    record: Any = None
+
+    @classmethod
+    def from_record(cls, record, live=True):
+        return cls(record.sensor_id, record.timestamp, record.get_value(), live, record)
+
+    def to_message(self):
+        """转换为可序列化的字典，用于发送给外部代理"""
+        return {
+            "sensor_id": self.sensor_id,
+            "timestamp": self.timestamp.isoformat(),
+            "value": self.value,
+            "live": self.live,
+        }
+
+
+class BusConsumer:
+    """
+    消费者基类
+
+    子类实现 handle()，每次收到最多 batch_size 条事件；live_only 为True时只接收实时数据。
+    lossless 为True时队列满后不丢弃事件，而是让写入方等待消费者追上。
+    handle() 在事件循环中执行，需要访问数据库或其他阻塞操作时应交给数据库执行器或线程池。
+    """
+
+    name = 'consumer'
+    batch_size = 500
+    live_only = False
+    lossless = False
+
+    async def handle(self, events):
+        raise NotImplementedError
+
+    async def close(self):
+        """总线停止时调用，用于释放连接等资源"""
+
+
+class _Subscription:
+    __slots__ = ('consumer', 'queue', 'ready', 'writable', 'task')
+
+    def __init__(self, consumer, max_queue):
+        self.consumer = consumer
+        # 不可丢失的消费者不限制队列长度，积压由 MessageBus.wait_for_capacity() 控制
+        self.queue = collections.deque(maxlen=None if consumer.lossless else max_queue)
+        self.ready = asyncio.Event()
+        self.writable = asyncio.Event()
+        self.writable.set()
+        self.task = None
+
+
+class MessageBus:
+    """
+    进程内发布/订阅总线
+
+    只在事件循环线程中使用。publish() 是同步的，开销为每个消费者一次队列追加。
+    """
+
+    def __init__(self, max_queue=10000, stats=None):
+        self.max_queue = max_queue
+        self.stats = stats
+        self._subscriptions = []
+        self._closing = False
+
+    def subscribe(self, consumer):
+        """注册消费者，需在 start() 之前调用"""
+        self._subscriptions.append(_Subscription(consumer, self.max_queue))
+
+    async def start(self):
+        """为每个消费者启动处理任务"""
+        for subscription in self._subscriptions:
+            subscription.task = asyncio.create_task(self._drain(subscription))
+
+    async def close(self):
+        """处理完队列中剩余的事件后停止"""
+        self._closing = True
+        for subscription in self._subscriptions:
+            subscription.ready.set()
+        for subscription in self._subscriptions:
+            if subscription.task is not None:
+                await subscription.task
+            try:
+                await subscription.consumer.close()
+            except Exception as e:
+                logger.error(f"关闭消费者 {subscription.consumer.name} 时出错: {e}")
+
+    async def wait_for_capacity(self):
+        """
+        等待所有不可丢失事件的消费者积压降到 max_queue 以下
+
+        写入方在写入下一批数据前调用，使发布的事件不超过消费者的处理能力。
+        每次调用最多多发布一批事件，因此队列长度不会超过 max_queue 加一批的大小。
+        """
+        for subscription in self._subscriptions:
+            if not subscription.consumer.lossless:
+                continue
+            if len(subscription.queue) >= self.max_queue and self.stats is not None:
+                self.stats.incr('bus_backpressure')
+            while len(subscription.queue) >= self.max_queue and subscription.task is not None:
+                subscription.writable.clear()
+                await subscription.writable.wait()
+
+    @property
+    def backlog(self):
+        """各消费者队列中等待处理的事件总数"""
+        return sum(len(subscription.queue) for subscription in self._subscriptions)
+
+    def publish(self, events):
+        """
+        发布一批事件，不等待任何消费者
+
+        Args:
+            events: SensorEvent 列表
+        """
+        if not events or self._closing:
+            return
+        live_events = None
+        for subscription in self._subscriptions:
+            if subscription.consumer.live_only:
+                if live_events is None:
+                    live_events = [event for event in events if event.live]
+                batch = live_events
+            else:
+                batch = events
+            if not batch:
+                continue
+            queue = subscription.queue
+            overflow = len(queue) + len(batch) - self.max_queue
+            queue.extend(batch)
+            if overflow > 0 and not subscription.consumer.lossless:
+                # deque 达到 maxlen 后自动丢弃最旧的事件
+                if self.stats is not None:
+                    self.stats.incr('bus_dropped', overflow)
+            subscription.ready.set()
+        if self.stats is not None:
+            self.stats.incr('bus_published', len(events))
+
+    async def _drain(self, subscription):
+        """按批取出事件交给消费者处理"""
+        consumer = subscription.consumer
+        queue = subscription.queue
+        while True:
+            await subscription.ready.wait()
+            subscription.ready.clear()
+            while queue:
+                batch = [queue.popleft() for _ in range(min(len(queue), consumer.batch_size))]
+                if len(queue) < self.max_queue:
+                    subscription.writable.set()
+                try:
+                    await consumer.handle(batch)
+                except Exception as e:
+                    if self.stats is not None:
+                        self.stats.incr('errors')
+                    logger.error(f"消费者 {consumer.name} 处理 {len(batch)} 条事件时出错: {e}")
+            if self._closing:
+                return
+
+
+class LatestValueConsumer(BusConsumer):
+    """
+    维护每个传感器的最新读数，并写入Django缓存
+
+    配置了Redis等共享缓存后，Web进程可以按 LATEST_VALUE_CACHE_KEY 读取最新值而不查询SensorData表。
+    """
+
+    name = 'latest_values'
+
+    def __init__(self, executor, timeout=None):
+        self.executor = executor
+        self.timeout = timeout
+        self.latest = {}  # 传感器ID -> (时间戳, 读数)
+
+    async def handle(self, events):
+        changed = {}
+        for event in events:
+            current = self.latest.get(event.sensor_id)
+            if current is None or event.timestamp >= current[0]:
+                self.latest[event.sensor_id] = changed[event.sensor_id] = (event.timestamp, event.value)
+        if changed:
+            await self.executor.run(cache.set_many, {
+                LATEST_VALUE_CACHE_KEY.format(sensor_id=sensor_id): latest
+                for sensor_id, latest in changed.items()
+            }, self.timeout)
+
+
+class BrokerAdapter:
+    """
+    外部消息代理适配器接口
+
+    子类实现 publish()，将一批消息（SensorEvent.to_message() 的结果）发送到外部代理。
+    构造时不传参数，连接信息应从 settings 中读取。
+    """
+
+    name = 'broker'
+
+    async def publish(self, messages):
+        raise NotImplementedError
+
+    async def close(self):
+        """释放与外部代理的连接"""
+
+
+class BrokerConsumer(BusConsumer):
+    """将事件转发给外部消息代理适配器"""
+
+    def __init__(self, adapter, batch_size=500):
+        self.adapter = adapter
+        self.name = f'broker:{adapter.name}'
+        self.batch_size = batch_size
+
+    async def handle(self, events):
+        await self.adapter.publish([event.to_message() for event in events])
+
+    async def close(self):
+        await self.adapter.close()
+
+
+def load_broker_consumers(adapter_paths):
+    """
+    按类路径加载外部消息代理适配器
+
+    Args:
+        adapter_paths: BrokerAdapter 子类的导入路径列表
+
+    Returns:
+        list: BrokerConsumer 列表，加载失败的适配器会被跳过并记录错误
+    """
+    consumers = []
+    for path in adapter_paths:
+        try:
+            consumers.append(BrokerConsumer(import_string(path)()))
+        except Exception as e:
+            logger.error(f"加载消息代理适配器 {path} 时出错: {e}")
+    return consumers
@@ -0,0 +1,125 @@
+"""
+设备协议编解码模块 - 可插拔的JSON编解码器和事件循环选择
+
+安装了 orjson 或 ujson 时优先使用，否则回退到标准库 json；
+安装了 uvloop 时可选用 uvloop 事件循环。
+"""
+
+import asyncio
+import json
+import logging
+
+# 配置日志记录器
+logger = logging.getLogger(__name__)
+
+# 'auto' 时按此顺序选择第一个可用的编解码器
+CODEC_PREFERENCE = ('orjson', 'ujson', 'json')
+CODEC_CHOICES = ('auto',) + CODEC_PREFERENCE
+EVENT_LOOP_CHOICES = ('auto', 'uvloop', 'asyncio')
+
+
+class JsonCodec:
+    """
+    标准库 json 编解码器
+
+    所有编解码器都满足相同的约定：
+    - loads() 接受 bytes 或 str，解析失败时抛出 json.JSONDecodeError
+    - dumps() 返回 UTF-8 编码的 bytes
+    """
+
+    name = 'json'
+
+    def loads(self, data):
+        return json.loads(data)
+
+    def dumps(self, obj):
+        return json.dumps(obj).encode()
+
+
+class OrjsonCodec(JsonCodec):
+    """orjson 编解码器，直接解析和输出 bytes"""
+
+    name = 'orjson'
+
+    def __init__(self):
+        import orjson
+        self._orjson = orjson
+
+    def loads(self, data):
+        # orjson.JSONDecodeError 是 json.JSONDecodeError 的子类
+        return self._orjson.loads(data)
+
+    def dumps(self, obj):
+        return self._orjson.dumps(obj)
+
+
+class UjsonCodec(JsonCodec):
+    """ujson 编解码器"""
+
+    name = 'ujson'
+
+    def __init__(self):
+        import ujson
+        self._ujson = ujson
+
+    def loads(self, data):
+        try:
+            return self._ujson.loads(data)
+        except ValueError as e:
+            # 统一为 json.JSONDecodeError，调用方无需区分编解码器
+            doc = data.decode(errors='replace') if isinstance(data, bytes) else data
+            raise json.JSONDecodeError(str(e), doc, 0) from e
+
+    def dumps(self, obj):
+        return self._ujson.dumps(obj).encode()
+
+
+CODEC_CLASSES = {
+    'orjson': OrjsonCodec,
+    'ujson': UjsonCodec,
+    'json': JsonCodec,
+}
+
+
+def get_codec(name='auto'):
+    """
+    获取JSON编解码器
+
+    Args:
+        name: 'auto'、'orjson'、'ujson' 或 'json'
+
+    Returns:
+        JsonCodec: 编解码器实例；指定的库未安装时回退到标准库并记录警告
+    """
+    candidates = CODEC_PREFERENCE if name == 'auto' else (name,)
+    for candidate in candidates:
+        try:
+            return CODEC_CLASSES[candidate]()
+        except ImportError:
+            if name != 'auto':
+                logger.warning(f"JSON编解码器 {candidate} 未安装，回退到标准库 json")
+        except KeyError:
+            raise ValueError(f"未知的JSON编解码器: {candidate}")
+    return JsonCodec()
+
+
+def install_event_loop(name='auto'):
+    """
+    按配置安装事件循环策略，需在 asyncio.run() 之前调用
+
+    Args:
+        name: 'auto'（uvloop可用时使用）、'uvloop' 或 'asyncio'
+
+    Returns:
+        str: 实际使用的事件循环名称
+    """
+    if name == 'asyncio':
+        return 'asyncio'
+    try:
+        import uvloop
+    except ImportError:
+        if name == 'uvloop':
+            logger.warning("uvloop 未安装，使用标准 asyncio 事件循环")
+        return 'asyncio'
+    asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    return 'uvloop'
@@ -0,0 +1,112 @@
+"""
+执行器命令状态模块 - 读取待发送的命令，并批量写回 ActuatorCommandLog 的发送、确认、失败和超时状态
+
+ActuatorCommandLog 本身就是持久化的命令队列：未确认且未过期的命令在设备重新认证后会被重新发送。
+"""
+
+from datetime import timedelta
+
+from django.utils import timezone
+
+from iot_devices.models import ActuatorCommandLog
+
+from .presence import QUERY_CHUNK_SIZE, chunked
+
+# 尚未推送到设备的状态；策略引擎创建的命令日志使用 'pending'
+PENDING_STATUSES = ('pending_send', 'pending')
+# 设备重新认证后需要重新发送的状态，'sent' 表示已发送但设备未回复
+UNACKNOWLEDGED_STATUSES = PENDING_STATUSES + ('sent',)
+
+# 设备响应中的 status -> 命令日志状态；'pending' 表示设备仍在执行，只记录响应内容
+RESPONSE_STATUS_MAP = {
+    'success': 'acknowledged',
+    'error': 'failed',
+}
+
+# 设备重新认证时最多重新发送的命令数
+MAX_REPLAY_COMMANDS = 1000
+
+
+def load_pending_commands(device_id, ttl, limit=MAX_REPLAY_COMMANDS):
+    """
+    读取设备未确认且未过期的命令，按创建时间排序
+
+    Returns:
+        list: (命令ID, 命令内容, 创建时间) 列表
+    """
+    queryset = ActuatorCommandLog.objects.filter(
+        actuator__device__device_id=device_id,
+        status__in=UNACKNOWLEDGED_STATUSES,
+        acknowledged_at__isnull=True,
+    )
+    if ttl:
+        queryset = queryset.filter(created_at__gte=timezone.now() - timedelta(seconds=ttl))
+    return list(queryset.order_by('created_at', 'pk').values_list('pk', 'command_payload', 'created_at')[:limit])
+
+
+def apply_command_updates(sent, responses, expired):
+    """
+    批量写入命令状态，在数据库执行器的工作线程中调用
+
+    Args:
+        sent: {命令ID: 首次写入设备连接的时间}
+        responses: {命令ID: (设备ID, 设备回复的status, 响应时间, 响应内容)}
+        expired: 重试耗尽或超过有效期的命令ID集合
+
+    Returns:
+        tuple: (标记为已发送的数量, 记录的响应数量, 标记为超时的数量)
+    """
+    sent_count = response_count = expired_count = 0
+
+    for ids in chunked(list(sent)):
+        # 设备的响应可能先于本次写入，只修改仍处于待发送状态的记录的状态
+        sent_count += ActuatorCommandLog.objects.filter(
+            pk__in=ids, status__in=PENDING_STATUSES
+        ).update(status='sent')
+        unsent_ids = ActuatorCommandLog.objects.filter(pk__in=ids, sent_at__isnull=True).values_list('pk', flat=True)
+        ActuatorCommandLog.objects.bulk_update(
+            [ActuatorCommandLog(pk=pk, sent_at=sent[pk]) for pk in unsent_ids], ['sent_at']
+        )
+
+    if responses:
+        # 只接受设备对属于自己的命令的响应
+        owners = {}
+        for ids in chunked(list(responses)):
+            owners.update(ActuatorCommandLog.objects.filter(pk__in=ids).values_list('pk', 'actuator__device__device_id'))
+        finished, in_progress = [], []
+        for pk, (device_id, status, responded_at, payload) in responses.items():
+            if pk not in owners or str(owners[pk]) != str(device_id):
+                continue
+            log_status = RESPONSE_STATUS_MAP.get(status)
+            if log_status:
+                finished.append(ActuatorCommandLog(
+                    pk=pk, status=log_status, acknowledged_at=responded_at, response_payload=payload
+                ))
+            else:
+                in_progress.append(ActuatorCommandLog(pk=pk, response_payload=payload))
+        ActuatorCommandLog.objects.bulk_update(
+            finished, ['status', 'acknowledged_at', 'response_payload'], batch_size=QUERY_CHUNK_SIZE
+        )
+        ActuatorCommandLog.objects.bulk_update(in_progress, ['response_payload'], batch_size=QUERY_CHUNK_SIZE)
+        response_count = len(finished) + len(in_progress)
+
+    for ids in chunked(list(expired)):
+        expired_count += ActuatorCommandLog.objects.filter(
+            pk__in=ids, status__in=UNACKNOWLEDGED_STATUSES, acknowledged_at__isnull=True
+        ).update(status='timeout')
+
+    return sent_count, response_count, expired_count
+
+
+def expire_stale_commands(ttl):
+    """
+    将超过有效期仍未确认的命令标记为超时，包括设备一直未上线、从未发送的命令
+
+    Returns:
+        int: 标记为超时的数量
+    """
+    return ActuatorCommandLog.objects.filter(
+        status__in=UNACKNOWLEDGED_STATUSES,
+        acknowledged_at__isnull=True,
+        created_at__lt=timezone.now() - timedelta(seconds=ttl),
+    ).update(status='timeout')
@@ -0,0 +1,57 @@
+"""
+在线连接注册表模块 - 记录当前工作进程中每个已认证设备的连接，用于向设备推送命令
+"""
+
+import time
+
+
+class DeviceConnection:
+    """一个已认证的设备连接，send 按连接协商的帧格式发送消息"""
+
+    __slots__ = ('device_id', 'addr', 'send', 'connected_at')
+
+    def __init__(self, device_id, addr, send):
+        self.device_id = device_id
+        self.addr = addr
+        self.send = send
+        self.connected_at = time.time()
+
+
+class ConnectionRegistry:
+    """
+    设备连接注册表
+
+    device_id -> 该设备的连接列表。同一设备可能短暂存在多个连接（如设备重连时旧连接尚未超时），
+    推送命令时使用最近认证的连接。只在事件循环线程中访问，不需要加锁；
+    多进程模式下每个工作进程只记录自己接受的连接。
+    """
+
+    def __init__(self):
+        self._connections = {}
+
+    def register(self, connection):
+        """登记一个认证成功的连接"""
+        self._connections.setdefault(connection.device_id, []).append(connection)
+
+    def unregister(self, connection):
+        """移除已断开的连接"""
+        connections = self._connections.get(connection.device_id)
+        if not connections:
+            return
+        try:
+            connections.remove(connection)
+        except ValueError:
+            return
+        if not connections:
+            del self._connections[connection.device_id]
+
+    def get(self, device_id):
+        """返回设备最近认证的连接，设备不在本进程中在线时返回None"""
+        connections = self._connections.get(str(device_id))
+        return connections[-1] if connections else None
+
+    def __contains__(self, device_id):
+        return str(device_id) in self._connections
+
+    def __len__(self):
+        return len(self._connections)
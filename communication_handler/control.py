@@ -0,0 +1,344 @@
+"""
+本地控制通道模块 - Web进程和策略引擎通过本机控制通道，把执行器命令交给持有设备连接的TCP服务器工作进程
+
+控制地址为本机TCP地址（如 127.0.0.1:8101）或以 unix: 开头的Unix套接字路径（如 unix:/run/novacloud/control.sock）。
+多进程模式下每个工作进程监听自己的控制地址：TCP端口加上工作进程序号，Unix套接字路径加上 ".序号" 后缀；
+客户端依次询问各工作进程，由持有设备连接的进程将命令加入该设备的发送队列。
+请求和响应都是换行分隔的JSON，请求需携带由 SECRET_KEY 派生的令牌。
+
+TCP服务器工作进程内部（如数据入库时触发的策略引擎）不经过控制通道，通过 submit_local_command 直接交给本进程的命令分发器。
+"""
+
+import asyncio
+import functools
+import glob
+import hashlib
+import hmac
+import json
+import logging
+import os
+import socket
+import threading
+
+from django.conf import settings
+
+# 配置日志记录器
+logger = logging.getLogger(__name__)
+
+DEFAULT_CONTROL_ADDRESS = '127.0.0.1:8101'
+UNIX_PREFIX = 'unix:'
+# 客户端等待控制通道响应的最长时间（秒）
+CONTROL_TIMEOUT = getattr(settings, 'NOVA_TCP_CONTROL_TIMEOUT', 2.0)
+# 单条控制请求的最大字节数
+MAX_REQUEST_SIZE = 1024 * 1024
+
+# push_command 和 submit_local_command 的结果
+PUSH_QUEUED = 'queued'
+PUSH_SUBMITTED = 'submitted'
+PUSH_OFFLINE = 'offline'
+PUSH_UNAVAILABLE = 'unavailable'
+PUSH_MESSAGES = {
+    PUSH_QUEUED: "命令已提交，正在发送到设备",
+    PUSH_SUBMITTED: "命令已交给TCP服务器，设备在线时立即发送，否则在设备重新连接后发送",
+    PUSH_OFFLINE: "设备当前不在线，命令将在设备重新连接后发送",
+    PUSH_UNAVAILABLE: "暂时无法连接TCP服务器，命令将在设备重新连接后发送",
+}
+
+
+def control_token():
+    """由 SECRET_KEY 派生的控制通道令牌，Web进程与TCP服务器共享同一配置即可互相认证"""
+    return hmac.new(settings.SECRET_KEY.encode(), b'novacloud-tcp-control', hashlib.sha256).hexdigest()
+
+
+def worker_control_address(address, index):
+    """
+    返回工作进程监听的控制地址
+
+    Args:
+        address: 配置的控制地址
+        index: 工作进程序号，单进程模式为0
+    """
+    if address.startswith(UNIX_PREFIX):
+        return f'{address}.{index}'
+    host, port = address.rsplit(':', 1)
+    return f'{host}:{int(port) + index}'
+
+
+def control_endpoints(address, workers):
+    """
+    返回客户端需要询问的所有工作进程控制地址
+
+    Unix套接字按文件查找，TCP地址按配置的工作进程数依次递增端口
+    """
+    if address.startswith(UNIX_PREFIX):
+        path = address[len(UNIX_PREFIX):]
+        return [UNIX_PREFIX + found for found in sorted(glob.glob(glob.escape(path) + '.*'))]
+    return [worker_control_address(address, index) for index in range(max(1, workers))]
+
+
+def _open_socket(endpoint, timeout):
+    """连接到一个控制地址"""
+    if endpoint.startswith(UNIX_PREFIX):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(timeout)
+        try:
+            sock.connect(endpoint[len(UNIX_PREFIX):])
+        except OSError:
+            sock.close()
+            raise
+        return sock
+    host, port = endpoint.rsplit(':', 1)
+    sock = socket.create_connection((host, int(port)), timeout=timeout)
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    return sock
+
+
+class _ControlConnections(threading.local):
+    """每个线程复用到各控制地址的连接，fork出的子进程不继承父进程的连接"""
+
+    def __init__(self):
+        self.pid = os.getpid()
+        self.streams = {}  # 控制地址 -> (socket, 读取用的文件对象)
+
+    def get(self, endpoint, timeout):
+        if self.pid != os.getpid():
+            self.pid = os.getpid()
+            self.streams = {}
+        cached = self.streams.get(endpoint)
+        if cached is None:
+            sock = _open_socket(endpoint, timeout)
+            cached = self.streams[endpoint] = (sock, sock.makefile('rb'))
+        return cached
+
+    def discard(self, endpoint):
+        cached = self.streams.pop(endpoint, None)
+        if cached is not None:
+            cached[1].close()
+            cached[0].close()
+
+
+_control_connections = _ControlConnections()
+# device_id -> 最近一次接受该设备命令的控制地址，下次优先询问
+_device_routes = {}
+MAX_DEVICE_ROUTES = 10000
+
+
+def _request(endpoint, data, timeout):
+    """向一个控制地址发送请求并读取一行响应，复用的连接已失效时重新连接一次"""
+    for attempt in range(2):
+        reused = endpoint in _control_connections.streams
+        try:
+            sock, stream = _control_connections.get(endpoint, timeout)
+            sock.settimeout(timeout)
+            sock.sendall(data)
+            line = stream.readline(MAX_REQUEST_SIZE)
+            if not line:
+                raise ConnectionError("控制通道未返回响应")
+            return json.loads(line)
+        except (OSError, ValueError):
+            _control_connections.discard(endpoint)
+            if not reused or attempt:
+                raise
+
+
+def push_command(device_id, command_id, payload, created_at=None, address=None, workers=None, timeout=None,
+                 exclude=None):
+    """
+    通过控制通道将命令交给设备所在的TCP服务器工作进程，供Web进程和策略引擎调用（同步阻塞）
+
+    工作进程只把命令放入该设备的发送队列就立即返回，不等待写入设备或数据库；
+    到各工作进程的连接在线程内复用，并优先询问上次接受该设备命令的工作进程。
+
+    Args:
+        device_id: 设备的 device_id
+        command_id: ActuatorCommandLog 的主键，设备回复 command_response 时原样带回
+        payload: 命令内容
+        created_at: 命令创建时间（Unix时间戳），用于判断命令是否过期
+        address: 控制地址，默认为 settings.NOVA_TCP_CONTROL_ADDRESS
+        workers: TCP服务器的工作进程数，默认为 settings.NOVA_TCP_WORKERS
+        timeout: 每个控制地址的超时时间（秒）
+        exclude: 不需要询问的控制地址，如调用方所在工作进程自己的地址
+
+    Returns:
+        str: PUSH_QUEUED、PUSH_OFFLINE（所有工作进程都没有该设备的连接）或 PUSH_UNAVAILABLE（控制通道不可用）；
+            后两种情况下命令仍保留在数据库中，设备重新认证后发送
+    """
+    if address is None:
+        address = getattr(settings, 'NOVA_TCP_CONTROL_ADDRESS', DEFAULT_CONTROL_ADDRESS)
+    if not address:
+        return PUSH_UNAVAILABLE
+    if workers is None:
+        workers = getattr(settings, 'NOVA_TCP_WORKERS', 1)
+    device_key = str(device_id)
+    request = {
+        "token": control_token(),
+        "action": "command",
+        "device_id": device_key,
+        "command_id": command_id,
+        "payload": payload,
+    }
+    if created_at is not None:
+        request["created_at"] = created_at
+    data = json.dumps(request, ensure_ascii=False).encode() + b'\n'
+
+    endpoints = [endpoint for endpoint in control_endpoints(address, workers) if endpoint != exclude]
+    route = _device_routes.get(device_key)
+    if route in endpoints:
+        endpoints.remove(route)
+        endpoints.insert(0, route)
+
+    reachable = False
+    for endpoint in endpoints:
+        try:
+            response = _request(endpoint, data, timeout or CONTROL_TIMEOUT)
+        except (OSError, ValueError) as e:
+            logger.debug(f"控制地址 {endpoint} 不可用: {e}")
+            continue
+        reachable = True
+        status = response.get("status")
+        if status == PUSH_QUEUED:
+            if len(_device_routes) >= MAX_DEVICE_ROUTES:
+                _device_routes.clear()
+            _device_routes[device_key] = endpoint
+            return PUSH_QUEUED
+        if status != PUSH_OFFLINE:
+            logger.warning(f"控制地址 {endpoint} 拒绝了命令 {command_id}: {response.get('message')}")
+    return PUSH_OFFLINE if reachable else PUSH_UNAVAILABLE
+
+
+# 本进程作为TCP服务器工作进程运行时的 (命令分发器, 本进程的控制地址)
+_local_dispatcher = None
+
+
+def register_local_dispatcher(dispatcher, endpoint=None):
+    """
+    TCP服务器工作进程启动命令分发器后调用，本进程内提交的命令不再经过控制通道
+
+    Args:
+        dispatcher: CommandDispatcher
+        endpoint: 本进程监听的控制地址，控制通道未启动时为None
+    """
+    global _local_dispatcher
+    _local_dispatcher = (dispatcher, endpoint)
+
+
+def unregister_local_dispatcher():
+    """TCP服务器工作进程停止时调用"""
+    global _local_dispatcher
+    _local_dispatcher = None
+
+
+def submit_local_command(device_id, command_id, payload, created_at=None):
+    """
+    在TCP服务器工作进程内把命令交给本进程的命令分发器，不阻塞调用线程
+
+    策略引擎在数据入库的信号中触发时运行在数据库执行器的工作线程里，使用 push_command 会让该线程
+    等待各工作进程的控制通道响应（包括本进程自己）。这里通过事件循环把命令交给命令分发器后立即返回；
+    设备不在本进程在线时，由事件循环在线程池中用 push_command 询问其他工作进程。
+
+    Returns:
+        str: 已交给本进程的分发器时返回 PUSH_SUBMITTED；本进程不是TCP服务器工作进程时返回None，
+            调用方应改用 push_command
+    """
+    local = _local_dispatcher
+    if local is None:
+        return None
+    dispatcher, endpoint = local
+    fallback = None
+    if getattr(settings, 'NOVA_TCP_CONTROL_ADDRESS', DEFAULT_CONTROL_ADDRESS):
+        fallback = functools.partial(push_command, device_id, command_id, payload, created_at, exclude=endpoint)
+    if not dispatcher.submit_threadsafe(str(device_id), command_id, payload, created_at, fallback):
+        return None
+    return PUSH_SUBMITTED
+
+
+class ControlServer:
+    """
+    TCP服务器工作进程内的控制通道服务端
+
+    收到命令请求后交给命令分发器，设备在本进程在线时加入其发送队列。
+    """
+
+    def __init__(self, dispatcher):
+        self.dispatcher = dispatcher
+        self._token = control_token().encode()
+        self._server = None
+        self._unix_path = None
+
+    async def start(self, address, index=0):
+        """
+        开始监听控制地址
+
+        Returns:
+            str: 实际监听的控制地址
+        """
+        endpoint = worker_control_address(address, index)
+        if endpoint.startswith(UNIX_PREFIX):
+            path = endpoint[len(UNIX_PREFIX):]
+            # 工作进程重启时清理上一次遗留的套接字文件
+            if os.path.exists(path):
+                os.unlink(path)
+            self._server = await asyncio.start_unix_server(self.handle_connection, path=path, limit=MAX_REQUEST_SIZE)
+            # 只允许运行TCP服务器的用户连接
+            os.chmod(path, 0o600)
+            self._unix_path = path
+        else:
+            host, port = endpoint.rsplit(':', 1)
+            self._server = await asyncio.start_server(self.handle_connection, host, int(port), limit=MAX_REQUEST_SIZE)
+        return endpoint
+
+    async def close(self):
+        """停止监听并删除Unix套接字文件"""
+        if self._server is None:
+            return
+        self._server.close()
+        await self._server.wait_closed()
+        self._server = None
+        if self._unix_path:
+            try:
+                os.unlink(self._unix_path)
+            except OSError:
+                pass
+            self._unix_path = None
+
+    async def handle_connection(self, reader, writer):
+        """处理一个控制连接，客户端会在同一连接上依次发送多条请求"""
+        try:
+            while True:
+                try:
+                    line = await reader.readline()
+                except ValueError:
+                    break
+                if not line:
+                    break
+                try:
+                    response = self.handle_request(json.loads(line))
+                except (TypeError, ValueError) as e:
+                    response = {"status": "error", "message": f"无效的控制请求: {e}"}
+                writer.write(json.dumps(response, ensure_ascii=False).encode() + b'\n')
+                await writer.drain()
+        except (ConnectionError, OSError):
+            pass
+        finally:
+            writer.close()
+
+    def handle_request(self, request):
+        """处理一条控制请求并返回响应"""
+        if not isinstance(request, dict):
+            raise ValueError("控制请求必须是JSON对象")
+        token = str(request.get("token", "")).encode()
+        if not hmac.compare_digest(token, self._token):
+            logger.warning("控制通道收到令牌无效的请求")
+            return {"status": "error", "message": "令牌无效"}
+        if request.get("action") != "command":
+            return {"status": "error", "message": f"未知操作: {request.get('action')}"}
+
+        command_id = int(request.get("command_id"))
+        created_at = request.get("created_at")
+        queued = self.dispatcher.enqueue(
+            request.get("device_id"),
+            command_id,
+            request.get("payload") or {},
+            float(created_at) if created_at is not None else None
+        )
+        return {"status": PUSH_QUEUED if queued else PUSH_OFFLINE}
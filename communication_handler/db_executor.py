@@ -0,0 +1,106 @@
+"""
+数据库执行器模块 - 为TCP服务器提供固定数量的数据库工作线程和有界任务队列
+"""
+
+import asyncio
+import logging
+import queue
+import threading
+
+from django.db import connections, DatabaseError
+
+# 配置日志记录器
+logger = logging.getLogger(__name__)
+
+
+class DatabaseExecutor:
+    """
+    TCP服务器的数据库执行器
+
+    每个工作线程持有自己的数据库连接并在整个生命周期内复用，线程退出时关闭。
+    排队和执行中的任务总数受 max_queue 限制，队列满时 run() 会挂起调用方，
+    从而让连接处理协程暂停读取套接字，将压力反馈给设备端。
+    """
+
+    def __init__(self, workers=4, max_queue=1000, name='nova-db'):
+        self.workers = max(1, workers)
+        self.max_queue = max(1, max_queue)
+        self.name = name
+        self._queue = queue.SimpleQueue()
+        self._threads = []
+        self._slots = None
+        self._in_flight = 0
+
+    def start(self):
+        """启动工作线程"""
+        self._slots = asyncio.Semaphore(self.max_queue)
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._worker, name=f'{self.name}-{i}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    async def shutdown(self):
+        """等待已提交的任务完成后停止所有工作线程"""
+        for _ in self._threads:
+            self._queue.put(None)
+        loop = asyncio.get_running_loop()
+        for thread in self._threads:
+            await loop.run_in_executor(None, thread.join)
+        self._threads = []
+
+    @property
+    def queue_depth(self):
+        """已提交但尚未开始执行的任务数"""
+        return self._queue.qsize()
+
+    @property
+    def pending(self):
+        """排队和执行中的任务总数"""
+        return self._in_flight
+
+    async def run(self, func, *args, **kwargs):
+        """
+        在数据库工作线程中执行同步函数并等待结果
+
+        队列已满时在此处等待空位。
+        """
+        await self._slots.acquire()
+        self._in_flight += 1
+        try:
+            loop = asyncio.get_running_loop()
+            future = loop.create_future()
+            self._queue.put((func, args, kwargs, loop, future))
+            return await future
+        finally:
+            self._in_flight -= 1
+            self._slots.release()
+
+    def _worker(self):
+        """工作线程主循环"""
+        try:
+            while True:
+                item = self._queue.get()
+                if item is None:
+                    break
+                func, args, kwargs, loop, future = item
+                try:
+                    result = func(*args, **kwargs)
+                except BaseException as e:
+                    if isinstance(e, DatabaseError):
+                        # 连接可能已损坏，关闭后由下一个任务重新建立
+                        connections.close_all()
+                    loop.call_soon_threadsafe(self._reject, future, e)
+                else:
+                    loop.call_soon_threadsafe(self._resolve, future, result)
+        finally:
+            connections.close_all()
+
+    @staticmethod
+    def _resolve(future, result):
+        if not future.done():
+            future.set_result(result)
+
+    @staticmethod
+    def _reject(future, exc):
+        if not future.done():
+            future.set_exception(exc)
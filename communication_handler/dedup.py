@@ -0,0 +1,74 @@
+"""
+读数死区压缩模块 - 按传感器配置的死区省略重复读数，减少SensorData的写入量
+
+每个传感器最后一条已存储读数的时间和值保存在TCP服务器进程的内存中。服务器重启或设备连接到
+另一个工作进程后，该传感器的第一条读数总会被存储，因此不会丢失变化，只是少压缩一条。
+"""
+
+import logging
+
+# 配置日志记录器
+logger = logging.getLogger(__name__)
+
+
+class DeadbandFilter:
+    """
+    死区过滤器
+
+    传感器配置了 deadband 时，与上一条已存储读数相差不超过死区（非数值读数为完全相同）、
+    且距其不超过 max_store_interval 秒的读数不存储。省略过读数后存储的下一条记录标记为
+    compressed，表示上一条记录的值一直保持到该记录，图表据此按阶梯绘制。
+    早于上一条已存储读数的补传数据总是存储，且不影响压缩状态。
+
+    只在事件循环线程中使用，不需要加锁。
+    """
+
+    def __init__(self):
+        self._last = {}  # 传感器ID -> [时间戳, 值, 此后省略的读数数]
+
+    def filter(self, records):
+        """
+        过滤一组按时间顺序排列的记录
+
+        Args:
+            records: 未保存的SensorData记录，record.sensor 为注册表中的Sensor实例
+
+        Returns:
+            tuple: (需要存储的记录, 省略的读数数)
+        """
+        kept = []
+        suppressed = 0
+        for record in records:
+            deadband = record.sensor.deadband
+            if deadband is None:
+                kept.append(record)
+                continue
+
+            value = record.get_value()
+            state = self._last.get(record.sensor_id)
+            if state is not None:
+                if record.timestamp < state[0]:
+                    # 补传的历史数据
+                    kept.append(record)
+                    continue
+                max_interval = record.sensor.max_store_interval
+                if (self._within(value, state[1], deadband)
+                        and not (max_interval and (record.timestamp - state[0]).total_seconds() >= max_interval)):
+                    state[2] += 1
+                    suppressed += 1
+                    continue
+                record.compressed = state[2] > 0
+            self._last[record.sensor_id] = [record.timestamp, value, 0]
+            kept.append(record)
+        return kept, suppressed
+
+    def forget(self, sensor_ids):
+        """丢弃传感器的压缩状态，如写入失败时，使下一条读数重新存储"""
+        for sensor_id in sensor_ids:
+            self._last.pop(sensor_id, None)
+
+    @staticmethod
+    def _within(value, last, deadband):
+        if isinstance(value, float) and isinstance(last, float):
+            return abs(value - last) <= deadband
+        return value == last
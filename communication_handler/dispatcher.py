@@ -0,0 +1,296 @@
+"""
+执行器命令分发模块 - 按设备维护发送队列和在途窗口，超时重发、过期丢弃，状态变化批量写回数据库
+
+命令的持久化由 ActuatorCommandLog 承担：内存中的队列只保存当前在本进程在线的设备的命令，
+设备断开后丢弃，设备重新认证时从数据库重新加载未确认的命令。因此设备可能收到重复的命令，
+应按 command_id 去重。
+"""
+
+import asyncio
+import collections
+import logging
+import time
+
+from django.utils import timezone
+
+from .commands import apply_command_updates, expire_stale_commands, load_pending_commands
+
+# 配置日志记录器
+logger = logging.getLogger(__name__)
+
+# 清理数据库中过期命令的周期（秒）
+EXPIRE_SWEEP_INTERVAL = 60.0
+
+
+class PendingCommand:
+    """一条等待发送或等待设备响应的命令"""
+
+    __slots__ = ('command_id', 'payload', 'created_at', 'attempts', 'deadline')
+
+    def __init__(self, command_id, payload, created_at):
+        self.command_id = command_id
+        self.payload = payload
+        self.created_at = created_at  # time.time()
+        self.attempts = 0
+        self.deadline = None  # 等待响应的截止时间，loop.time()
+
+
+class DeviceCommandQueue:
+    """单个设备的命令队列：等待发送的命令和已发送但未收到响应的在途命令"""
+
+    __slots__ = ('queued', 'in_flight', 'known', 'pumping')
+
+    def __init__(self):
+        self.queued = collections.deque()
+        self.in_flight = {}  # 命令ID -> PendingCommand
+        self.known = set()  # 队列和在途中的命令ID，用于去重
+        self.pumping = False
+
+
+class CommandDispatcher:
+    """
+    执行器命令分发器
+
+    每个设备最多同时有 window 条命令等待响应；超过 ack_timeout 秒没有响应的命令重新发送，
+    等待时间按重试次数指数增长，重试 max_retries 次后标记为超时；创建超过 ttl 秒的命令不再发送。
+    发送、响应和超时都先记录在内存中，每隔 flush_interval 秒批量写回数据库，
+    控制通道和设备连接都不需要等待数据库。
+    """
+
+    def __init__(self, executor, connections, stats=None, window=8, ack_timeout=5.0, max_retries=3,
+                 ttl=300, flush_interval=0.2):
+        self.executor = executor
+        self.connections = connections
+        self.stats = stats
+        self.window = max(1, window)
+        self.ack_timeout = ack_timeout
+        self.max_retries = max_retries
+        self.ttl = ttl
+        self.flush_interval = flush_interval
+        self._queues = {}  # 设备ID -> DeviceCommandQueue
+        self._sent = {}  # 命令ID -> 首次发送时间
+        self._responses = {}  # 命令ID -> (设备ID, status, 响应时间, 响应内容)
+        self._expired = set()
+        self._tasks = set()
+        self._loop = None
+        self._task = None
+        self._closing = False
+        self._wakeup = None
+        self._last_sweep = 0.0
+
+    async def start(self):
+        """启动后台任务"""
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        """停止后台任务并写入剩余的状态变化"""
+        self._closing = True
+        if self._task:
+            self._wakeup.set()
+            await self._task
+            self._task = None
+        for task in list(self._tasks):
+            task.cancel()
+        await self.flush()
+
+    def enqueue(self, device_id, command_id, payload, created_at=None):
+        """
+        将命令加入设备的发送队列
+
+        Returns:
+            bool: 设备在本进程在线时返回True；否则返回False，命令留在数据库中等待设备重新认证
+        """
+        key = str(device_id)
+        if key not in self.connections:
+            return False
+        queue = self._queues.setdefault(key, DeviceCommandQueue())
+        if command_id not in queue.known:
+            queue.known.add(command_id)
+            queue.queued.append(PendingCommand(command_id, payload, created_at or time.time()))
+            self._wake(key, queue)
+        return True
+
+    def submit_threadsafe(self, device_id, command_id, payload, created_at=None, fallback=None):
+        """
+        从其他线程（如在数据库执行器中运行的策略引擎）提交命令，交给事件循环后立即返回，不等待结果
+
+        Args:
+            fallback: 设备不在本进程在线时在线程池中调用的函数，用于询问其他工作进程
+
+        Returns:
+            bool: 分发器已停止时返回False
+        """
+        if self._loop is None or self._closing:
+            return False
+        try:
+            self._loop.call_soon_threadsafe(self._submit, device_id, command_id, payload, created_at, fallback)
+        except RuntimeError:
+            # 事件循环已经关闭
+            return False
+        return True
+
+    def _submit(self, device_id, command_id, payload, created_at, fallback):
+        if not self.enqueue(device_id, command_id, payload, created_at) and fallback is not None and not self._closing:
+            self._loop.run_in_executor(None, fallback)
+
+    def attach(self, device_id):
+        """设备认证成功后调用，从数据库重新加载未确认的命令"""
+        self._spawn(self._replay(str(device_id)))
+
+    def detach(self, device_id):
+        """设备的连接断开后调用，没有剩余连接时丢弃内存中的队列"""
+        key = str(device_id)
+        if key not in self.connections:
+            self._queues.pop(key, None)
+
+    def on_response(self, device_id, command_id, status, payload):
+        """记录设备对命令的响应，释放在途窗口并发送后续命令"""
+        key = str(device_id)
+        self._responses[command_id] = (key, status, timezone.now(), payload)
+        queue = self._queues.get(key)
+        if queue is None or command_id not in queue.known:
+            return
+        queue.known.discard(command_id)
+        if queue.in_flight.pop(command_id, None) is not None:
+            self._wake(key, queue)
+        else:
+            # 超时后已放回队列等待重发的命令，响应迟到时不再重发
+            for command in queue.queued:
+                if command.command_id == command_id:
+                    queue.queued.remove(command)
+                    break
+
+    @property
+    def queued_count(self):
+        """等待发送的命令数"""
+        return sum(len(queue.queued) for queue in self._queues.values())
+
+    @property
+    def in_flight_count(self):
+        """等待设备响应的命令数"""
+        return sum(len(queue.in_flight) for queue in self._queues.values())
+
+    def _spawn(self, coro):
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def _wake(self, device_id, queue):
+        """队列有可发送的命令时启动发送任务，每个设备同时最多一个"""
+        if not queue.pumping and queue.queued and len(queue.in_flight) < self.window:
+            queue.pumping = True
+            self._spawn(self._pump(device_id, queue))
+
+    def _expire(self, queue, command):
+        queue.known.discard(command.command_id)
+        self._expired.add(command.command_id)
+        if self.stats is not None:
+            self.stats.incr('commands_expired')
+
+    async def _pump(self, device_id, queue):
+        """在窗口允许的范围内发送队列中的命令"""
+        try:
+            while queue.queued and len(queue.in_flight) < self.window:
+                connection = self.connections.get(device_id)
+                if connection is None or self._queues.get(device_id) is not queue:
+                    return
+                command = queue.queued.popleft()
+                if self.ttl and time.time() - command.created_at > self.ttl:
+                    self._expire(queue, command)
+                    continue
+
+                message = {"type": "command", "command_id": command.command_id, "payload": command.payload}
+                try:
+                    await connection.send(message)
+                except (ConnectionError, OSError, RuntimeError) as e:
+                    # 连接正在关闭，命令留在队列中，设备重新认证后从数据库重新加载
+                    queue.queued.appendleft(command)
+                    logger.debug(f"向设备 {device_id} 发送命令 {command.command_id} 失败: {e!r}")
+                    return
+
+                command.attempts += 1
+                if command.attempts == 1:
+                    self._sent.setdefault(command.command_id, timezone.now())
+                    if self.stats is not None:
+                        self.stats.incr('commands_pushed')
+                elif self.stats is not None:
+                    self.stats.incr('commands_retried')
+                if command.command_id not in queue.known:
+                    # 等待写入期间已经收到了设备的响应
+                    continue
+                command.deadline = self._loop.time() + self.ack_timeout * 2 ** (command.attempts - 1)
+                queue.in_flight[command.command_id] = command
+        finally:
+            queue.pumping = False
+
+    async def _replay(self, device_id):
+        """设备重新认证后，加载数据库中未确认的命令并按创建顺序加入队列"""
+        try:
+            commands = await self.executor.run(load_pending_commands, device_id, self.ttl)
+        except Exception as e:
+            logger.error(f"加载设备 {device_id} 待发送的命令时出错: {e}")
+            return
+        # 已收到响应但尚未写入数据库的命令不再重发
+        commands = [command for command in commands if command[0] not in self._responses]
+        for command_id, payload, created_at in commands:
+            self.enqueue(device_id, command_id, payload, created_at.timestamp())
+        if commands:
+            logger.info(f"设备 {device_id} 重新认证，重新发送 {len(commands)} 条未确认的命令",
+                        extra={'event': 'command_replay', 'device_id': device_id})
+
+    def _check_timeouts(self):
+        """将超过等待时间的在途命令放回队列重发，重试次数耗尽的标记为超时"""
+        now = self._loop.time()
+        for device_id, queue in self._queues.items():
+            if not queue.in_flight:
+                continue
+            overdue = [command for command in queue.in_flight.values() if command.deadline <= now]
+            for command in overdue:
+                del queue.in_flight[command.command_id]
+                if command.attempts > self.max_retries:
+                    self._expire(queue, command)
+                    logger.info(f"设备 {device_id} 未响应命令 {command.command_id}，重试 {self.max_retries} 次后放弃",
+                                extra={'event': 'command_timeout', 'device_id': device_id})
+                else:
+                    queue.queued.appendleft(command)
+            if overdue:
+                self._wake(device_id, queue)
+
+    async def _run(self):
+        """后台循环：检查响应超时并批量写入状态变化"""
+        while not self._closing:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._check_timeouts()
+            await self.flush()
+            if self.ttl and self._loop.time() - self._last_sweep >= EXPIRE_SWEEP_INTERVAL:
+                self._last_sweep = self._loop.time()
+                try:
+                    expired = await self.executor.run(expire_stale_commands, self.ttl)
+                    if expired:
+                        logger.info(f"已将 {expired} 条超过有效期仍未确认的命令标记为超时")
+                except Exception as e:
+                    logger.error(f"清理过期命令时出错: {e}")
+
+    async def flush(self):
+        """将发送、响应和超时批量写入数据库"""
+        if not self._sent and not self._responses and not self._expired:
+            return
+
+        sent, responses, expired = self._sent, self._responses, self._expired
+        self._sent, self._responses, self._expired = {}, {}, set()
+        try:
+            counts = await self.executor.run(apply_command_updates, sent, responses, expired)
+            logger.debug(f"命令状态已写入: 已发送 {counts[0]}，响应 {counts[1]}，超时 {counts[2]}")
+        except Exception as e:
+            logger.error(f"批量更新命令状态时出错: {str(e)}")
+            # 写入失败时保留，等待下一周期重试（新的变化优先）
+            for command_id, sent_at in sent.items():
+                self._sent.setdefault(command_id, sent_at)
+            for command_id, response in responses.items():
+                self._responses.setdefault(command_id, response)
+            self._expired |= expired
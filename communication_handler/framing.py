@@ -0,0 +1,139 @@
+"""
+设备协议帧格式模块 - 默认的换行分隔JSON，以及认证时可选的长度前缀二进制帧（MessagePack/CBOR）
+
+二进制帧格式：4字节大端无符号整数表示消息体长度，后跟对应长度的 MessagePack 或 CBOR 消息体。
+安装了 msgpack 或 cbor2 时才能使用对应的帧格式。
+"""
+
+import asyncio
+import struct
+
+FRAMING_JSON = 'json'
+FRAMING_MSGPACK = 'msgpack'
+FRAMING_CBOR = 'cbor'
+FRAMING_CHOICES = (FRAMING_JSON, FRAMING_MSGPACK, FRAMING_CBOR)
+
+# 二进制帧头：消息体长度（uint32，大端）
+FRAME_HEADER = struct.Struct('>I')
+# 单个二进制帧的最大长度，超过时无法继续同步帧边界，只能关闭连接
+MAX_FRAME_SIZE = 1024 * 1024
+
+
+class FrameDecodeError(ValueError):
+    """二进制消息体无法解析"""
+
+
+class FrameTooLargeError(Exception):
+    """消息行或二进制帧长度超过上限"""
+
+
+class LineFraming:
+    """换行分隔的JSON帧，使用服务器配置的JSON编解码器"""
+
+    name = FRAMING_JSON
+    binary = False
+    decode_error_message = "无效的JSON数据格式"
+
+    def __init__(self, codec):
+        self.codec = codec
+
+    async def read(self, reader):
+        """读取一条消息，连接关闭时返回空bytes"""
+        try:
+            return await reader.readline()
+        except ValueError as e:
+            # 超过 StreamReader 的 limit 时 readline 抛出 ValueError
+            raise FrameTooLargeError("消息长度超过上限") from e
+
+    def decode(self, raw):
+        return self.codec.loads(raw)
+
+    def encode(self, obj):
+        return self.codec.dumps(obj) + b'\n'
+
+
+class LengthPrefixedFraming:
+    """长度前缀二进制帧的基类，子类实现 loads/dumps"""
+
+    binary = True
+
+    def __init__(self, max_frame_size=MAX_FRAME_SIZE):
+        self.max_frame_size = max_frame_size
+        self.decode_error_message = f"无效的{self.name}数据格式"
+
+    async def read(self, reader):
+        """读取一帧消息体，连接在帧边界处关闭时返回空bytes；长度为0的帧视为保活并跳过"""
+        while True:
+            try:
+                header = await reader.readexactly(FRAME_HEADER.size)
+            except asyncio.IncompleteReadError as e:
+                if not e.partial:
+                    return b''
+                raise
+            (length,) = FRAME_HEADER.unpack(header)
+            if length > self.max_frame_size:
+                raise FrameTooLargeError(f"帧长度 {length} 超过上限 {self.max_frame_size}")
+            if length:
+                return await reader.readexactly(length)
+
+    def decode(self, raw):
+        try:
+            return self.loads(raw)
+        except Exception as e:
+            raise FrameDecodeError(str(e)) from e
+
+    def encode(self, obj):
+        body = self.dumps(obj)
+        return FRAME_HEADER.pack(len(body)) + body
+
+
+class MsgpackFraming(LengthPrefixedFraming):
+    """MessagePack 帧，允许以整数作为map的键（传感器序号）"""
+
+    name = FRAMING_MSGPACK
+
+    def __init__(self, max_frame_size=MAX_FRAME_SIZE):
+        import msgpack
+        self._msgpack = msgpack
+        super().__init__(max_frame_size)
+
+    def loads(self, raw):
+        return self._msgpack.unpackb(raw, raw=False, strict_map_key=False)
+
+    def dumps(self, obj):
+        return self._msgpack.packb(obj, use_bin_type=True)
+
+
+class CborFraming(LengthPrefixedFraming):
+    """CBOR 帧"""
+
+    name = FRAMING_CBOR
+
+    def __init__(self, max_frame_size=MAX_FRAME_SIZE):
+        import cbor2
+        self._cbor2 = cbor2
+        super().__init__(max_frame_size)
+
+    def loads(self, raw):
+        return self._cbor2.loads(raw)
+
+    def dumps(self, obj):
+        return self._cbor2.dumps(obj)
+
+
+BINARY_FRAMING_CLASSES = {
+    FRAMING_MSGPACK: MsgpackFraming,
+    FRAMING_CBOR: CborFraming,
+}
+
+
+def available_framings():
+    """返回当前环境可用的帧格式名称"""
+    names = [FRAMING_JSON]
+    for name, framing_class in BINARY_FRAMING_CLASSES.items():
+        try:
+            framing_class()
+        except ImportError:
+            continue
+        names.append(name)
+    return names
@@ -0,0 +1,374 @@
+"""
+传感器数据批量写入模块 - 合并来自多个设备连接的数据消息，按数量或时间批量写入SensorData
+"""
+
+import asyncio
+import logging
+import time
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.db import transaction, IntegrityError
+from django.db.models.signals import post_save
+from django.utils import timezone
+
+from iot_devices.models import SensorData
+from .bus import BusConsumer, SensorEvent
+from .server_logging import LogRateLimiter
+
+# 配置日志记录器
+logger = logging.getLogger(__name__)
+
+# 同一设备同一value_key的告警每5分钟最多记录一次
+warning_limiter = LogRateLimiter(interval=300)
+
+# data_batch 消息允许携带的最大样本数
+MAX_BATCH_SAMPLES = getattr(settings, 'NOVA_TCP_MAX_BATCH_SAMPLES', 1000)
+# 时间戳比服务器时间超前超过此秒数的样本视为设备时钟错误并拒绝
+MAX_CLOCK_SKEW = 300
+# 早于此秒数的样本视为补传的历史数据，只存储，不触发策略引擎
+LATE_SAMPLE_SECONDS = getattr(settings, 'NOVA_TCP_LATE_SAMPLE_SECONDS', 300)
+
+
+def parse_device_timestamp(device_timestamp_unix):
+    """
+    将设备上报的秒级Unix时间戳转换为带时区的datetime
+
+    Args:
+        device_timestamp_unix: 设备上报的时间戳，可以为空
+
+    Returns:
+        datetime: 时间戳无效或缺失时返回服务器当前时间
+    """
+    if device_timestamp_unix:
+        try:
+            return datetime.fromtimestamp(int(device_timestamp_unix), tz=timezone.get_current_timezone())
+        except (TypeError, ValueError, OverflowError, OSError):
+            if warning_limiter.allow('invalid_timestamp'):
+                logger.warning(f"设备提供的时间戳 {device_timestamp_unix} 无效，使用服务器时间（同类告警限频）")
+    return timezone.now()
+
+
+def parse_sample_timestamp(sample_timestamp_unix, now):
+    """
+    解析 data_batch 中单个样本的时间戳
+
+    与 parse_device_timestamp 不同，批量样本必须携带有效时间戳，
+    否则无法确定其先后顺序，不会用服务器时间代替。
+
+    Args:
+        sample_timestamp_unix: 秒级Unix时间戳
+        now: 服务器当前时间
+
+    Returns:
+        datetime: 时间戳缺失、无效或超前过多时返回None
+    """
+    if isinstance(sample_timestamp_unix, bool) or not isinstance(sample_timestamp_unix, (int, float)):
+        return None
+    try:
+        record_timestamp = datetime.fromtimestamp(sample_timestamp_unix, tz=timezone.get_current_timezone())
+    except (ValueError, OverflowError, OSError):
+        return None
+    if record_timestamp - now > timedelta(seconds=MAX_CLOCK_SKEW):
+        return None
+    return record_timestamp
+
+
+def build_sensor_data(sensor, value, record_timestamp):
+    """
+    根据值的类型构造一条未保存的SensorData记录
+
+    Args:
+        sensor: Sensor实例
+        value: 设备上报的原始值
+        record_timestamp: 记录时间戳
+
+    Returns:
+        SensorData: 未保存的数据记录
+    """
+    data_entry = SensorData(sensor=sensor, timestamp=record_timestamp)
+    if isinstance(value, bool):
+        data_entry.value_boolean = value
+    elif isinstance(value, (int, float)):
+        data_entry.value_float = float(value)
+    elif isinstance(value, str):
+        data_entry.value_string = value
+    elif isinstance(value, (dict, list)):  # JSONField 可以存 dict 或 list
+        data_entry.value_json = value
+    else:
+        logger.warning(f"传感器 {sensor.value_key} 的值类型不支持: {type(value)}，以字符串形式存储")
+        data_entry.value_string = str(value)  # 降级为字符串存储
+    return data_entry
+
+
+def build_sensor_records(device_id_str, sensors_by_key, sensor_readings, record_timestamp):
+    """
+    将一条数据消息的读数转换为SensorData记录列表，未配置的value_key会被忽略
+
+    Args:
+        device_id_str: 设备ID，仅用于日志
+        sensors_by_key: value_key -> Sensor 映射
+        sensor_readings: 消息中的 payload 字典
+        record_timestamp: 记录时间戳
+
+    Returns:
+        list: 未保存的SensorData记录
+    """
+    records = []
+    for value_key, value in sensor_readings.items():
+        sensor = sensors_by_key.get(value_key)
+        if sensor is None:
+            if warning_limiter.allow((device_id_str, value_key)):
+                logger.warning(f"设备 {device_id_str} 没有value_key为 '{value_key}' 的传感器，数据已忽略（同类告警限频）")
+            continue
+        records.append(build_sensor_data(sensor, value, record_timestamp))
+    return records
+
+
+def build_batch_sensor_records(device_id_str, sensors_by_key, samples, now=None):
+    """
+    将 data_batch 消息中的样本转换为SensorData记录
+
+    - 样本按时间戳排序后生成记录，乱序上报的样本按实际时间顺序写入
+    - 同一传感器同一时间戳的重复读数只保留最后上报的值（设备重传时常见）
+    - 时间戳缺失、无效或超前过多的样本被拒绝
+    - 只有每个传感器最新且不早于 LATE_SAMPLE_SECONDS 的记录需要派发信号，
+      补传的历史数据不会触发策略引擎
+
+    Args:
+        device_id_str: 设备ID，仅用于日志
+        sensors_by_key: value_key -> Sensor 映射
+        samples: [{"timestamp": ..., "payload": {...}}, ...]
+        now: 服务器当前时间，默认为 timezone.now()
+
+    Returns:
+        tuple: (全部记录, 需要派发信号的记录, 被拒绝的样本数)
+    """
+    now = now or timezone.now()
+    accepted = []
+    rejected = 0
+    for sample in samples:
+        if not isinstance(sample, dict) or not isinstance(sample.get("payload"), dict):
+            rejected += 1
+            continue
+        record_timestamp = parse_sample_timestamp(sample.get("timestamp"), now)
+        if record_timestamp is None:
+            rejected += 1
+            continue
+        accepted.append((record_timestamp, sample["payload"]))
+
+    if rejected and warning_limiter.allow((device_id_str, 'invalid_sample')):
+        logger.warning(f"设备 {device_id_str} 的批量数据中有 {rejected} 个样本时间戳无效或格式错误，已忽略（同类告警限频）")
+
+    # sort 是稳定排序，相同时间戳的样本保持上报顺序，后面的值覆盖前面的
+    accepted.sort(key=lambda item: item[0])
+    readings = {}
+    for record_timestamp, payload in accepted:
+        for value_key, value in payload.items():
+            readings[(value_key, record_timestamp)] = value
+
+    records = []
+    newest = {}  # value_key -> 最新记录
+    for (value_key, record_timestamp), value in readings.items():
+        sensor = sensors_by_key.get(value_key)
+        if sensor is None:
+            if warning_limiter.allow((device_id_str, value_key)):
+                logger.warning(f"设备 {device_id_str} 没有value_key为 '{value_key}' 的传感器，数据已忽略（同类告警限频）")
+            continue
+        record = build_sensor_data(sensor, value, record_timestamp)
+        records.append(record)
+        if value_key not in newest or record_timestamp >= newest[value_key].timestamp:
+            newest[value_key] = record
+
+    late_before = now - timedelta(seconds=LATE_SAMPLE_SECONDS)
+    signal_records = [record for record in newest.values() if record.timestamp >= late_before]
+    return records, signal_records, rejected
+
+
+def write_sensor_data(records):
+    """使用bulk_create在一个事务中写入一批SensorData"""
+    with transaction.atomic():
+        SensorData.objects.bulk_create(records)
+
+
+def dispatch_sensor_data_signals(records):
+    """
+    为已写入的SensorData补发post_save信号
+
+    bulk_create不会触发模型信号，而策略引擎依赖SensorData的post_save信号，
+    因此写入成功后需要手动派发。
+    """
+    for record in records:
+        try:
+            post_save.send(sender=SensorData, instance=record, created=True,
+                           update_fields=None, raw=False, using=record._state.db)
+        except Exception as e:
+            logger.error(f"派发传感器数据信号时出错: 传感器ID={record.sensor_id}, 错误={str(e)}")
+
+
+class SignalConsumer(BusConsumer):
+    """消息总线的消费者：为实时数据派发post_save信号，策略引擎依赖该信号评估策略"""
+
+    name = 'signals'
+    live_only = True
+    # 丢弃事件会让策略在流量高峰时不再触发，队列满时对写入方施加背压
+    lossless = True
+
+    def __init__(self, executor):
+        self.executor = executor
+
+    async def handle(self, events):
+        await self.executor.run(dispatch_sensor_data_signals, [event.record for event in events])
+
+
+class SensorDataBatchWriter:
+    """
+    传感器数据批量写入器
+
+    各连接通过 submit() 提交记录并等待写入完成，写入器在累计记录数达到
+    batch_size 或距离上次写入超过 flush_interval 秒时，将所有待写入记录
+    合并为一次bulk_create。写入和信号派发都在数据库执行器中进行，
+    信号派发不会阻塞设备确认。提交时可以指定只为其中一部分记录派发信号，
+    用于批量补传的历史数据。
+
+    指定了消息总线时，写入成功的记录作为读数事件发布到总线，由总线的消费者
+    （包括派发post_save信号的 SignalConsumer）异步处理；只有 signal_records 标记为实时数据。
+    写入前先等待总线中不可丢失事件的消费者有空闲容量，信号派发跟不上时写入随之放慢，而不是丢弃信号。
+    指定了 stats 时，每次批量写入的耗时（包括在数据库执行器中排队的时间）记录到 db_write_latency。
+    """
+
+    def __init__(self, executor, batch_size=500, flush_interval=0.05, bus=None, stats=None):
+        self.executor = executor
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.bus = bus
+        self.stats = stats
+        self._pending = []  # [(records, signal_records, future), ...]
+        self._pending_count = 0
+        self._flush_event = None
+        self._task = None
+        self._closing = False
+        self._signal_tasks = set()
+
+    async def start(self):
+        """启动后台写入任务"""
+        self._flush_event = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        """停止后台任务并写入剩余记录"""
+        self._closing = True
+        if self._task:
+            self._flush_event.set()
+            await self._task
+            self._task = None
+        await self.flush()
+        if self._signal_tasks:
+            await asyncio.gather(*self._signal_tasks, return_exceptions=True)
+
+    @property
+    def pending_count(self):
+        """等待写入的记录数"""
+        return self._pending_count
+
+    async def submit(self, records, signal_records=None):
+        """
+        提交一组记录并等待其写入数据库
+
+        Args:
+            records: 未保存的SensorData记录
+            signal_records: 写入后需要派发post_save信号的记录，默认为全部记录
+
+        Returns:
+            int: 已写入的记录数
+        """
+        if not records:
+            return 0
+
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((records, records if signal_records is None else signal_records, future))
+        self._pending_count += len(records)
+        if self._pending_count >= self.batch_size:
+            self._flush_event.set()
+        return await future
+
+    async def _run(self):
+        """后台循环：按时间或数量触发写入"""
+        while not self._closing:
+            try:
+                await asyncio.wait_for(self._flush_event.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._flush_event.clear()
+            await self.flush()
+
+    async def flush(self):
+        """写入当前所有待写入的记录，并通知对应的提交者"""
+        if not self._pending:
+            return
+        if self.bus is not None:
+            await self.bus.wait_for_capacity()
+
+        pending, self._pending = self._pending, []
+        self._pending_count = 0
+
+        written = [record for records, _, _ in pending for record in records]
+        started = time.monotonic()
+        try:
+            await self.executor.run(write_sensor_data, written)
+            if self.stats is not None:
+                self.stats.observe('db_write_latency', time.monotonic() - started)
+        except IntegrityError:
+            # 批次中某条消息引用了已删除的传感器等，逐条消息重试，避免影响其他设备
+            written_pending = []
+            for records, signal_records, future in pending:
+                try:
+                    await self.executor.run(write_sensor_data, records)
+                    written_pending.append((records, signal_records, future))
+                    self._resolve(future, len(records))
+                except Exception as e:
+                    self._reject(future, e)
+            self._publish(written_pending)
+            return
+        except Exception as e:
+            logger.error(f"批量写入传感器数据时出错: {str(e)}")
+            for _, _, future in pending:
+                self._reject(future, e)
+            return
+
+        for records, _, future in pending:
+            self._resolve(future, len(records))
+        logger.debug(f"已批量写入 {len(written)} 条传感器数据")
+        self._publish(pending)
+
+    def _publish(self, pending):
+        """发布已写入的记录；没有消息总线时直接派发post_save信号"""
+        if self.bus is None:
+            self._dispatch_signals([record for _, signal_records, _ in pending for record in signal_records])
+            return
+        events = []
+        for records, signal_records, _ in pending:
+            if signal_records is records:
+                events.extend(SensorEvent.from_record(record) for record in records)
+            else:
+                live = {id(record) for record in signal_records}
+                events.extend(SensorEvent.from_record(record, id(record) in live) for record in records)
+        self.bus.publish(events)
+
+    def _dispatch_signals(self, records):
+        """在数据库执行器中异步派发post_save信号"""
+        if not records:
+            return
+        task = asyncio.create_task(self.executor.run(dispatch_sensor_data_signals, records))
+        self._signal_tasks.add(task)
+        task.add_done_callback(self._signal_tasks.discard)
+
+    @staticmethod
+    def _resolve(future, result):
+        if not future.done():
+            future.set_result(result)
+
+    @staticmethod
+    def _reject(future, exc):
+        if not future.done():
+            future.set_exception(exc)
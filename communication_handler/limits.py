@@ -0,0 +1,301 @@
+"""
+TCP服务器连接限制模块 - 全局和按IP的连接数上限、按设备和项目的消息速率限制、超时关闭连接
+"""
+
+import asyncio
+import logging
+import socket
+import time
+from typing import NamedTuple
+
+# 配置日志记录器
+logger = logging.getLogger(__name__)
+
+
+class ConnectionLimiter:
+    """
+    连接数限制器
+
+    max_connections 和 max_per_ip 为0时表示不限制。多进程模式下每个工作进程独立计数。
+    """
+
+    def __init__(self, max_connections=0, max_per_ip=0):
+        self.max_connections = max_connections
+        self.max_per_ip = max_per_ip
+        self.active = 0
+        self._per_ip = {}
+
+    def acquire(self, ip):
+        """
+        尝试占用一个连接名额
+
+        Returns:
+            str: 成功时返回None，超出上限时返回拒绝原因
+        """
+        if self.max_connections and self.active >= self.max_connections:
+            return "服务器连接数已达上限"
+        count = self._per_ip.get(ip, 0)
+        if self.max_per_ip and count >= self.max_per_ip:
+            return "来自该IP的连接数已达上限"
+        self.active += 1
+        self._per_ip[ip] = count + 1
+        return None
+
+    def release(self, ip):
+        """释放一个连接名额"""
+        self.active -= 1
+        count = self._per_ip.get(ip, 0) - 1
+        if count > 0:
+            self._per_ip[ip] = count
+        else:
+            self._per_ip.pop(ip, None)
+
+
+# 超过速率上限时的处理方式：defer 暂停读取该连接，等到有令牌时再处理；drop 丢弃消息并回复限流响应
+RATE_LIMIT_DEFER = 'defer'
+RATE_LIMIT_DROP = 'drop'
+RATE_LIMIT_ACTIONS = (RATE_LIMIT_DEFER, RATE_LIMIT_DROP)
+
+SCOPE_DEVICE = 'device'
+SCOPE_PROJECT = 'project'
+
+
+class TokenBucket:
+    """令牌桶：每秒补充 rate 个令牌，最多积累 burst 个，每条消息消耗一个"""
+
+    __slots__ = ('rate', 'burst', 'tokens', 'updated')
+
+    def __init__(self, rate, burst, now):
+        self.rate = rate
+        self.burst = max(1.0, burst or rate)
+        self.tokens = self.burst
+        self.updated = now
+
+    def configure(self, rate, burst):
+        """更换速率和突发量，保留已积累的令牌"""
+        self.rate = rate
+        self.burst = max(1.0, burst or rate)
+        self.tokens = min(self.tokens, self.burst)
+
+    def delay(self, now):
+        """
+        补充令牌并返回距下一个令牌可用的秒数
+
+        Returns:
+            float: 当前有令牌时返回0
+        """
+        elapsed = now - self.updated
+        if elapsed > 0:
+            self.tokens = min(self.burst, self.tokens + elapsed * self.rate)
+            self.updated = now
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+
+class Throttle(NamedTuple):
+    """一次限流：触发的限额范围、设备ID或项目ID，以及距下一个令牌可用的秒数"""
+
+    scope: str
+    key: str
+    delay: float
+
+
+class IngestRateLimiter:
+    """
+    设备消息速率限制器
+
+    每个设备和每个项目各有一个令牌桶，认证后的每条消息在解析之前消耗一个令牌，两者都有令牌时才放行。
+    限额默认取服务器配置，项目的 device_rate_limit 等字段不为空时覆盖默认值，速率为0表示不限制；
+    配置在设备认证时读取，设备注册表条目重新加载时通过 refresh() 更新，已连接的设备不需要重连。
+    设备只记录项目ID，每条消息按ID查找项目令牌桶，项目限额的修改或取消对该项目已连接的所有设备立即生效。
+    多进程模式下每个工作进程独立计数，项目限额作用于同一工作进程内该项目的所有设备。
+    """
+
+    def __init__(self, device_rate=0.0, device_burst=0, project_rate=0.0, project_burst=0, action=RATE_LIMIT_DEFER):
+        self.device_rate = device_rate
+        self.device_burst = device_burst
+        self.project_rate = project_rate
+        self.project_burst = project_burst
+        self.action = action
+        self._devices = {}  # 已连接的 device_id -> (设备令牌桶, 项目ID)，设备不限制时令牌桶为None
+        self._projects = {}  # 项目ID -> TokenBucket
+        self._throttled = {}  # (范围, 设备ID或项目ID) -> 本周期被限流的消息数
+
+    @property
+    def defer(self):
+        return self.action == RATE_LIMIT_DEFER
+
+    def limits_for(self, project):
+        """返回项目生效的 (单设备速率, 单设备突发量, 项目速率, 项目突发量)"""
+        def pick(name, default):
+            value = getattr(project, name, None)
+            return default if value is None else value
+
+        return (
+            pick('device_rate_limit', self.device_rate),
+            pick('device_rate_burst', self.device_burst),
+            pick('project_rate_limit', self.project_rate),
+            pick('project_rate_burst', self.project_burst),
+        )
+
+    def attach(self, device_id, project):
+        """设备认证成功后调用，按项目配置创建或更新令牌桶"""
+        device_rate, device_burst, project_rate, project_burst = self.limits_for(project)
+        now = time.monotonic()
+
+        device_bucket = None
+        if device_rate > 0:
+            current = self._devices.get(device_id)
+            device_bucket = current[0] if current and current[0] is not None else TokenBucket(device_rate, device_burst, now)
+            device_bucket.configure(device_rate, device_burst)
+
+        project_id = str(project.pk)
+        if project_rate > 0:
+            project_bucket = self._projects.get(project_id)
+            if project_bucket is None:
+                self._projects[project_id] = TokenBucket(project_rate, project_burst, now)
+            else:
+                project_bucket.configure(project_rate, project_burst)
+        else:
+            self._projects.pop(project_id, None)
+
+        self._devices[device_id] = (device_bucket, project_id)
+
+    def refresh(self, device_id, project):
+        """设备注册表条目重新加载后调用，按最新的项目配置更新已连接设备的令牌桶"""
+        if device_id in self._devices:
+            self.attach(device_id, project)
+
+    def detach(self, device_id):
+        """设备的最后一个连接断开后调用"""
+        self._devices.pop(device_id, None)
+
+    def check(self, device_id):
+        """
+        为一条消息消耗令牌
+
+        Returns:
+            Throttle: 超过限额时返回，否则返回None
+        """
+        limits = self._devices.get(device_id)
+        if limits is None:
+            return None
+        throttle = self._take(device_id, limits, time.monotonic())
+        if throttle is not None:
+            key = (throttle.scope, throttle.key)
+            self._throttled[key] = self._throttled.get(key, 0) + 1
+        return throttle
+
+    async def wait(self, device_id, throttle):
+        """延后处理模式下等待令牌，返回时已为该消息消耗令牌"""
+        while throttle is not None:
+            await asyncio.sleep(throttle.delay)
+            limits = self._devices.get(device_id)
+            if limits is None:
+                return
+            throttle = self._take(device_id, limits, time.monotonic())
+
+    def pop_throttled(self, top_n=10):
+        """
+        返回本周期被限流最多的设备和项目并清空计数
+
+        Returns:
+            list: [(范围, 设备ID或项目ID, 被限流的消息数), ...]
+        """
+        throttled, self._throttled = self._throttled, {}
+        ranked = sorted(throttled.items(), key=lambda item: item[1], reverse=True)[:top_n]
+        return [(scope, key, count) for (scope, key), count in ranked]
+
+    def _take(self, device_id, limits, now):
+        device_bucket, project_id = limits
+        project_bucket = self._projects.get(project_id)
+        if device_bucket is not None:
+            delay = device_bucket.delay(now)
+            if delay:
+                return Throttle(SCOPE_DEVICE, device_id, delay)
+        if project_bucket is not None:
+            delay = project_bucket.delay(now)
+            if delay:
+                return Throttle(SCOPE_PROJECT, project_id, delay)
+            project_bucket.tokens -= 1
+        if device_bucket is not None:
+            device_bucket.tokens -= 1
+        return None
+
+
+def enable_keepalive(writer):
+    """为连接开启TCP keepalive，使内核能发现已经失联的对端"""
+    sock = writer.get_extra_info('socket')
+    if sock is None:
+        return
+    try:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+    except OSError:
+        pass
+
+
+async def close_writer(writer, timeout):
+    """
+    关闭连接，对端长时间不读取导致发送缓冲区无法清空时直接中止，避免连接永远无法释放
+
+    Args:
+        writer: StreamWriter
+        timeout: 等待正常关闭的秒数
+    """
+    writer.close()
+    try:
+        await asyncio.wait_for(writer.wait_closed(), timeout)
+    except asyncio.TimeoutError:
+        writer.transport.abort()
+    except (ConnectionError, OSError):
+        pass
+
+
+class IdleTimer:
+    """
+    连接空闲计时器
+
+    收到消息时只记录时间，不重新调度定时器；定时器到期时检查实际空闲时间，
+    未超时则按剩余时间重新调度，超时则中止连接。中止后等待中的读取会收到EOF，
+    阻塞在发送（对端不再读取）上的写入也会随之结束。
+    """
+
+    def __init__(self, transport, timeout):
+        self._loop = asyncio.get_running_loop()
+        self.transport = transport
+        self.timeout = timeout
+        self.expired = False
+        self.last_activity = self._loop.time()
+        self._handle = None
+        self._schedule(timeout)
+
+    def touch(self):
+        """记录一次活动"""
+        self.last_activity = self._loop.time()
+
+    def reset(self, timeout):
+        """更换超时时间并重新计时，如认证完成后从认证超时切换为空闲超时"""
+        self.cancel()
+        self.timeout = timeout
+        self.touch()
+        self._schedule(timeout)
+
+    def cancel(self):
+        """停止计时"""
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+
+    def _schedule(self, delay):
+        if self.timeout:
+            self._handle = self._loop.call_later(delay, self._check)
+
+    def _check(self):
+        idle = self._loop.time() - self.last_activity
+        if idle < self.timeout:
+            self._schedule(self.timeout - idle)
+            return
+        self._handle = None
+        self.expired = True
+        self.transport.abort()
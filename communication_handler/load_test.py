@@ -0,0 +1,610 @@
+#!/usr/bin/env python
+"""
+NovaCloud TCP设备协议负载测试工具
+批量创建测试设备，并用asyncio模拟大量设备同时连接TCP服务器，按配置的消息比例和速率发送数据，
+统计吞吐量、确认延迟百分位数和错误率，用于评估硬件容量和发现 run_tcp_server 的性能退化
+
+使用方法:
+python load_test.py provision --count 1000 [--sensors 4] [--username <用户名>] [--output devices.json]
+python load_test.py run --devices devices.json [--host HOST] [--port PORT] [--connections N] [--duration 60]
+                    [--rate 1] [--mix data=70,batch=5,heartbeat=20,status=5] [--json results.json]
+"""
+
+import argparse
+import asyncio
+import collections
+import json
+import os
+import random
+import sys
+import time
+from pathlib import Path
+
+# 将项目根目录添加到Python路径，以便导入 communication_handler 和Django项目
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from communication_handler.codec import get_codec, install_event_loop  # noqa: E402
+from communication_handler.stats import LatencyHistogram  # noqa: E402
+
+# 每个测试设备的传感器：(value_key, 传感器类型, 单位, 取值范围)
+SENSOR_TEMPLATES = (
+    ('temperature', 'temperature', '°C', (18.0, 28.0)),
+    ('humidity', 'humidity', '%', (30.0, 70.0)),
+    ('light_level', 'light', 'lux', (0, 1000)),
+    ('pressure', 'pressure', 'hPa', (980.0, 1040.0)),
+    ('co2', 'co2', 'ppm', (400, 2000)),
+    ('voltage', 'voltage', 'V', (3.0, 4.2)),
+)
+# value_key -> 取值范围
+SENSOR_RANGES = {template[0]: template[3] for template in SENSOR_TEMPLATES}
+
+MESSAGE_KINDS = ('data', 'batch', 'heartbeat', 'status')
+DEFAULT_MIX = 'data=70,batch=5,heartbeat=20,status=5'
+# 批量创建设备和传感器时每条INSERT的行数
+PROVISION_BATCH_SIZE = 1000
+# 结束后等待未确认消息的最长时间（秒）
+DRAIN_TIMEOUT = 5.0
+
+
+def parse_args():
+    """解析命令行参数"""
+    parser = argparse.ArgumentParser(description='NovaCloud TCP设备协议负载测试工具')
+    subparsers = parser.add_subparsers(dest='action', required=True)
+
+    provision = subparsers.add_parser('provision', help='批量创建测试设备和传感器（需要访问数据库）')
+    provision.add_argument('--count', type=int, required=True,
+                           help='创建的设备数')
+    provision.add_argument('--sensors', type=int, default=4,
+                           help=f'每个设备的传感器数，最多{len(SENSOR_TEMPLATES)}个 (默认: 4)')
+    provision.add_argument('--username', type=str, default=None,
+                           help='项目所有者的用户名，未提供则使用第一个可用用户')
+    provision.add_argument('--project', type=str, default='TCP负载测试项目',
+                           help='设备所属的项目名称，不存在时自动创建 (默认: TCP负载测试项目)')
+    provision.add_argument('--output', type=str, default='devices.json',
+                           help='写入设备ID、密钥和传感器的文件 (默认: devices.json)')
+
+    run = subparsers.add_parser('run', help='模拟设备连接TCP服务器并发送消息')
+    run.add_argument('--devices', type=str, default='devices.json',
+                     help='provision 生成的设备文件 (默认: devices.json)')
+    run.add_argument('--host', type=str, default='127.0.0.1',
+                     help='TCP服务器地址 (默认: 127.0.0.1)')
+    run.add_argument('--port', type=int, default=8100,
+                     help='TCP服务器端口 (默认: 8100)')
+    run.add_argument('--connections', type=int, default=None,
+                     help='同时连接数，超过设备数时多个连接共用设备 (默认: 设备数)')
+    run.add_argument('--duration', type=float, default=60.0,
+                     help='发送消息的时长，单位为秒 (默认: 60)')
+    run.add_argument('--ramp-up', type=float, default=10.0,
+                     help='在多少秒内逐步建立所有连接，0表示同时连接 (默认: 10)')
+    run.add_argument('--rate', type=float, default=1.0,
+                     help='每个连接每秒发送的消息数 (默认: 1)')
+    run.add_argument('--mix', type=str, default=DEFAULT_MIX,
+                     help=f'各类消息的比例 (默认: {DEFAULT_MIX})')
+    run.add_argument('--batch-size', type=int, default=10,
+                     help='data_batch 消息中的样本数 (默认: 10)')
+    run.add_argument('--window', type=int, default=1,
+                     help='每个连接最多同时等待确认的消息数，1表示等收到确认后再发送下一条 (默认: 1)')
+    run.add_argument('--timeout', type=float, default=10.0,
+                     help='连接和认证的超时时间，单位为秒 (默认: 10)')
+    run.add_argument('--report-interval', type=float, default=5.0,
+                     help='输出进度的周期，单位为秒，0表示不输出 (默认: 5)')
+    run.add_argument('--event-loop', type=str, default='auto', choices=['auto', 'uvloop', 'asyncio'],
+                     help='事件循环 (默认: auto)')
+    run.add_argument('--json', type=str, default=None,
+                     help='将结果以JSON格式写入指定文件')
+    return parser.parse_args()
+
+
+def parse_mix(text):
+    """
+    解析消息比例，如 "data=70,heartbeat=30"
+
+    Returns:
+        tuple: (消息类型列表, 权重列表)
+    """
+    kinds, weights = [], []
+    for part in text.split(','):
+        if not part.strip():
+            continue
+        kind, _, weight = part.partition('=')
+        kind = kind.strip()
+        if kind not in MESSAGE_KINDS:
+            raise ValueError(f"未知的消息类型: {kind}，可选: {', '.join(MESSAGE_KINDS)}")
+        kinds.append(kind)
+        weights.append(float(weight or 1))
+    if not kinds or sum(weights) <= 0:
+        raise ValueError("消息比例中至少需要一种权重大于0的消息类型")
+    return kinds, weights
+
+
+# ---------------------------------------------------------------- 设备创建
+
+def provision_devices(args):
+    """批量创建测试项目、设备和传感器，并将设备凭据写入文件"""
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'NovaCloud.settings')
+    import django
+    django.setup()
+
+    from django.contrib.auth.models import User
+    from django.db import transaction
+    from django.utils.crypto import get_random_string
+    from iot_devices.models import Device, Project, Sensor
+
+    if args.username:
+        user = User.objects.filter(username=args.username).first()
+        if not user:
+            print(f"错误: 用户 '{args.username}' 不存在")
+            return 1
+    else:
+        user = User.objects.first()
+        if not user:
+            print("错误: 系统中没有用户。请先创建用户，或使用--username参数指定现有用户")
+            return 1
+
+    templates = SENSOR_TEMPLATES[:max(1, min(args.sensors, len(SENSOR_TEMPLATES)))]
+    started = time.perf_counter()
+    with transaction.atomic():
+        project, _ = Project.objects.get_or_create(
+            name=args.project,
+            owner=user,
+            defaults={'description': '负载测试工具批量创建的设备'}
+        )
+        # 设备物理标识在项目内唯一，从已有设备数之后继续编号
+        offset = project.devices.count()
+        devices = [
+            Device(
+                name=f'负载测试设备{offset + index + 1:06d}',
+                device_identifier=f'LOAD_{offset + index + 1:06d}',
+                device_key=get_random_string(128),
+                project=project,
+                status='offline',
+            )
+            for index in range(args.count)
+        ]
+        Device.objects.bulk_create(devices, batch_size=PROVISION_BATCH_SIZE)
+        Sensor.objects.bulk_create(
+            [
+                Sensor(name=value_key, sensor_type=sensor_type, unit=unit, value_key=value_key, device=device)
+                for device in devices
+                for value_key, sensor_type, unit, _ in templates
+            ],
+            batch_size=PROVISION_BATCH_SIZE
+        )
+
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump({
+            "project_id": str(project.project_id),
+            "sensors": [template[0] for template in templates],
+            "devices": [{"device_id": str(device.device_id), "device_key": device.device_key} for device in devices],
+        }, f, ensure_ascii=False)
+
+    elapsed = time.perf_counter() - started
+    print(f"已在项目 {project.name} 中创建 {len(devices)} 个设备和 {len(devices) * len(templates)} 个传感器，"
+          f"耗时 {elapsed:.2f} 秒")
+    print(f"设备凭据已写入: {args.output}")
+    print(f"运行负载测试: python communication_handler/load_test.py run --devices {args.output}")
+    return 0
+
+
+# ---------------------------------------------------------------- 负载测试
+
+class LoadResults:
+    """负载测试结果：计数、按消息类型的确认延迟和错误"""
+
+    def __init__(self, kinds):
+        self.counters = {
+            'connects': 0,
+            'connect_errors': 0,
+            'auth_failed': 0,
+            'handshake_rejected': 0,
+            'disconnects': 0,
+            'reconnect_hints': 0,
+            'throttled': 0,
+            'commands_received': 0,
+            'readings_sent': 0,
+            'readings_acked': 0,
+            'unacked': 0,
+        }
+        self.sent = {kind: 0 for kind in kinds}
+        self.acked = {kind: 0 for kind in kinds}
+        self.errors = {kind: 0 for kind in kinds}
+        self.latency = {kind: LatencyHistogram() for kind in kinds}
+        self.auth_latency = LatencyHistogram()
+        self.active = 0
+        self.error_messages = {}
+
+    def incr(self, name, amount=1):
+        self.counters[name] += amount
+
+    def record_error(self, message):
+        """按内容统计服务器返回的错误，报告中列出最常见的几种"""
+        self.error_messages[message] = self.error_messages.get(message, 0) + 1
+
+    @property
+    def total_sent(self):
+        return sum(self.sent.values())
+
+    @property
+    def total_acked(self):
+        return sum(self.acked.values())
+
+    @property
+    def total_errors(self):
+        return sum(self.errors.values())
+
+
+class SimulatedDevice:
+    """
+    一个模拟设备连接
+
+    按固定速率发送随机选择类型的消息，按发送顺序与服务器的逐条响应配对计算确认延迟；
+    服务器推送的命令立即回复成功。连接断开或收到重连提示后按建议的时间重新连接。
+    """
+
+    def __init__(self, device, sensor_keys, args, kinds, weights, results, codec, stop_event):
+        self.device = device
+        self.sensor_keys = sensor_keys
+        self.args = args
+        self.kinds = kinds
+        self.weights = weights
+        self.results = results
+        self.codec = codec
+        self.stop_event = stop_event
+        self.retry_after = None
+
+    async def run(self, start_delay):
+        """在 start_delay 秒后开始，直到测试结束"""
+        await asyncio.sleep(start_delay)
+        backoff = 1.0
+        while not self.stop_event.is_set():
+            self.retry_after = None
+            try:
+                if not await self.session():
+                    return
+                backoff = 1.0
+            except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError, ValueError):
+                self.results.incr('connect_errors')
+            if self.stop_event.is_set():
+                return
+            delay = self.retry_after if self.retry_after is not None else backoff * random.uniform(1, 2)
+            backoff = min(backoff * 2, 30.0)
+            try:
+                await asyncio.wait_for(self.stop_event.wait(), timeout=delay)
+            except asyncio.TimeoutError:
+                pass
+
+    async def session(self):
+        """
+        建立一次连接：认证后同时发送和接收，直到测试结束或连接断开
+
+        Returns:
+            bool: 认证失败时返回False，不再重连
+        """
+        results = self.results
+        reader, writer = await asyncio.wait_for(
+            asyncio.open_connection(self.args.host, self.args.port), timeout=self.args.timeout
+        )
+        try:
+            auth_started = time.perf_counter()
+            writer.write(self.codec.dumps({
+                "type": "auth",
+                "device_id": self.device["device_id"],
+                "device_key": self.device["device_key"],
+            }) + b'\n')
+            line = await asyncio.wait_for(reader.readline(), timeout=self.args.timeout)
+            if not line:
+                raise ConnectionError("服务器在认证时关闭了连接")
+            response = self.codec.loads(line)
+            if response.get("status") != "ok":
+                if "retry_after_ms" in response:
+                    results.incr('handshake_rejected')
+                    self.retry_after = response["retry_after_ms"] / 1000
+                    return True
+                results.incr('auth_failed')
+                results.record_error(response.get("message"))
+                return False
+            results.auth_latency.record(time.perf_counter() - auth_started)
+            results.incr('connects')
+
+            results.active += 1
+            pending = collections.deque()  # 等待响应的消息：(类型, 发送时间, 读数数)
+            window = asyncio.Semaphore(max(1, self.args.window))
+            sender = asyncio.create_task(self.send_loop(writer, pending, window))
+            try:
+                await self.receive_loop(reader, writer, pending, window)
+            finally:
+                results.active -= 1
+                sender.cancel()
+                results.incr('unacked', sum(1 for kind, _, _ in pending if kind in results.sent))
+            return True
+        finally:
+            writer.close()
+
+    def build_message(self, kind):
+        """构造一条指定类型的消息，返回 (消息, 读数数)"""
+        now = time.time()
+        if kind == 'data':
+            return {"type": "data", "timestamp": now, "payload": self.random_readings()}, len(self.sensor_keys)
+        if kind == 'batch':
+            samples = [
+                {"timestamp": now - offset, "payload": self.random_readings()}
+                for offset in range(self.args.batch_size - 1, -1, -1)
+            ]
+            return {"type": "data_batch", "samples": samples}, len(samples) * len(self.sensor_keys)
+        if kind == 'status':
+            return {
+                "type": "status",
+                "timestamp": now,
+                "payload": {"battery": random.randint(0, 100), "rssi": random.randint(-100, -30)},
+            }, 0
+        return {"type": "heartbeat", "timestamp": now}, 0
+
+    def random_readings(self):
+        readings = {}
+        for key in self.sensor_keys:
+            low, high = SENSOR_RANGES.get(key, (0.0, 100.0))
+            readings[key] = round(random.uniform(low, high), 2)
+        return readings
+
+    async def send_loop(self, writer, pending, window):
+        """按固定速率发送消息，等待确认的消息达到窗口上限时暂停"""
+        loop = asyncio.get_running_loop()
+        interval = 1.0 / self.args.rate if self.args.rate > 0 else 0.0
+        # 随机错开各连接的发送时刻
+        next_at = loop.time() + random.uniform(0, interval)
+        while not self.stop_event.is_set():
+            delay = next_at - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            next_at = max(next_at + interval, loop.time() - interval)
+            await window.acquire()
+            if self.stop_event.is_set():
+                window.release()
+                return
+            kind = random.choices(self.kinds, self.weights)[0]
+            message, readings = self.build_message(kind)
+            pending.append((kind, time.perf_counter(), readings))
+            self.results.sent[kind] += 1
+            self.results.counters['readings_sent'] += readings
+            writer.write(self.codec.dumps(message) + b'\n')
+            await writer.drain()
+
+    async def receive_loop(self, reader, writer, pending, window):
+        """读取服务器消息，直到连接关闭；测试结束且没有未确认的消息时主动结束"""
+        results = self.results
+        while True:
+            if self.stop_event.is_set() and not pending:
+                return
+            try:
+                line = await asyncio.wait_for(reader.readline(), timeout=1.0)
+            except asyncio.TimeoutError:
+                if self.stop_event.is_set() and time.perf_counter() - self.stop_event.stopped_at > DRAIN_TIMEOUT:
+                    return
+                continue
+            if not line:
+                results.incr('disconnects')
+                return
+            message = self.codec.loads(line)
+            message_type = message.get("type")
+            if message_type == "command":
+                # 模拟设备执行命令，立即回复成功
+                results.incr('commands_received')
+                pending.append(('command_response', time.perf_counter(), 0))
+                writer.write(self.codec.dumps({
+                    "type": "command_response",
+                    "command_id": message.get("command_id"),
+                    "status": "success",
+                    "payload": message.get("payload"),
+                }) + b'\n')
+                continue
+            if message_type == "reconnect":
+                results.incr('reconnect_hints')
+                self.retry_after = message.get("retry_after_ms", 0) / 1000
+                continue
+            if message_type == "throttle":
+                results.incr('throttled')
+                if message.get("action") != "drop":
+                    # 延后处理的提示不对应任何消息，之后仍会收到该消息的确认
+                    continue
+            if not pending:
+                continue
+            kind, sent_at, readings = pending.popleft()
+            if kind not in results.sent:
+                continue
+            window.release()
+            results.latency[kind].record(time.perf_counter() - sent_at)
+            if message.get("status") == "ok":
+                results.acked[kind] += 1
+                results.counters['readings_acked'] += readings
+            else:
+                results.errors[kind] += 1
+                results.record_error(message.get("message"))
+
+
+class StopEvent(asyncio.Event):
+    """记录测试结束时间的事件，用于限制结束后等待确认的时间"""
+
+    stopped_at = None
+
+    def set(self):
+        if self.stopped_at is None:
+            self.stopped_at = time.perf_counter()
+        super().set()
+
+
+def format_latency(histogram):
+    """格式化确认延迟的百分位数"""
+    if not histogram.count:
+        return "无样本"
+    p50, p90, p99 = (histogram.percentile(q) for q in (0.5, 0.9, 0.99))
+    return f"p50={p50:.1f}ms p90={p90:.1f}ms p99={p99:.1f}ms 平均={histogram.sum_ms / histogram.count:.1f}ms"
+
+
+async def report_progress(results, interval, started):
+    """定期输出进度"""
+    last_sent = last_acked = 0
+    while True:
+        await asyncio.sleep(interval)
+        sent, acked = results.total_sent, results.total_acked
+        print(f"[{time.perf_counter() - started:6.1f}s] 在线连接={results.active} "
+              f"发送={(sent - last_sent) / interval:.0f}/s 确认={(acked - last_acked) / interval:.0f}/s "
+              f"错误={results.total_errors} 断开={results.counters['disconnects']}", flush=True)
+        last_sent, last_acked = sent, acked
+
+
+async def run_load(args, devices, sensor_keys, kinds, weights):
+    """运行负载测试并返回结果"""
+    codec = get_codec('auto')
+    results = LoadResults(kinds)
+    stop_event = StopEvent()
+    connections = args.connections or len(devices)
+    ramp_step = args.ramp_up / connections if args.ramp_up > 0 else 0.0
+
+    simulators = [
+        SimulatedDevice(devices[index % len(devices)], sensor_keys, args, kinds, weights, results, codec, stop_event)
+        for index in range(connections)
+    ]
+    started = time.perf_counter()
+    tasks = [asyncio.create_task(simulator.run(index * ramp_step)) for index, simulator in enumerate(simulators)]
+    reporter = None
+    if args.report_interval > 0:
+        reporter = asyncio.create_task(report_progress(results, args.report_interval, started))
+
+    # 计时从所有连接开始建立后算起，吞吐量按全部连接在线的时段计算
+    await asyncio.sleep(args.ramp_up)
+    measure_started = time.perf_counter()
+    sent_before, acked_before = results.total_sent, results.total_acked
+    readings_before = results.counters['readings_acked']
+    await asyncio.sleep(args.duration)
+    measured = time.perf_counter() - measure_started
+    sent_during = results.total_sent - sent_before
+    acked_during = results.total_acked - acked_before
+    readings_during = results.counters['readings_acked'] - readings_before
+
+    stop_event.set()
+    await asyncio.wait(tasks, timeout=DRAIN_TIMEOUT + args.timeout)
+    for task in tasks:
+        task.cancel()
+    if reporter:
+        reporter.cancel()
+
+    return results, {
+        'connections': connections,
+        'duration': round(measured, 3),
+        'sent_per_second': round(sent_during / measured, 1),
+        'acked_per_second': round(acked_during / measured, 1),
+        'readings_per_second': round(readings_during / measured, 1),
+    }
+
+
+def print_summary(results, throughput):
+    """输出测试结果汇总"""
+    counters = results.counters
+    print("\n========== 负载测试结果 ==========")
+    print(f"连接: 目标={throughput['connections']} 成功={counters['connects']} 连接失败={counters['connect_errors']} "
+          f"认证失败={counters['auth_failed']} 握手被拒绝={counters['handshake_rejected']} "
+          f"服务器断开={counters['disconnects']} 重连提示={counters['reconnect_hints']} 限流={counters['throttled']}")
+    print(f"认证延迟: {format_latency(results.auth_latency)}")
+    print(f"吞吐量（{throughput['duration']:.1f}秒）: 发送={throughput['sent_per_second']:.0f}条/s "
+          f"确认={throughput['acked_per_second']:.0f}条/s 读数={throughput['readings_per_second']:.0f}个/s")
+    for kind in results.sent:
+        sent = results.sent[kind]
+        error_rate = results.errors[kind] / sent * 100 if sent else 0.0
+        print(f"  {kind:<9} 发送={sent} 确认={results.acked[kind]} 错误={results.errors[kind]} "
+              f"({error_rate:.2f}%) {format_latency(results.latency[kind])}")
+    total_sent = results.total_sent
+    error_rate = results.total_errors / total_sent * 100 if total_sent else 0.0
+    print(f"合计: 发送={total_sent} 确认={results.total_acked} 错误={results.total_errors} ({error_rate:.2f}%) "
+          f"未确认={counters['unacked']} 收到命令={counters['commands_received']}")
+    if results.error_messages:
+        print("常见错误:")
+        for message, count in sorted(results.error_messages.items(), key=lambda item: -item[1])[:5]:
+            print(f"  {count} × {message}")
+
+
+def build_report(args, results, throughput):
+    """构造JSON格式的结果，便于保存和比较不同版本"""
+    def latency(histogram):
+        if not histogram.count:
+            return None
+        return {
+            'count': histogram.count,
+            'p50_ms': round(histogram.percentile(0.5), 3),
+            'p90_ms': round(histogram.percentile(0.9), 3),
+            'p99_ms': round(histogram.percentile(0.99), 3),
+            'mean_ms': round(histogram.sum_ms / histogram.count, 3),
+        }
+
+    return {
+        'config': {
+            'host': args.host,
+            'port': args.port,
+            'connections': throughput['connections'],
+            'duration': args.duration,
+            'rate': args.rate,
+            'mix': args.mix,
+            'batch_size': args.batch_size,
+            'window': args.window,
+        },
+        'throughput': throughput,
+        'counters': results.counters,
+        'auth_latency': latency(results.auth_latency),
+        'messages': {
+            kind: {
+                'sent': results.sent[kind],
+                'acked': results.acked[kind],
+                'errors': results.errors[kind],
+                'latency': latency(results.latency[kind]),
+            }
+            for kind in results.sent
+        },
+        'errors': results.error_messages,
+    }
+
+
+def run_load_test(args):
+    """run 子命令入口"""
+    try:
+        kinds, weights = parse_mix(args.mix)
+    except ValueError as e:
+        print(f"错误: {e}")
+        return 1
+    try:
+        with open(args.devices, encoding='utf-8') as f:
+            device_file = json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"错误: 无法读取设备文件 {args.devices}: {e}")
+        return 1
+    devices = device_file.get("devices") or []
+    if not devices:
+        print("错误: 设备文件中没有设备，请先运行 provision")
+        return 1
+
+    loop_name = install_event_loop(args.event_loop)
+    connections = args.connections or len(devices)
+    print(f"负载测试: {connections} 个连接 ({len(devices)} 个设备) -> {args.host}:{args.port}，"
+          f"每个连接 {args.rate:g} 条/秒，持续 {args.duration:g} 秒，消息比例 {args.mix}，事件循环: {loop_name}")
+    try:
+        results, throughput = asyncio.run(run_load(args, devices, device_file.get("sensors") or [], kinds, weights))
+    except KeyboardInterrupt:
+        print("\n负载测试被用户中断")
+        return 1
+
+    print_summary(results, throughput)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(build_report(args, results, throughput), f, ensure_ascii=False, indent=2)
+        print(f"结果已写入: {args.json}")
+    return 0
+
+
+def main():
+    """主函数"""
+    args = parse_args()
+    if args.action == 'provision':
+        return provision_devices(args)
+    return run_load_test(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
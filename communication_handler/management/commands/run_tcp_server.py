@@ -1,16 +1,64 @@
+import argparse
 import asyncio
+import hmac
 from django.core.management.base import BaseCommand
 from django.conf import settings
 import logging
 import json
-from django.utils import timezone
-from datetime import datetime
-from iot_devices.models import Device, Sensor, SensorData
-from asgiref.sync import sync_to_async
+import os
+import random
+import signal
+import time
+from django.core.exceptions import ValidationError
+from iot_devices.models import Device
+from communication_handler.admission import HandshakeAdmission, HandshakeRejected
+from communication_handler.auth_cache import auth_cache, key_digest
+from communication_handler.bus import LatestValueConsumer, MessageBus, load_broker_consumers
+from communication_handler.codec import CODEC_CHOICES, EVENT_LOOP_CHOICES, get_codec, install_event_loop
+from communication_handler.connections import ConnectionRegistry, DeviceConnection
+from communication_handler.control import (
+    DEFAULT_CONTROL_ADDRESS, ControlServer, register_local_dispatcher, unregister_local_dispatcher
+)
+from communication_handler.db_executor import DatabaseExecutor
+from communication_handler.dedup import DeadbandFilter
+from communication_handler.dispatcher import CommandDispatcher
+from communication_handler.framing import FrameDecodeError, FrameTooLargeError
+from communication_handler.ingest import (
+    MAX_BATCH_SAMPLES, SensorDataBatchWriter, SignalConsumer, build_batch_sensor_records, build_sensor_records,
+    parse_device_timestamp
+)
+from communication_handler.limits import (
+    RATE_LIMIT_ACTIONS, RATE_LIMIT_DEFER, SCOPE_DEVICE, ConnectionLimiter, IdleTimer, IngestRateLimiter, close_writer,
+    enable_keepalive
+)
+from communication_handler.metrics import COLLECT_TIMEOUT, METRICS_PUSH_INTERVAL, MetricsServer
+from communication_handler.presence import DevicePresenceTracker
+from communication_handler.protocol import (
+    ConnectionAcker, ProtocolNegotiationError, negotiate_ack_options, negotiate_framing,
+    negotiate_read_timeout, resolve_batch_samples, resolve_sensor_keys
+)
+from communication_handler.registry import device_registry
+from communication_handler.server_logging import (
+    DeviceActivitySummary, LogRateLimiter, PayloadSampler, setup_server_logging
+)
+from communication_handler.stats import ServerStats
+from communication_handler.supervisor import WorkerSupervisor, create_listening_socket
 
 # 配置日志
 logger = logging.getLogger(__name__)
 
+# 关闭连接时等待发送缓冲区清空的最长时间（秒），超时后直接中止
+CLOSE_TIMEOUT = 5.0
+# 服务器停止时发给设备的重连提示
+RECONNECT_MESSAGE = "服务器正在重启，请稍后重新连接"
+# 超过消息速率上限时的提示
+THROTTLE_MESSAGES = {
+    ('device', 'defer'): "设备消息速率超过上限，后续消息将延后处理",
+    ('device', 'drop'): "设备消息速率超过上限，消息已丢弃，请稍后重新发送",
+    ('project', 'defer'): "项目消息速率超过上限，后续消息将延后处理",
+    ('project', 'drop'): "项目消息速率超过上限，消息已丢弃，请稍后重新发送",
+}
+
 class Command(BaseCommand):
     help = 'NovaCloud TCP服务器 - 用于设备通信'
 
@@ -28,26 +76,294 @@ class Command(BaseCommand):
             default=getattr(settings, 'NOVA_TCP_SERVER_PORT', 8100),
             help='TCP服务器监听端口 (默认: settings.NOVA_TCP_SERVER_PORT 或 8100)'
         )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=getattr(settings, 'NOVA_TCP_INGEST_BATCH_SIZE', 500),
+            help='传感器数据批量写入的最大记录数 (默认: settings.NOVA_TCP_INGEST_BATCH_SIZE 或 500)'
+        )
+        parser.add_argument(
+            '--flush-interval',
+            type=float,
+            default=getattr(settings, 'NOVA_TCP_INGEST_FLUSH_INTERVAL', 0.05),
+            help='传感器数据批量写入的最长等待时间，单位为秒 (默认: settings.NOVA_TCP_INGEST_FLUSH_INTERVAL 或 0.05)'
+        )
+        parser.add_argument(
+            '--bus-queue-size',
+            type=int,
+            default=getattr(settings, 'NOVA_TCP_BUS_QUEUE_SIZE', 10000),
+            help='消息总线每个消费者的最大积压事件数，超过时丢弃最旧的事件 (默认: settings.NOVA_TCP_BUS_QUEUE_SIZE 或 10000)'
+        )
+        parser.add_argument(
+            '--presence-interval',
+            type=float,
+            default=getattr(settings, 'NOVA_TCP_PRESENCE_FLUSH_INTERVAL', 5.0),
+            help='设备最后在线时间批量写入的周期，单位为秒 (默认: settings.NOVA_TCP_PRESENCE_FLUSH_INTERVAL 或 5)'
+        )
+        parser.add_argument(
+            '--db-workers',
+            type=int,
+            default=getattr(settings, 'NOVA_TCP_DB_WORKERS', 4),
+            help='数据库工作线程数，每个线程持有独立连接 (默认: settings.NOVA_TCP_DB_WORKERS 或 4)'
+        )
+        parser.add_argument(
+            '--db-queue-size',
+            type=int,
+            default=getattr(settings, 'NOVA_TCP_DB_QUEUE_SIZE', 1000),
+            help='数据库任务队列上限，队满时暂停读取设备数据 (默认: settings.NOVA_TCP_DB_QUEUE_SIZE 或 1000)'
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=getattr(settings, 'NOVA_TCP_WORKERS', 1),
+            help='工作进程数，大于1时由主进程守护多个共享端口的事件循环进程 (默认: settings.NOVA_TCP_WORKERS 或 1)'
+        )
+        parser.add_argument(
+            '--no-reuse-port',
+            action='store_false',
+            dest='reuse_port',
+            help='多进程模式下不使用SO_REUSEPORT，改为由主进程预先绑定并共享监听套接字'
+        )
+        parser.add_argument(
+            '--stats-interval',
+            type=float,
+            default=getattr(settings, 'NOVA_TCP_STATS_INTERVAL', 60),
+            help='输出运行统计的周期，单位为秒，0表示不输出 (默认: settings.NOVA_TCP_STATS_INTERVAL 或 60)'
+        )
+        parser.add_argument(
+            '--metrics-address',
+            type=str,
+            default=getattr(settings, 'NOVA_TCP_METRICS_ADDRESS', ''),
+            help='提供Prometheus指标（GET /metrics）的HTTP监听地址 host:port，多进程模式下由主进程汇总后提供，空字符串表示不启用 '
+                 '(默认: settings.NOVA_TCP_METRICS_ADDRESS 或 不启用)'
+        )
+        parser.add_argument(
+            '--codec',
+            choices=CODEC_CHOICES,
+            default=getattr(settings, 'NOVA_TCP_JSON_CODEC', 'auto'),
+            help='设备协议使用的JSON编解码器，auto按 orjson、ujson、json 的顺序选择已安装的库 (默认: settings.NOVA_TCP_JSON_CODEC 或 auto)'
+        )
+        parser.add_argument(
+            '--event-loop',
+            choices=EVENT_LOOP_CHOICES,
+            default=getattr(settings, 'NOVA_TCP_EVENT_LOOP', 'auto'),
+            help='事件循环实现，auto在安装了uvloop时使用uvloop (默认: settings.NOVA_TCP_EVENT_LOOP 或 auto)'
+        )
+        parser.add_argument(
+            '--log-level',
+            choices=['DEBUG', 'INFO', 'WARNING', 'ERROR'],
+            type=str.upper,
+            default=getattr(settings, 'NOVA_TCP_LOG_LEVEL', 'INFO'),
+            help='TCP服务器日志级别，DEBUG会记录每条消息 (默认: settings.NOVA_TCP_LOG_LEVEL 或 INFO)'
+        )
+        parser.add_argument(
+            '--log-format',
+            choices=['text', 'json'],
+            default=getattr(settings, 'NOVA_TCP_LOG_FORMAT', 'text'),
+            help='日志格式，json为每行一条结构化记录 (默认: settings.NOVA_TCP_LOG_FORMAT 或 text)'
+        )
+        parser.add_argument(
+            '--log-sample-rate',
+            type=float,
+            default=getattr(settings, 'NOVA_TCP_LOG_SAMPLE_RATE', 0.0),
+            help='INFO级别下记录原始设备数据的采样比例，0~1 (默认: settings.NOVA_TCP_LOG_SAMPLE_RATE 或 0)'
+        )
+        parser.add_argument(
+            '--log-summary-interval',
+            type=float,
+            default=getattr(settings, 'NOVA_TCP_LOG_SUMMARY_INTERVAL', 60),
+            help='按设备汇总活动日志的周期，单位为秒，0表示不输出 (默认: settings.NOVA_TCP_LOG_SUMMARY_INTERVAL 或 60)'
+        )
+        parser.add_argument(
+            '--preload-devices',
+            action=argparse.BooleanOptionalAction,
+            default=getattr(settings, 'NOVA_TCP_PRELOAD_DEVICES', True),
+            help='启动时批量加载所有设备的认证信息和传感器 (默认: settings.NOVA_TCP_PRELOAD_DEVICES 或 开启)'
+        )
+        parser.add_argument(
+            '--handshake-concurrency',
+            type=int,
+            default=getattr(settings, 'NOVA_TCP_HANDSHAKE_CONCURRENCY', 100),
+            help='每个工作进程同时进行的需要访问数据库的设备认证数，0表示不限制 (默认: settings.NOVA_TCP_HANDSHAKE_CONCURRENCY 或 100)'
+        )
+        parser.add_argument(
+            '--handshake-max-wait',
+            type=float,
+            default=getattr(settings, 'NOVA_TCP_HANDSHAKE_MAX_WAIT', 2.0),
+            help='设备认证排队的最长等待时间，超时后回复稍后重试，单位为秒 (默认: settings.NOVA_TCP_HANDSHAKE_MAX_WAIT 或 2)'
+        )
+        parser.add_argument(
+            '--handshake-queue-size',
+            type=int,
+            default=getattr(settings, 'NOVA_TCP_HANDSHAKE_QUEUE_SIZE', 5000),
+            help='设备认证的最大排队数，超过时立即回复稍后重试 (默认: settings.NOVA_TCP_HANDSHAKE_QUEUE_SIZE 或 5000)'
+        )
+        parser.add_argument(
+            '--retry-after-ms',
+            type=int,
+            default=getattr(settings, 'NOVA_TCP_RETRY_AFTER_MS', 1000),
+            help='握手被拒绝时建议设备重试的基准间隔，实际值在1~2倍之间随机，单位为毫秒 (默认: settings.NOVA_TCP_RETRY_AFTER_MS 或 1000)'
+        )
+        parser.add_argument(
+            '--drain-timeout',
+            type=float,
+            default=getattr(settings, 'NOVA_TCP_DRAIN_TIMEOUT', 10.0),
+            help='收到SIGTERM或Ctrl+C后等待连接处理完已收到数据的最长时间，单位为秒 (默认: settings.NOVA_TCP_DRAIN_TIMEOUT 或 10)'
+        )
+        parser.add_argument(
+            '--reconnect-spread-ms',
+            type=int,
+            default=getattr(settings, 'NOVA_TCP_RECONNECT_SPREAD_MS', 10000),
+            help='服务器停止时建议设备重连的随机分散范围，实际值在 retry-after-ms 与 retry-after-ms 加该值之间，单位为毫秒 (默认: settings.NOVA_TCP_RECONNECT_SPREAD_MS 或 10000)'
+        )
+        parser.add_argument(
+            '--device-rate-limit',
+            type=float,
+            default=getattr(settings, 'NOVA_TCP_DEVICE_RATE_LIMIT', 100),
+            help='每个设备每秒最多处理的消息数，项目中配置了单设备速率上限时以项目为准，0表示不限制 (默认: settings.NOVA_TCP_DEVICE_RATE_LIMIT 或 100)'
+        )
+        parser.add_argument(
+            '--device-rate-burst',
+            type=int,
+            default=getattr(settings, 'NOVA_TCP_DEVICE_RATE_BURST', 200),
+            help='每个设备短时间内可以超出速率上限连续发送的消息数，0表示等于每秒速率 (默认: settings.NOVA_TCP_DEVICE_RATE_BURST 或 200)'
+        )
+        parser.add_argument(
+            '--project-rate-limit',
+            type=float,
+            default=getattr(settings, 'NOVA_TCP_PROJECT_RATE_LIMIT', 0),
+            help='每个项目的设备合计每秒最多处理的消息数，多进程模式下每个工作进程分别计算，项目中配置了项目速率上限时以项目为准，0表示不限制 '
+                 '(默认: settings.NOVA_TCP_PROJECT_RATE_LIMIT 或 0)'
+        )
+        parser.add_argument(
+            '--project-rate-burst',
+            type=int,
+            default=getattr(settings, 'NOVA_TCP_PROJECT_RATE_BURST', 0),
+            help='每个项目的设备短时间内可以超出速率上限连续发送的消息数，0表示等于每秒速率 (默认: settings.NOVA_TCP_PROJECT_RATE_BURST 或 0)'
+        )
+        parser.add_argument(
+            '--rate-limit-action',
+            choices=RATE_LIMIT_ACTIONS,
+            default=getattr(settings, 'NOVA_TCP_RATE_LIMIT_ACTION', RATE_LIMIT_DEFER),
+            help='超过速率上限时的处理方式：defer 暂停读取该连接并延后处理，drop 丢弃消息并回复限流响应 '
+                 f'(默认: settings.NOVA_TCP_RATE_LIMIT_ACTION 或 {RATE_LIMIT_DEFER})'
+        )
+        parser.add_argument(
+            '--auth-timeout',
+            type=float,
+            default=getattr(settings, 'NOVA_TCP_AUTH_TIMEOUT', 10),
+            help='连接建立后等待认证消息的最长时间，单位为秒，0表示不限制 (默认: settings.NOVA_TCP_AUTH_TIMEOUT 或 10)'
+        )
+        parser.add_argument(
+            '--idle-timeout',
+            type=float,
+            default=getattr(settings, 'NOVA_TCP_IDLE_TIMEOUT', 300),
+            help='认证后连续多长时间没有收到消息即断开，单位为秒，0表示不限制 (默认: settings.NOVA_TCP_IDLE_TIMEOUT 或 300)'
+        )
+        parser.add_argument(
+            '--heartbeat-misses',
+            type=float,
+            default=getattr(settings, 'NOVA_TCP_HEARTBEAT_MISSES', 3),
+            help='设备在认证时声明了心跳间隔时，连续错过多少个心跳间隔即断开，0表示不按心跳间隔断开 (默认: settings.NOVA_TCP_HEARTBEAT_MISSES 或 3)'
+        )
+        parser.add_argument(
+            '--max-line-size',
+            type=int,
+            default=getattr(settings, 'NOVA_TCP_MAX_LINE_SIZE', 262144),
+            help='单条消息（JSON行或二进制帧）的最大字节数，超过时断开连接 (默认: settings.NOVA_TCP_MAX_LINE_SIZE 或 262144)'
+        )
+        parser.add_argument(
+            '--max-connections',
+            type=int,
+            default=getattr(settings, 'NOVA_TCP_MAX_CONNECTIONS', 10000),
+            help='每个工作进程的最大连接数，超过时立即拒绝新连接，0表示不限制 (默认: settings.NOVA_TCP_MAX_CONNECTIONS 或 10000)'
+        )
+        parser.add_argument(
+            '--max-connections-per-ip',
+            type=int,
+            default=getattr(settings, 'NOVA_TCP_MAX_CONNECTIONS_PER_IP', 0),
+            help='每个工作进程中同一IP的最大连接数，0表示不限制 (默认: settings.NOVA_TCP_MAX_CONNECTIONS_PER_IP 或 0)'
+        )
+        parser.add_argument(
+            '--control-address',
+            type=str,
+            default=getattr(settings, 'NOVA_TCP_CONTROL_ADDRESS', DEFAULT_CONTROL_ADDRESS),
+            help='接收命令推送的本机控制地址，host:port 或 unix:路径，多进程模式下按工作进程序号递增端口或添加后缀，空字符串表示不启用 '
+                 f'(默认: settings.NOVA_TCP_CONTROL_ADDRESS 或 {DEFAULT_CONTROL_ADDRESS})'
+        )
+        parser.add_argument(
+            '--command-window',
+            type=int,
+            default=getattr(settings, 'NOVA_TCP_COMMAND_WINDOW', 8),
+            help='每个设备同时等待响应的最大命令数 (默认: settings.NOVA_TCP_COMMAND_WINDOW 或 8)'
+        )
+        parser.add_argument(
+            '--command-ack-timeout',
+            type=float,
+            default=getattr(settings, 'NOVA_TCP_COMMAND_ACK_TIMEOUT', 5.0),
+            help='等待设备响应命令的初始超时时间，每次重试加倍，单位为秒 (默认: settings.NOVA_TCP_COMMAND_ACK_TIMEOUT 或 5)'
+        )
+        parser.add_argument(
+            '--command-max-retries',
+            type=int,
+            default=getattr(settings, 'NOVA_TCP_COMMAND_MAX_RETRIES', 3),
+            help='设备未响应时命令的最大重发次数，之后标记为超时 (默认: settings.NOVA_TCP_COMMAND_MAX_RETRIES 或 3)'
+        )
+        parser.add_argument(
+            '--command-ttl',
+            type=float,
+            default=getattr(settings, 'NOVA_TCP_COMMAND_TTL', 300),
+            help='命令的有效期，创建超过该时间仍未确认的命令不再发送并标记为超时，单位为秒，0表示不过期 (默认: settings.NOVA_TCP_COMMAND_TTL 或 300)'
+        )
 
     async def handle_client_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
         """处理客户端连接"""
         addr = writer.get_extra_info('peername')
-        self.stdout.write(self.style.HTTP_INFO(f"接受来自 {addr} 的连接"))
+        client_ip = addr[0] if addr else None
+        self.stats.incr('connections_total')
+
+        # 超过连接数上限时立即拒绝，不读取任何数据
+        rejection = self.connection_limiter.acquire(client_ip)
+        if rejection:
+            self.stats.incr('connections_rejected')
+            if self.warning_limiter.allow(('connection_rejected', client_ip)):
+                logger.warning(f"拒绝来自 {addr} 的连接: {rejection}（同类告警限频）",
+                               extra={'event': 'connection_rejected', 'addr': addr})
+            writer.write(self.codec.dumps({"status": "error", "message": rejection}) + b'\n')
+            writer.close()
+            return
+
+        logger.debug(f"接受来自 {addr} 的连接", extra={'event': 'connect', 'addr': addr})
+        self.stats.incr('connections_active')
+        # 登记当前连接，服务器停止时据此停止读取并等待处理完成
+        client_task = asyncio.current_task()
+        self.client_streams[client_task] = (reader, writer)
+        enable_keepalive(writer)
+        # 认证前使用认证超时，认证后切换为空闲超时
+        idle_timer = IdleTimer(writer.transport, self.auth_timeout)
         
         authenticated_device_id = None  # 用于存储认证成功的设备ID
+        acker = None  # 按认证时协商的确认模式发送成功确认
+        connection = None  # 登记到连接注册表中的连接，用于推送命令
 
         try:
             # 1. 接收认证数据 (假设以换行符结束的JSON)
-            auth_data_raw = await reader.readline()
+            try:
+                auth_data_raw = await reader.readline()
+            except ValueError:
+                logger.warning(f"来自 {addr} 的认证消息长度超过上限，关闭连接", extra={'event': 'auth_invalid', 'addr': addr})
+                return
             if not auth_data_raw:
-                self.stdout.write(self.style.WARNING(f"未收到来自 {addr} 的认证数据，关闭连接"))
+                if idle_timer.expired:
+                    self.stats.incr('timeouts')
+                    logger.debug(f"等待 {addr} 的认证消息超时，关闭连接", extra={'event': 'auth_timeout', 'addr': addr})
+                else:
+                    logger.debug(f"未收到来自 {addr} 的认证数据，关闭连接", extra={'event': 'auth_missing', 'addr': addr})
                 return  # 结束协程
 
-            auth_data_str = auth_data_raw.decode().strip()
-            self.stdout.write(f"来自 {addr} 的认证尝试: {auth_data_str}")
-
+            handshake_started = time.monotonic()
             try:
-                auth_payload = json.loads(auth_data_str)
+                auth_payload = self.codec.loads(auth_data_raw)
                 if auth_payload.get("type") != "auth":
                     raise ValueError("无效的认证类型")
                 
@@ -57,41 +373,127 @@ class Command(BaseCommand):
                 if not device_id_str or not device_key_str:
                     raise ValueError("认证信息缺少device_id或device_key")
 
+                # 协商确认模式和帧格式，未指定时保持每条消息确认和换行分隔的JSON
+                ack_options = negotiate_ack_options(auth_payload)
+                framing = negotiate_framing(auth_payload, self.codec, self.max_line_size)
+                read_timeout = negotiate_read_timeout(auth_payload, self.idle_timeout, self.heartbeat_misses)
+
+                # 不记录 device_key
+                logger.debug(f"来自 {addr} 的认证尝试: 设备 {device_id_str}",
+                             extra={'event': 'auth_attempt', 'device_id': device_id_str, 'addr': addr})
+
             except (json.JSONDecodeError, ValueError) as e:
-                self.stderr.write(self.style.ERROR(f"来自 {addr} 的认证信息无效: {e}，关闭连接"))
-                await self.send_json_response(writer, {"status": "error", "message": "无效的认证信息格式"})
+                logger.warning(f"来自 {addr} 的认证信息无效: {e}，关闭连接", extra={'event': 'auth_invalid', 'addr': addr})
+                message = str(e) if isinstance(e, ProtocolNegotiationError) else "无效的认证信息格式"
+                await self.send_json_response(writer, {"status": "error", "message": message})
                 return
 
-            # 2. 验证凭据
-            device_instance = await self.authenticate_device_orm(device_id_str, device_key_str)
+            # 2. 验证凭据，需要访问数据库时受握手准入控制
+            try:
+                device_instance = await self.authenticate_device(device_id_str, device_key_str)
+            except HandshakeRejected as e:
+                self.stats.incr('handshake_rejected')
+                logger.debug(f"设备 {device_id_str} 的握手被拒绝: {e}",
+                             extra={'event': 'handshake_rejected', 'device_id': device_id_str, 'addr': addr})
+                await self.send_json_response(writer, {
+                    "status": "error",
+                    "message": str(e),
+                    "retry_after_ms": e.retry_after_ms
+                })
+                return
 
             if device_instance:
+                self.stats.incr('auth_success')
                 authenticated_device_id = device_id_str
-                self.stdout.write(self.style.SUCCESS(f"设备 {device_id_str} 认证成功，来自 {addr}"))
-                await self.send_json_response(writer, {"status": "ok", "message": "认证成功"})
-                
                 # 更新设备状态为'online'
-                await self.update_device_status(authenticated_device_id, 'online')
+                self.presence_tracker.connect(authenticated_device_id)
+                logger.info(f"设备 {device_id_str} 认证成功，来自 {addr}",
+                            extra={'event': 'auth_success', 'device_id': device_id_str, 'addr': addr})
+                auth_response = {"status": "ok", "message": "认证成功"}
+                if 'ack' in auth_payload:
+                    auth_response.update(ack_options)
+                if 'heartbeat_interval' in auth_payload:
+                    auth_response["read_timeout"] = read_timeout
+                sensor_keys = ()
+                if framing.binary:
+                    # 二进制帧中以传感器序号代替 value_key，序号表在本连接内保持不变
+                    entry = await self.get_device_entry(authenticated_device_id)
+                    sensor_keys = entry.sensor_keys if entry else ()
+                    auth_response.update({"framing": framing.name, "sensors": list(sensor_keys)})
+                # 认证响应始终使用JSON行，之后的消息使用协商的帧格式
+                await self.send_json_response(writer, auth_response)
+                self.stats.observe('handshake_latency', time.monotonic() - handshake_started)
+
+                async def send(response):
+                    await self.send_response(writer, framing, response)
+
+                acker = ConnectionAcker(send, ack_options, self.stats)
+                # 登记连接，控制通道收到该设备的命令时通过此连接推送
+                connection = DeviceConnection(authenticated_device_id, addr, send)
+                self.connections.register(connection)
+                # 重新发送该设备尚未确认的命令
+                self.command_dispatcher.attach(authenticated_device_id)
+                # 按项目配置的速率上限为设备和项目创建令牌桶
+                self.rate_limiter.attach(authenticated_device_id, device_instance.project)
+                throttle_notified = False
                 
-                self.stdout.write(self.style.SUCCESS(f"设备 {authenticated_device_id} 已准备好接收数据"))
+                idle_timer.reset(read_timeout)
                 
                 # 进入数据接收循环
                 while True:
                     try:
-                        line_raw = await reader.readline()
+                        line_raw = await framing.read(reader)
                         if not line_raw:
-                            self.stdout.write(self.style.WARNING(f"设备 {authenticated_device_id} 关闭了连接 (EOF)"))
+                            if idle_timer.expired:
+                                self.stats.incr('timeouts')
+                                logger.info(f"设备 {authenticated_device_id} 超过 {read_timeout:g} 秒没有消息，已断开",
+                                            extra={'event': 'idle_timeout', 'device_id': authenticated_device_id, 'addr': addr})
+                            else:
+                                logger.debug(f"设备 {authenticated_device_id} 关闭了连接 (EOF)")
                             break  # 连接已关闭
+                        if self.draining:
+                            # 服务器正在停止，缓冲区中尚未处理的消息不确认，设备重连后重新发送
+                            break
+                        idle_timer.touch()
+                        acker.mark_received()
 
-                        line_str = line_raw.decode().strip()
-                        if not line_str:  # 空行忽略
+                        if not framing.binary and not line_raw.strip():  # 空行忽略
                             continue
 
-                        self.stdout.write(f"来自设备 {authenticated_device_id} 的数据: {line_str}")
+                        # DEBUG级别记录全部原始数据，否则按采样率记录
+                        if logger.isEnabledFor(logging.DEBUG):
+                            logger.debug(f"来自设备 {authenticated_device_id} 的数据: {self.format_raw_line(line_raw, framing.binary)}",
+                                         extra={'event': 'payload', 'device_id': authenticated_device_id})
+                        elif self.payload_sampler.should_log():
+                            logger.info(f"[采样] 来自设备 {authenticated_device_id} 的数据: {self.format_raw_line(line_raw, framing.binary)}",
+                                        extra={'event': 'payload_sample', 'device_id': authenticated_device_id})
+                        self.stats.incr('messages')
+
+                        # 在解析之前检查速率上限，超限的消息不占用解析、写入和确认的开销
+                        throttle = self.rate_limiter.check(authenticated_device_id)
+                        if throttle is not None:
+                            self.stats.incr('messages_throttled')
+                            if self.warning_limiter.allow((authenticated_device_id, 'throttled')):
+                                logger.warning(f"设备 {authenticated_device_id} 超过{'设备' if throttle.scope == SCOPE_DEVICE else '项目'}消息速率上限，"
+                                               f"{'延后处理' if self.rate_limiter.defer else '丢弃'}超出的消息（同类告警限频）",
+                                               extra={'event': 'throttled', 'device_id': authenticated_device_id, 'scope': throttle.scope})
+                            reply = self.throttle_reply(throttle)
+                            if not self.rate_limiter.defer:
+                                # 丢弃模式：限流响应代替确认，设备稍后重新发送
+                                await send(reply)
+                                continue
+                            # 延后模式：暂停读取该连接，发送缓冲区写满后设备自然放慢；每段连续限流只提示一次
+                            if not throttle_notified:
+                                throttle_notified = True
+                                await send(reply)
+                            await self.rate_limiter.wait(authenticated_device_id, throttle)
+                        else:
+                            throttle_notified = False
 
                         try:
-                            data_payload_json = json.loads(line_str)
+                            data_payload_json = framing.decode(line_raw)
                             msg_type = data_payload_json.get("type")
+                            self.stats.count_message(msg_type)
 
                             if msg_type == "data":
                                 # 处理传感器数据
@@ -99,8 +501,10 @@ class Command(BaseCommand):
                                 device_timestamp_unix = data_payload_json.get("timestamp")
 
                                 if not sensor_readings:
-                                    self.stdout.write(self.style.WARNING(f"来自设备 {authenticated_device_id} 的传感器读数为空，已忽略"))
+                                    logger.debug(f"来自设备 {authenticated_device_id} 的传感器读数为空，已忽略")
                                     continue
+                                if framing.binary and isinstance(sensor_readings, dict):
+                                    sensor_readings = resolve_sensor_keys(sensor_readings, sensor_keys)
 
                                 # 处理传感器数据并存储
                                 data_count = await self.process_and_store_sensor_data(
@@ -112,222 +516,692 @@ class Command(BaseCommand):
                                 
                                 # 更新设备 last_seen 和状态
                                 await self.update_device_status(authenticated_device_id, 'online')
+                                self.activity_summary.record(authenticated_device_id, data_count)
                                 
                                 # 发送数据接收确认
-                                await self.send_json_response(writer, {
+                                await acker.ack({
                                     "status": "ok", 
                                     "message": f"数据已接收并存储，处理了{data_count}个传感器读数"
-                                })
+                                }, data_payload_json.get("seq"))
                                 
+                            elif msg_type == "data_batch":
+                                # 处理设备缓存后批量补传的传感器数据
+                                samples = data_payload_json.get("samples")
+                                if not isinstance(samples, list) or not samples:
+                                    await send({
+                                        "status": "error",
+                                        "message": "批量数据的samples必须是非空数组"
+                                    })
+                                    continue
+                                if len(samples) > MAX_BATCH_SAMPLES:
+                                    await send({
+                                        "status": "error",
+                                        "message": f"批量数据最多包含{MAX_BATCH_SAMPLES}个样本"
+                                    })
+                                    continue
+                                if framing.binary:
+                                    samples = resolve_batch_samples(samples, sensor_keys)
+
+                                data_count, rejected_count = await self.process_and_store_sensor_batch(
+                                    authenticated_device_id,
+                                    samples
+                                )
+
+                                # 更新设备 last_seen 和状态
+                                await self.update_device_status(authenticated_device_id, 'online')
+                                self.activity_summary.record(authenticated_device_id, data_count)
+
+                                # 发送批量数据接收确认
+                                await acker.ack({
+                                    "status": "ok",
+                                    "message": f"批量数据已接收并存储，{len(samples)}个样本处理了{data_count}个传感器读数",
+                                    "accepted": len(samples) - rejected_count,
+                                    "rejected": rejected_count
+                                }, data_payload_json.get("seq"))
+
                             elif msg_type == "heartbeat":
                                 # 处理心跳包
-                                self.stdout.write(self.style.SUCCESS(f"收到设备 {authenticated_device_id} 的心跳"))
+                                logger.debug(f"收到设备 {authenticated_device_id} 的心跳")
                                 
                                 # 更新设备 last_seen 和状态
                                 await self.update_device_status(authenticated_device_id, 'online')
+                                self.activity_summary.record(authenticated_device_id)
                                 
                                 # 回复心跳确认
-                                await self.send_json_response(writer, {
+                                await acker.ack({
                                     "status": "ok", 
                                     "message": "心跳已确认"
-                                })
+                                }, data_payload_json.get("seq"))
                                 
                             elif msg_type == "status":
                                 # 处理设备状态上报
                                 status_payload = data_payload_json.get("payload", {})
-                                self.stdout.write(f"设备 {authenticated_device_id} 状态上报: {status_payload}")
+                                logger.debug(f"设备 {authenticated_device_id} 状态上报: {status_payload}")
                                 
                                 # 更新设备 last_seen 和状态
                                 await self.update_device_status(authenticated_device_id, 'online')
+                                self.activity_summary.record(authenticated_device_id)
                                 
                                 # 回复状态接收确认
-                                await self.send_json_response(writer, {
+                                await acker.ack({
                                     "status": "ok", 
                                     "message": "状态已接收"
-                                })
+                                }, data_payload_json.get("seq"))
+
+                            elif msg_type == "command_response":
+                                # 设备对推送命令的响应，更新对应的命令日志
+                                response = self.handle_command_response(authenticated_device_id, data_payload_json)
+                                self.activity_summary.record(authenticated_device_id)
+                                if response["status"] == "ok":
+                                    await acker.ack(response, data_payload_json.get("seq"))
+                                else:
+                                    await send(response)
                                 
                             else:
                                 # 未知消息类型
-                                self.stderr.write(self.style.ERROR(f"来自设备 {authenticated_device_id} 的未知消息类型 '{msg_type}'，已忽略"))
-                                await self.send_json_response(writer, {
+                                if self.warning_limiter.allow((authenticated_device_id, 'unknown_type')):
+                                    logger.warning(f"来自设备 {authenticated_device_id} 的未知消息类型 '{msg_type}'，已忽略（同类告警限频）",
+                                                   extra={'event': 'unknown_type', 'device_id': authenticated_device_id, 'msg_type': msg_type})
+                                await send({
                                     "status": "error", 
                                     "message": f"未知消息类型: {msg_type}"
                                 })
 
-                        except json.JSONDecodeError:
-                            self.stderr.write(self.style.ERROR(f"来自设备 {authenticated_device_id} 的JSON数据无效: {line_str}，已忽略"))
-                            await self.send_json_response(writer, {"status": "error", "message": "无效的JSON数据格式"})
+                        except (json.JSONDecodeError, FrameDecodeError):
+                            if self.warning_limiter.allow((authenticated_device_id, 'invalid_json')):
+                                logger.warning(f"来自设备 {authenticated_device_id} 的{framing.name}数据无效: {self.format_raw_line(line_raw, framing.binary)}，已忽略（同类告警限频）",
+                                               extra={'event': 'invalid_json', 'device_id': authenticated_device_id})
+                            await send({"status": "error", "message": framing.decode_error_message})
                         except Exception as e_proc:  # 捕获处理数据时的其他错误
-                            self.stderr.write(self.style.ERROR(f"处理来自设备 {authenticated_device_id} 的数据时出错: {e_proc}"))
-                            await self.send_json_response(writer, {"status": "error", "message": "处理数据时出错"})
+                            self.stats.incr('errors')
+                            logger.error(f"处理来自设备 {authenticated_device_id} 的数据时出错: {e_proc}",
+                                         extra={'event': 'process_error', 'device_id': authenticated_device_id})
+                            await send({"status": "error", "message": "处理数据时出错"})
                     
+                    except FrameTooLargeError as e_frame:
+                        # 无法跳过过长的消息继续同步消息边界，回复错误后关闭连接
+                        logger.warning(f"设备 {authenticated_device_id} 的{e_frame}，关闭连接",
+                                       extra={'event': 'frame_too_large', 'device_id': authenticated_device_id})
+                        await send({"status": "error", "message": str(e_frame)})
+                        break
                     except asyncio.IncompleteReadError:
-                        self.stdout.write(self.style.WARNING(f"从设备 {authenticated_device_id} 读取数据不完整，连接可能正在关闭"))
+                        logger.debug(f"从设备 {authenticated_device_id} 读取数据不完整，连接可能正在关闭")
                         break
                     except ConnectionResetError:
-                        self.stdout.write(self.style.WARNING(f"与设备 {authenticated_device_id} 的连接在数据阶段被重置"))
+                        logger.info(f"与设备 {authenticated_device_id} 的连接在数据阶段被重置")
                         break
                     except Exception as e_loop:
-                        self.stderr.write(self.style.ERROR(f"设备 {authenticated_device_id} 的数据循环中出错: {e_loop}"))
+                        logger.error(f"设备 {authenticated_device_id} 的数据循环中出错: {e_loop}",
+                                     extra={'event': 'loop_error', 'device_id': authenticated_device_id})
                         break  # 退出循环
 
             else:
-                self.stderr.write(self.style.ERROR(f"设备 {device_id_str} 认证失败，来自 {addr}"))
+                self.stats.incr('auth_failed')
+                logger.warning(f"设备 {device_id_str} 认证失败，来自 {addr}",
+                               extra={'event': 'auth_failed', 'device_id': device_id_str, 'addr': addr})
                 await self.send_json_response(writer, {"status": "error", "message": "认证失败，无效的凭据"})
+                self.stats.observe('handshake_latency', time.monotonic() - handshake_started)
                 return  # 认证失败，关闭连接
 
         except ConnectionResetError:
-            self.stdout.write(self.style.WARNING(f"连接被重置: {addr}"))
+            logger.info(f"连接被重置: {addr}")
         except asyncio.IncompleteReadError:
-            self.stdout.write(self.style.WARNING(f"读取不完整，来自 {addr}，连接可能已关闭"))
+            logger.debug(f"读取不完整，来自 {addr}，连接可能已关闭")
         except Exception as e:
-            self.stderr.write(self.style.ERROR(f"处理客户端 {addr} 时出错: {e}"))
+            logger.error(f"处理客户端 {addr} 时出错: {e}", extra={'event': 'connection_error', 'addr': addr})
         finally:
+            self.stats.decr('connections_active')
+            self.connection_limiter.release(client_ip)
+            if acker is not None and not idle_timer.expired:
+                # 发送尚未发出的累计确认
+                await acker.close()
+            idle_timer.cancel()
+            if connection is not None:
+                if self.draining and not idle_timer.expired:
+                    # 服务器正在停止，提示设备在随机分散的时间后重连，避免所有设备同时重连
+                    try:
+                        await connection.send({
+                            "type": "reconnect",
+                            "message": RECONNECT_MESSAGE,
+                            "retry_after_ms": self.reconnect_after()
+                        })
+                    except (ConnectionError, OSError, RuntimeError):
+                        pass
+                self.connections.unregister(connection)
+                self.command_dispatcher.detach(authenticated_device_id)
+                if authenticated_device_id not in self.connections:
+                    self.rate_limiter.detach(authenticated_device_id)
             if authenticated_device_id:
-                # 设备断开连接，更新状态为'offline'
-                await self.update_device_status(authenticated_device_id, 'offline')
-                self.stdout.write(self.style.HTTP_INFO(f"设备 {authenticated_device_id} 已断开连接，来自 {addr}"))
+                # 设备断开连接，没有其他连接时由在线状态跟踪器批量标记为'offline'
+                self.presence_tracker.disconnect(authenticated_device_id)
+                logger.info(f"设备 {authenticated_device_id} 已断开连接，来自 {addr}",
+                            extra={'event': 'disconnect', 'device_id': authenticated_device_id, 'addr': addr})
             
-            self.stdout.write(self.style.HTTP_INFO(f"关闭与 {addr} 的连接"))
-            writer.close()
-            await writer.wait_closed()
+            logger.debug(f"关闭与 {addr} 的连接")
+            await close_writer(writer, CLOSE_TIMEOUT)
+            self.client_streams.pop(client_task, None)
 
-    @sync_to_async
     def authenticate_device_orm(self, device_id_str, device_key_str):
-        """通过ORM验证设备凭据"""
+        """认证缓存未命中时通过ORM验证设备凭据，在数据库执行器的工作线程中调用"""
         try:
-            device = Device.objects.get(device_id=device_id_str, device_key=device_key_str)
-            # 可选：这里可以检查device的其他状态，如device.status != 'disabled'
-            return device  # 返回device实例
-        except Device.DoesNotExist:
+            # 只按device_id查询，密钥在进程内以恒定时间比较
+            device = Device.objects.select_related('project').get(device_id=device_id_str)
+        except (Device.DoesNotExist, ValidationError, ValueError):
+            auth_cache.store_missing(device_id_str)
             return None
         except Exception as e:
-            self.stderr.write(self.style.ERROR(f"验证设备 {device_id_str} 时ORM错误: {e}"))
+            logger.error(f"验证设备 {device_id_str} 时ORM错误: {e}")
             return None
+
+        auth_cache.store(device_id_str, device.device_key)
+        if not hmac.compare_digest(key_digest(device.device_key), key_digest(device_key_str)):
+            return None
+        # 可选：这里可以检查device的其他状态，如device.status != 'disabled'
+        # 认证成功时加载设备及其传感器到注册表，后续数据消息不再查询
+        device_registry.register(device)
+        return device  # 返回device实例
     
     async def authenticate_device(self, device_id_str, device_key_str):
-        """异步验证设备凭据"""
-        device_instance = await self.authenticate_device_orm(device_id_str, device_key_str)
-        return device_instance is not None
-    
-    @sync_to_async
-    def update_device_status_orm(self, device_id_str, status):
-        """通过ORM更新设备状态"""
-        try:
-            device = Device.objects.get(device_id=device_id_str)
-            device.status = status
-            if status == 'online':
-                device.last_seen = timezone.now()
-                device.save(update_fields=['status', 'last_seen'])
-            else:
-                device.save(update_fields=['status'])
-            return True
-        except Device.DoesNotExist:
-            self.stderr.write(self.style.ERROR(f"更新状态时设备 {device_id_str} 不存在"))
-            return False
-        except Exception as e:
-            self.stderr.write(self.style.ERROR(f"更新设备 {device_id_str} 状态时ORM错误: {e}"))
-            return False
+        """
+        异步验证设备凭据
+
+        认证缓存和设备注册表都命中时不访问数据库，缓存中确定凭据无效时也不访问数据库；
+        需要访问数据库时先占用握手名额。注册表条目过期时按重新加载的设备密钥再次验证，
+        因此认证缓存中的旧密钥最多在 NOVA_TCP_REGISTRY_TTL 秒内有效。
+
+        Returns:
+            Device: 验证失败时返回None
+
+        Raises:
+            HandshakeRejected: 握手排队已满或等待超时
+        """
+        verified = auth_cache.verify(device_id_str, device_key_str)
+        if verified is False:
+            return None
+        if verified:
+            entry = device_registry.get(device_id_str)
+            if entry is not None:
+                return entry.device
+
+        async with self.handshake_admission.slot():
+            if verified is None:
+                return await self.db_executor.run(self.authenticate_device_orm, device_id_str, device_key_str)
+            entry = await self.db_executor.run(self.load_device_entry_orm, device_id_str)
+            if entry is None:
+                return None
+            # 重新加载的设备带有数据库中的最新密钥，Web进程中重新生成的密钥最迟在注册表条目过期后生效
+            auth_cache.store(device_id_str, entry.device.device_key)
+            if not hmac.compare_digest(key_digest(entry.device.device_key), key_digest(device_key_str)):
+                return None
+            return entry.device
 
+    def preload_devices_orm(self):
+        """启动时批量加载认证缓存和设备注册表，在数据库执行器的工作线程中调用"""
+        auth_count = auth_cache.preload()
+        registry_count = device_registry.preload()
+        return auth_count, registry_count
+    
     async def update_device_status(self, device_id_str, status):
-        """异步更新设备状态"""
-        return await self.update_device_status_orm(device_id_str, status)
+        """
+        记录设备状态，由在线状态跟踪器定期批量写入数据库
 
-    @sync_to_async
-    def store_sensor_data_orm(self, device_id_str, device_obj, sensor_readings, device_timestamp_unix):
-        """通过ORM存储传感器数据"""
+        'online' 只刷新内存中的最后在线时间，状态仅在真正变化时写入
+        """
+        if status == 'online':
+            self.presence_tracker.seen(device_id_str)
+        else:
+            self.presence_tracker.set_status(device_id_str, status)
+        return True
+
+    def load_device_entry_orm(self, device_id_str):
+        """注册表未命中时，通过ORM重新加载设备及其传感器，在数据库执行器的工作线程中调用"""
         try:
-            # 确定时间戳
-            if device_timestamp_unix:
-                try:
-                    # 假设是秒级 Unix 时间戳
-                    record_timestamp = datetime.fromtimestamp(int(device_timestamp_unix), tz=timezone.get_current_timezone())
-                except ValueError:
-                    self.stderr.write(self.style.ERROR(f"设备 {device_id_str} 提供的时间戳 {device_timestamp_unix} 无效，使用服务器时间"))
-                    record_timestamp = timezone.now()
-            else:
-                record_timestamp = timezone.now()
+            return device_registry.load(device_id_str)
+        except Exception as e_orm:
+            logger.error(f"加载设备 {device_id_str} 的传感器时ORM错误: {e_orm}")
+            return None
 
-            created_data_count = 0
-            for value_key, value in sensor_readings.items():
-                try:
-                    sensor = Sensor.objects.get(device=device_obj, value_key=value_key)
-                    
-                    # 根据值的类型存入对应字段
-                    data_entry = SensorData(sensor=sensor, timestamp=record_timestamp)
-                    if isinstance(value, bool):
-                        data_entry.value_boolean = value
-                    elif isinstance(value, (int, float)):
-                        data_entry.value_float = float(value)
-                    elif isinstance(value, str):
-                        data_entry.value_string = value
-                    elif isinstance(value, dict) or isinstance(value, list):  # JSONField 可以存 dict 或 list
-                        data_entry.value_json = value
-                    else:
-                        self.stderr.write(self.style.WARNING(f"设备 {device_id_str} 的 {value_key} 值类型不支持: {type(value)}，以字符串形式存储"))
-                        data_entry.value_string = str(value)  # 降级为字符串存储
-                    
-                    data_entry.save()
-                    created_data_count += 1
-                    self.stdout.write(f"已存储设备 {device_id_str} 的 {sensor} 数据")
+    async def get_device_entry(self, device_id_str):
+        """从设备注册表获取设备条目，命中时不访问数据库；重新加载后按最新的项目配置更新速率限制"""
+        entry = device_registry.get(device_id_str)
+        if entry is None:
+            entry = await self.db_executor.run(self.load_device_entry_orm, device_id_str)
+            if entry is not None:
+                self.rate_limiter.refresh(device_id_str, entry.device.project)
+        return entry
 
-                except Sensor.DoesNotExist:
-                    self.stderr.write(self.style.WARNING(f"设备 {device_id_str} 没有value_key为 '{value_key}' 的传感器，数据已忽略"))
-                except Exception as e_save:
-                    self.stderr.write(self.style.ERROR(f"保存设备 {device_id_str} 的 {value_key} 传感器数据时出错: {e_save}"))
-            return created_data_count
+    async def process_and_store_sensor_data(self, device_id_str, device_obj, sensor_readings, device_timestamp_unix):
+        """异步处理传感器数据，并交由批量写入器与其他连接的数据合并写入"""
+        entry = await self.get_device_entry(device_id_str)
+        if entry is None:
+            logger.error(f"设备 {device_id_str} 不存在，数据已忽略")
+            return 0
 
-        except Exception as e_orm:
-            self.stderr.write(self.style.ERROR(f"处理设备 {device_id_str} 的传感器数据时ORM错误: {e_orm}"))
+        record_timestamp = parse_device_timestamp(device_timestamp_unix)
+        records = build_sensor_records(device_id_str, entry.sensors, sensor_readings, record_timestamp)
+        # 省略与上一条已存储读数相差不超过死区的读数
+        records, suppressed_count = self.deadband_filter.filter(records)
+        try:
+            stored_count = await self.sensor_data_writer.submit(records)
+            self.stats.incr('readings_stored', stored_count)
+            self.stats.incr('readings_suppressed', suppressed_count)
+            return stored_count + suppressed_count
+        except Exception as e_save:
+            self.deadband_filter.forget(record.sensor_id for record in records)
+            logger.error(f"保存设备 {device_id_str} 的传感器数据时出错: {e_save}")
             return 0
 
-    async def process_and_store_sensor_data(self, device_id_str, device_obj, sensor_readings, device_timestamp_unix):
-        """异步处理和存储传感器数据"""
-        return await self.store_sensor_data_orm(device_id_str, device_obj, sensor_readings, device_timestamp_unix)
+    async def process_and_store_sensor_batch(self, device_id_str, samples):
+        """
+        异步处理批量补传的传感器数据，所有样本作为一次提交交由批量写入器写入
+
+        Returns:
+            tuple: (已处理的读数数，包括因死区压缩未存储的读数, 被拒绝的样本数)
+        """
+        entry = await self.get_device_entry(device_id_str)
+        if entry is None:
+            logger.error(f"设备 {device_id_str} 不存在，数据已忽略")
+            return 0, len(samples)
+
+        records, signal_records, rejected_count = build_batch_sensor_records(device_id_str, entry.sensors, samples)
+        records, suppressed_count = self.deadband_filter.filter(records)
+        if suppressed_count:
+            kept = {id(record) for record in records}
+            signal_records = [record for record in signal_records if id(record) in kept]
+        try:
+            stored_count = await self.sensor_data_writer.submit(records, signal_records)
+            self.stats.incr('readings_stored', stored_count)
+            self.stats.incr('readings_suppressed', suppressed_count)
+            return stored_count + suppressed_count, rejected_count
+        except Exception as e_save:
+            self.deadband_filter.forget(record.sensor_id for record in records)
+            logger.error(f"保存设备 {device_id_str} 的批量传感器数据时出错: {e_save}")
+            return 0, rejected_count
+
+    def handle_command_response(self, device_id_str, message):
+        """
+        处理设备的 command_response 消息，由命令分发器释放在途窗口并批量更新命令日志
+
+        Returns:
+            dict: 回复设备的响应
+        """
+        try:
+            command_id = int(message.get("command_id"))
+        except (TypeError, ValueError):
+            return {"status": "error", "message": "command_response缺少有效的command_id"}
+        status = message.get("status")
+        payload = message.get("payload")
+        if not isinstance(payload, dict):
+            payload = {}
+
+        self.command_dispatcher.on_response(device_id_str, command_id, status, payload)
+        self.stats.incr('command_responses')
+        logger.debug(f"设备 {device_id_str} 响应命令 {command_id}: {status}",
+                     extra={'event': 'command_response', 'device_id': device_id_str})
+        return {"status": "ok", "message": "命令响应已接收"}
+
+    @staticmethod
+    def format_raw_line(line_raw, binary=False, limit=200):
+        """将原始数据行转换为可记录的文本，二进制帧以十六进制表示，过长时截断"""
+        if binary:
+            text = line_raw[:limit // 2].hex()
+            return text + '...' if len(line_raw) > limit // 2 else text
+        text = line_raw[:limit].decode(errors='replace').strip()
+        return text + '...' if len(line_raw) > limit else text
+
+    async def report_activity(self, interval):
+        """定期输出按设备汇总的活动日志"""
+        while True:
+            await asyncio.sleep(interval)
+            self.stats.device_rates = self.activity_summary.emit(ServerStats.TOP_DEVICES)
+            self.stats.throttled = self.rate_limiter.pop_throttled(ServerStats.TOP_DEVICES)
+            if self.stats.throttled:
+                throttled_str = ', '.join(f"{scope}:{key}({count})" for scope, key, count in self.stats.throttled)
+                logger.info(f"过去 {interval:g} 秒被限流最多的设备和项目: {throttled_str}",
+                            extra={'event': 'throttle_summary', 'count': sum(item[2] for item in self.stats.throttled)})
 
     async def send_json_response(self, writer: asyncio.StreamWriter, data: dict):
         """发送JSON响应"""
-        response_str = json.dumps(data) + '\n'  # 添加换行符作为消息结束标记
-        writer.write(response_str.encode())
+        writer.write(self.codec.dumps(data) + b'\n')  # 添加换行符作为消息结束标记
+        await writer.drain()
+
+    async def send_response(self, writer: asyncio.StreamWriter, framing, data: dict):
+        """按连接协商的帧格式发送响应"""
+        writer.write(framing.encode(data))
         await writer.drain()
 
-    async def handle_async(self, options):
-        """异步处理入口"""
+    async def report_stats(self, interval, worker_index=None, stats_queue=None):
+        """定期输出运行统计；多进程模式下改为上报给主进程汇总"""
+        while True:
+            await asyncio.sleep(interval)
+            snapshot = self.stats.snapshot()
+            if stats_queue is not None:
+                stats_queue.put((worker_index, os.getpid(), snapshot))
+            else:
+                logger.info(f"[统计] {ServerStats.format(snapshot)}", extra={'event': 'stats'})
+
+    async def snapshot_stats(self):
+        """在事件循环线程中读取统计快照"""
+        return self.stats.snapshot()
+
+    def collect_metrics(self):
+        """指标HTTP线程调用，交给事件循环线程读取快照，避免与连接处理协程同时访问计数和队列"""
+        future = asyncio.run_coroutine_threadsafe(self.snapshot_stats(), self.loop)
+        return future.result(COLLECT_TIMEOUT)
+
+    async def watch_supervisor(self, supervisor_pid):
+        """多进程模式下监视主进程，主进程意外退出后停止当前工作进程，避免遗留孤儿进程"""
+        while True:
+            await asyncio.sleep(1)
+            if os.getppid() != supervisor_pid:
+                self.stderr.write(self.style.ERROR('主进程已退出，正在停止工作进程'))
+                os.kill(os.getpid(), signal.SIGTERM)
+                return
+
+    def throttle_reply(self, throttle):
+        """超过速率上限时发给设备的限流响应"""
+        action = self.rate_limiter.action
+        reply = {
+            "type": "throttle",
+            "scope": throttle.scope,
+            "action": action,
+            "message": THROTTLE_MESSAGES[throttle.scope, action],
+            "retry_after_ms": max(1, int(throttle.delay * 1000)),
+        }
+        if action != RATE_LIMIT_DEFER:
+            reply["status"] = "error"
+        return reply
+
+    def reconnect_after(self):
+        """服务器停止时建议设备重连的等待时间（毫秒）"""
+        base = self.handshake_admission.retry_after_ms
+        return int(base + random.uniform(0, self.reconnect_spread_ms))
+
+    def request_shutdown(self, signum):
+        """SIGTERM/SIGINT的处理函数，通知服务器开始停止"""
+        if self.shutdown_event.is_set():
+            self.stderr.write(self.style.WARNING('服务器正在停止，请等待连接处理完成...'))
+            return
+        self.stdout.write(self.style.WARNING(f'\n收到 {signal.Signals(signum).name}，正在停止TCP服务器...'))
+        self.shutdown_event.set()
+
+    async def drain_connections(self, timeout):
+        """
+        停止读取所有连接的新数据，等待已收到的消息处理完毕、确认发出后关闭连接
+
+        读取暂停后向每个连接的读取流写入EOF，连接的处理协程处理完当前消息后按正常断开流程退出：
+        发出尚未发送的累计确认，并在关闭前向设备发送重连提示。尚未开始处理的消息不会被确认，
+        设备重连后重新发送。超过 timeout 秒仍未结束的连接被取消。
+        """
+        self.draining = True
+        self.presence_tracker.begin_shutdown()
+        for reader, writer in self.client_streams.values():
+            if not writer.transport.is_closing():
+                writer.transport.pause_reading()
+            reader.feed_eof()
+
+        tasks = list(self.client_streams)
+        if not tasks:
+            return
+        self.stdout.write(self.style.WARNING(f'等待 {len(tasks)} 个连接处理完已收到的数据...'))
+        _, pending = await asyncio.wait(tasks, timeout=timeout)
+        if pending:
+            self.stderr.write(self.style.ERROR(f'{len(pending)} 个连接未能在 {timeout:g} 秒内处理完成，强制关闭'))
+            for task in pending:
+                task.cancel()
+            await asyncio.wait(pending, timeout=CLOSE_TIMEOUT)
+
+    async def handle_async(self, options, listen_sock=None, worker_index=None, stats_queue=None):
+        """
+        异步处理入口
+
+        Args:
+            options: 命令行参数
+            listen_sock: 多进程模式下由主进程共享的监听套接字
+            worker_index: 多进程模式下的工作进程序号
+            stats_queue: 多进程模式下上报统计数据的队列
+        """
         host = options['host']
         port = options['port']
         
         self.stdout.write(self.style.SUCCESS(f'正在启动TCP服务器，监听地址: {host}:{port}...'))
+        self.stats = ServerStats()
+        self.payload_sampler = PayloadSampler(options['log_sample_rate'])
+        self.warning_limiter = LogRateLimiter(interval=options['log_summary_interval'] or 60)
+        self.activity_summary = DeviceActivitySummary(logger, interval=options['log_summary_interval'])
+        self.connection_limiter = ConnectionLimiter(options['max_connections'], options['max_connections_per_ip'])
+        self.rate_limiter = IngestRateLimiter(
+            device_rate=options['device_rate_limit'],
+            device_burst=options['device_rate_burst'],
+            project_rate=options['project_rate_limit'],
+            project_burst=options['project_rate_burst'],
+            action=options['rate_limit_action']
+        )
+        self.connections = ConnectionRegistry()
+        self.deadband_filter = DeadbandFilter()
+        self.client_streams = {}  # 连接的处理任务 -> (reader, writer)
+        self.draining = False
+        self.reconnect_spread_ms = options['reconnect_spread_ms']
+        self.auth_timeout = options['auth_timeout']
+        self.idle_timeout = options['idle_timeout']
+        self.heartbeat_misses = options['heartbeat_misses']
+        self.max_line_size = options['max_line_size']
+        self.handshake_admission = HandshakeAdmission(
+            max_concurrent=options['handshake_concurrency'],
+            max_wait=options['handshake_max_wait'],
+            max_waiting=options['handshake_queue_size'],
+            retry_after_ms=options['retry_after_ms']
+        )
+
+        # 启动数据库执行器，所有ORM操作都在其工作线程中执行
+        self.db_executor = DatabaseExecutor(
+            workers=options['db_workers'],
+            max_queue=options['db_queue_size']
+        )
+        self.db_executor.start()
+
+        # 启动消息总线，写入后的读数由各消费者按批异步处理，慢消费者不会阻塞数据读取
+        self.message_bus = MessageBus(max_queue=options['bus_queue_size'], stats=self.stats)
+        self.message_bus.subscribe(SignalConsumer(self.db_executor))
+        self.message_bus.subscribe(LatestValueConsumer(self.db_executor))
+        for consumer in load_broker_consumers(getattr(settings, 'NOVA_TCP_BUS_ADAPTERS', [])):
+            self.message_bus.subscribe(consumer)
+        await self.message_bus.start()
+
+        # 启动传感器数据批量写入器，合并所有连接的数据写入
+        self.sensor_data_writer = SensorDataBatchWriter(
+            self.db_executor,
+            batch_size=options['batch_size'],
+            flush_interval=options['flush_interval'],
+            bus=self.message_bus,
+            stats=self.stats
+        )
+        await self.sensor_data_writer.start()
+
+        # 启动设备在线状态跟踪器，合并 last_seen/status 写入
+        self.presence_tracker = DevicePresenceTracker(self.db_executor, flush_interval=options['presence_interval'])
+        await self.presence_tracker.start()
+
+        if options['preload_devices']:
+            # 预加载设备凭据和传感器，服务器重启后设备集中重连时无需逐个查询数据库
+            try:
+                auth_count, registry_count = await self.db_executor.run(self.preload_devices_orm)
+                self.stdout.write(self.style.SUCCESS(f'已预加载 {auth_count} 个设备的认证信息和 {registry_count} 个设备的传感器'))
+            except Exception as e:
+                self.stderr.write(self.style.ERROR(f'预加载设备时出错: {e}'))
+
+        # 启动命令分发器，按设备维护命令发送队列，批量写回命令状态
+        self.command_dispatcher = CommandDispatcher(
+            self.db_executor,
+            self.connections,
+            self.stats,
+            window=options['command_window'],
+            ack_timeout=options['command_ack_timeout'],
+            max_retries=options['command_max_retries'],
+            ttl=options['command_ttl']
+        )
+        await self.command_dispatcher.start()
+
+        # 队列深度等当前值只在读取快照时计算
+        self.stats.gauge('db_pending', lambda: self.db_executor.pending)
+        self.stats.gauge('ingest_pending', lambda: self.sensor_data_writer.pending_count)
+        self.stats.gauge('bus_backlog', lambda: self.message_bus.backlog)
+        self.stats.gauge('commands_queued', lambda: self.command_dispatcher.queued_count)
+        self.stats.gauge('commands_in_flight', lambda: self.command_dispatcher.in_flight_count)
+        self.stats.gauge('presence_pending', lambda: self.presence_tracker.pending_count)
+        self.stats.gauge('handshake_waiting', lambda: self.handshake_admission.waiting)
+
+        # 启动控制通道，接收Web进程和策略引擎的命令推送
+        control_server = None
+        control_endpoint = None
+        if options['control_address']:
+            control_server = ControlServer(self.command_dispatcher)
+            try:
+                control_endpoint = await control_server.start(options['control_address'], worker_index or 0)
+                self.stdout.write(self.style.SUCCESS(f'控制通道已启动 - 监听地址: {control_endpoint}'))
+            except (OSError, ValueError) as e:
+                control_server = None
+                self.stderr.write(self.style.ERROR(f'启动控制通道时出错，命令推送不可用: {e}'))
+        # 本进程内触发的策略引擎直接把命令交给命令分发器，不经过控制通道
+        register_local_dispatcher(self.command_dispatcher, control_endpoint)
+
+        self.loop = asyncio.get_running_loop()
+        metrics_server = None
+        stats_interval = options['stats_interval']
+        if options['metrics_address']:
+            if worker_index is None:
+                metrics_server = MetricsServer(self.collect_metrics)
+                try:
+                    metrics_endpoint = metrics_server.start(options['metrics_address'])
+                    self.stdout.write(self.style.SUCCESS(f'指标服务已启动 - http://{metrics_endpoint}/metrics'))
+                except (OSError, ValueError) as e:
+                    metrics_server = None
+                    self.stderr.write(self.style.ERROR(f'启动指标服务时出错，指标不可用: {e}'))
+            else:
+                # 多进程模式下由主进程提供指标，工作进程需要更频繁地上报快照
+                stats_interval = min(stats_interval, METRICS_PUSH_INTERVAL) if stats_interval > 0 else METRICS_PUSH_INTERVAL
+
+        background_tasks = []
+        if stats_interval > 0:
+            background_tasks.append(asyncio.create_task(
+                self.report_stats(stats_interval, worker_index, stats_queue)
+            ))
+        if options['log_summary_interval'] > 0:
+            background_tasks.append(asyncio.create_task(self.report_activity(options['log_summary_interval'])))
+        if worker_index is not None:
+            background_tasks.append(asyncio.create_task(self.watch_supervisor(os.getppid())))
+
+        # SIGTERM（以及单进程模式下的Ctrl+C）触发优雅停止；多进程模式下Ctrl+C由主进程处理
+        self.shutdown_event = asyncio.Event()
+        for signum in (signal.SIGTERM,) if worker_index is not None else (signal.SIGTERM, signal.SIGINT):
+            try:
+                self.loop.add_signal_handler(signum, self.request_shutdown, signum)
+            except (NotImplementedError, RuntimeError):
+                # 不支持的平台（如Windows）仍按KeyboardInterrupt停止
+                pass
         
         try:
             # 创建服务器
-            server = await asyncio.start_server(
-                self.handle_client_connection, 
-                host, 
-                port
-            )
+            if listen_sock is not None:
+                # 多进程模式：使用主进程预先绑定的套接字
+                server = await asyncio.start_server(
+                    self.handle_client_connection, sock=listen_sock, limit=self.max_line_size
+                )
+            elif worker_index is not None:
+                # 多进程模式：各工作进程通过SO_REUSEPORT绑定同一端口
+                server = await asyncio.start_server(
+                    self.handle_client_connection,
+                    sock=create_listening_socket(host, port, reuse_port=True),
+                    limit=self.max_line_size
+                )
+            else:
+                server = await asyncio.start_server(
+                    self.handle_client_connection, 
+                    host, 
+                    port,
+                    limit=self.max_line_size
+                )
             
             # 输出服务器的地址信息
             for socket in server.sockets:
                 addr = socket.getsockname()
                 self.stdout.write(self.style.SUCCESS(f'服务器已启动 - 监听地址: {addr[0]}:{addr[1]}'))
             
-            # 运行服务器，直到被中断
+            # 运行服务器，直到收到停止信号
             self.stdout.write(self.style.SUCCESS('按Ctrl+C可停止服务器...'))
             async with server:
-                await server.serve_forever()
+                await self.shutdown_event.wait()
+                # 停止接受新连接和新命令，处理完已收到的数据后关闭所有连接
+                server.close()
+                if control_server is not None:
+                    await control_server.close()
+                    control_server = None
+                await self.drain_connections(options['drain_timeout'])
                 
         except OSError as e:
             self.stderr.write(self.style.ERROR(f'启动服务器时出错: {e}'))
             if e.errno == 98:  # 地址已被使用
                 self.stderr.write(self.style.ERROR(f'端口 {port} 已被占用，请尝试其他端口'))
             raise
+        finally:
+            for task in background_tasks:
+                task.cancel()
+            if metrics_server is not None:
+                metrics_server.close()
+            if control_server is not None:
+                await control_server.close()
+            unregister_local_dispatcher()
+            # 写入剩余的传感器数据、设备状态和命令状态
+            await self.sensor_data_writer.close()
+            await self.message_bus.close()
+            await self.presence_tracker.close()
+            await self.command_dispatcher.close()
+            await self.db_executor.shutdown()
+            if self.draining:
+                self.stdout.write(self.style.SUCCESS('已写入剩余数据，TCP服务器已停止'))
+
+    def setup_runtime(self, options):
+        """配置日志、选择JSON编解码器并安装事件循环策略，需在 asyncio.run() 之前调用"""
+        self.log_listener = setup_server_logging(options['log_level'], options['log_format'])
+        self.codec = get_codec(options['codec'])
+        loop_name = install_event_loop(options['event_loop'])
+        self.stdout.write(self.style.SUCCESS(f'JSON编解码器: {self.codec.name}，事件循环: {loop_name}'))
+
+    def run_worker(self, options, worker_index, listen_sock, stats_queue):
+        """多进程模式下工作进程的入口，由 WorkerSupervisor 在fork出的子进程中调用"""
+        self.setup_runtime(options)
+        try:
+            asyncio.run(self.handle_async(
+                options,
+                listen_sock=listen_sock,
+                worker_index=worker_index,
+                stats_queue=stats_queue
+            ))
+        except KeyboardInterrupt:
+            self.stdout.write(self.style.WARNING(f'工作进程 #{worker_index} 已停止'))
+        finally:
+            self.stop_logging()
 
     def handle(self, *args, **options):
         """命令入口点"""
+        if options['workers'] > 1:
+            # 多进程模式：主进程只负责守护工作进程和汇总统计
+            WorkerSupervisor(self, options).run()
+            return
+
+        self.setup_runtime(options)
         try:
             # 运行异步服务器
             asyncio.run(self.handle_async(options))
         except KeyboardInterrupt:
             self.stdout.write(self.style.WARNING('\nTCP服务器被用户停止'))
         except Exception as e:
-            self.stderr.write(self.style.ERROR(f'TCP服务器错误: {e}')) 
\ No newline at end of file
+            self.stderr.write(self.style.ERROR(f'TCP服务器错误: {e}'))
+        finally:
+            self.stop_logging()
+
+    def stop_logging(self):
+        """停止后台日志线程，输出队列中剩余的日志"""
+        if getattr(self, 'log_listener', None):
+            self.log_listener.stop()
+            self.log_listener = None
\ No newline at end of file
@@ -0,0 +1,213 @@
+"""
+Prometheus指标模块 - 将TCP服务器的运行统计转换为Prometheus文本格式，并通过HTTP提供给采集端
+
+计数器仍由各工作进程在事件循环线程中无锁累加（见 stats.ServerStats），只有在采集端请求
+/metrics 时才读取快照并格式化：单进程模式下由服务器进程提供，多进程模式下由主进程汇总
+各工作进程上报的快照后提供，工作进程本身不监听指标端口。
+"""
+
+import http.server
+import logging
+import socket
+import threading
+
+from .stats import LatencyHistogram, ServerStats
+
+# 配置日志记录器
+logger = logging.getLogger(__name__)
+
+METRIC_PREFIX = 'nova_tcp'
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+# 启用指标时多进程模式下工作进程上报快照的周期（秒）
+METRICS_PUSH_INTERVAL = 1.0
+# 等待事件循环返回快照的最长时间（秒）
+COLLECT_TIMEOUT = 5.0
+
+COUNTER_HELP = {
+    'connections_total': '累计接受的连接数',
+    'connections_rejected': '因连接数上限被拒绝的连接数',
+    'auth_success': '认证成功次数',
+    'auth_failed': '认证失败次数',
+    'handshake_rejected': '因认证排队过载被拒绝的握手次数',
+    'messages': '认证后收到的消息数',
+    'messages_throttled': '超过设备或项目消息速率上限的消息数',
+    'readings_stored': '已写入数据库的传感器读数',
+    'readings_suppressed': '因死区压缩未存储的传感器读数',
+    'bus_published': '发布到消息总线的读数事件数',
+    'bus_dropped': '消息总线因消费者积压丢弃的事件数',
+    'bus_backpressure': '写入因信号派发等不可丢失的消费者积压而等待的次数',
+    'commands_pushed': '首次发送给设备的命令数',
+    'commands_retried': '重新发送的命令数',
+    'commands_expired': '过期或重试耗尽的命令数',
+    'command_responses': '收到的命令响应数',
+    'timeouts': '因认证或空闲超时断开的连接数',
+    'errors': '处理消息时出错的次数',
+}
+
+GAUGE_HELP = {
+    'connections_active': '当前活跃连接数',
+    'db_pending': '数据库执行器中排队和执行中的任务数',
+    'ingest_pending': '等待批量写入的传感器读数',
+    'bus_backlog': '消息总线各消费者队列中等待处理的事件数',
+    'commands_queued': '等待发送的命令数',
+    'commands_in_flight': '已发送等待设备响应的命令数',
+    'presence_pending': '等待写入的设备在线状态数',
+    'handshake_waiting': '排队等待认证的连接数',
+    'workers_alive': '存活的工作进程数',
+}
+
+HISTOGRAM_HELP = {
+    'handshake_latency': '从连接建立到认证完成的耗时',
+    'db_write_latency': '传感器数据批量写入的耗时，包括在数据库执行器中排队的时间',
+    'ack_latency': '从收到消息到确认的耗时',
+}
+
+
+def _metric_name(name, suffix=''):
+    name = f'{METRIC_PREFIX}_{name}'
+    if suffix and not name.endswith(suffix):
+        name += suffix
+    return name
+
+
+def _escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _header(lines, name, metric_type, help_text):
+    lines.append(f'# HELP {name} {help_text}')
+    lines.append(f'# TYPE {name} {metric_type}')
+
+
+def render_metrics(snapshot):
+    """
+    将统计快照格式化为Prometheus文本格式
+
+    Args:
+        snapshot: ServerStats.snapshot() 或 ServerStats.aggregate() 的结果，
+            可额外包含 workers_alive
+
+    Returns:
+        str: 指标文本
+    """
+    lines = []
+    for key, help_text in COUNTER_HELP.items():
+        name = _metric_name(key, '_total')
+        _header(lines, name, 'counter', help_text)
+        lines.append(f'{name} {snapshot.get(key, 0)}')
+
+    name = _metric_name('messages_received_total')
+    _header(lines, name, 'counter', '按类型统计的消息数，未知类型计入other')
+    for msg_type in ServerStats.MESSAGE_TYPES + ('other',):
+        lines.append(f'{name}{{type="{msg_type}"}} {snapshot.get("messages_" + msg_type, 0)}')
+
+    for key, help_text in GAUGE_HELP.items():
+        if key not in snapshot:
+            continue
+        name = _metric_name(key)
+        _header(lines, name, 'gauge', help_text)
+        lines.append(f'{name} {snapshot[key]}')
+
+    if 'uptime' in snapshot:
+        name = _metric_name('uptime_seconds')
+        _header(lines, name, 'gauge', '服务器进程运行时间')
+        lines.append(f'{name} {snapshot["uptime"]}')
+
+    for key, help_text in HISTOGRAM_HELP.items():
+        histogram = LatencyHistogram.merge([snapshot.get(key)])
+        name = _metric_name(key, '_seconds')
+        _header(lines, name, 'histogram', help_text)
+        cumulative = 0
+        for bound_ms, count in zip(LatencyHistogram.BUCKETS_MS, histogram.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{{le="{bound_ms / 1000:g}"}} {cumulative}')
+        lines.append(f'{name}_bucket{{le="+Inf"}} {histogram.count}')
+        lines.append(f'{name}_sum {histogram.sum_ms / 1000:.6f}')
+        lines.append(f'{name}_count {histogram.count}')
+
+    name = _metric_name('device_message_rate')
+    _header(lines, name, 'gauge', '最近一个活动汇总周期内消息最多的设备的消息速率（条/秒）')
+    for device_id, rate in snapshot.get('device_rates', ()):
+        lines.append(f'{name}{{device_id="{_escape_label(device_id)}"}} {rate}')
+
+    name = _metric_name('throttled_messages')
+    _header(lines, name, 'gauge', '最近一个活动汇总周期内被限流最多的设备和项目的被限流消息数')
+    for scope, key, count in snapshot.get('throttled', ()):
+        lines.append(f'{name}{{scope="{scope}",id="{_escape_label(key)}"}} {count}')
+
+    return '\n'.join(lines) + '\n'
+
+
+class _MetricsHandler(http.server.BaseHTTPRequestHandler):
+    """只响应 GET /metrics"""
+
+    def do_GET(self):
+        if self.path.split('?', 1)[0] != '/metrics':
+            self.send_error(404)
+            return
+        try:
+            body = render_metrics(self.server.collect()).encode()
+        except Exception as e:
+            logger.error(f"采集运行统计时出错: {e}")
+            self.send_error(503)
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug(f"指标请求 {self.address_string()}: {format % args}")
+
+
+class _MetricsHTTPServer(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+
+
+class _MetricsHTTPServerV6(_MetricsHTTPServer):
+    address_family = socket.AF_INET6
+
+
+class MetricsServer:
+    """
+    在后台线程中提供 /metrics 的HTTP服务
+
+    collect 在HTTP线程中调用，返回统计快照；需要读取事件循环中的状态时，
+    应通过 asyncio.run_coroutine_threadsafe 等方式交给事件循环线程执行。
+    """
+
+    def __init__(self, collect):
+        self.collect = collect
+        self._server = None
+        self._thread = None
+
+    def start(self, address):
+        """
+        开始监听指标地址
+
+        Args:
+            address: host:port
+
+        Returns:
+            str: 实际监听的地址
+        """
+        host, port = address.rsplit(':', 1)
+        host = host.strip('[]')
+        server_class = _MetricsHTTPServerV6 if ':' in host else _MetricsHTTPServer
+        self._server = server_class((host, int(port)), _MetricsHandler)
+        self._server.collect = self.collect
+        self._thread = threading.Thread(target=self._server.serve_forever, name='nova-metrics', daemon=True)
+        self._thread.start()
+        bound_host, bound_port = self._server.server_address[:2]
+        return f'{bound_host}:{bound_port}'
+
+    def close(self):
+        """停止HTTP服务"""
+        if self._server is None:
+            return
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+        self._server = None
+        self._thread = None
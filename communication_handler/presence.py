@@ -0,0 +1,172 @@
+"""
+设备在线状态跟踪模块 - 在内存中记录设备最后在线时间，定期批量写回数据库
+"""
+
+import asyncio
+import logging
+
+from django.utils import timezone
+
+from iot_devices.models import Device
+
+# 配置日志记录器
+logger = logging.getLogger(__name__)
+
+# 单条 IN 查询的最大参数数量，兼容SQLite的变量数限制
+QUERY_CHUNK_SIZE = 500
+
+
+def chunked(items, size=QUERY_CHUNK_SIZE):
+    """将列表按固定大小切分"""
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def write_device_presence(seen_ids, desired_status, flush_time, bulk_offline=False):
+    """
+    将一个周期内的在线状态变化写入数据库
+
+    Args:
+        seen_ids: 本周期内有消息的设备ID列表，统一更新 last_seen
+        desired_status: 设备ID -> 期望状态，仅在与数据库不一致时写入
+        flush_time: 本次写入使用的时间
+        bulk_offline: 为True时离线状态用批量UPDATE写入（每批 QUERY_CHUNK_SIZE 个设备），
+            不触发pre_save信号，用于服务器停止时一次性标记所有连接的设备
+
+    Returns:
+        int: 发生状态变化的设备数
+    """
+    for ids in chunked(seen_ids):
+        Device.objects.filter(device_id__in=ids).update(last_seen=flush_time)
+
+    transitions = 0
+    if bulk_offline:
+        offline_ids = [device_id for device_id, status in desired_status.items() if status == 'offline']
+        for ids in chunked(offline_ids):
+            transitions += Device.objects.filter(device_id__in=ids).exclude(status='offline').update(status='offline')
+        desired_status = {device_id: status for device_id, status in desired_status.items() if status != 'offline'}
+
+    for ids in chunked(list(desired_status)):
+        for device in Device.objects.filter(device_id__in=ids):
+            status = desired_status[str(device.device_id)]
+            if device.status == status:
+                continue
+            # 真正的状态变化通过save()写入，保证策略引擎的pre_save信号被触发
+            device.status = status
+            if status == 'online':
+                device.last_seen = flush_time
+                device.save(update_fields=['status', 'last_seen'])
+            else:
+                device.save(update_fields=['status'])
+            transitions += 1
+    return transitions
+
+
+class DevicePresenceTracker:
+    """
+    设备在线状态跟踪器
+
+    数据、心跳和状态消息只更新内存中的记录，每隔 flush_interval 秒
+    用一次批量UPDATE写回 last_seen；status 只在在线/离线真正发生变化时写入。
+    同一周期内先断开又重连的设备不会产生任何状态写入。
+
+    connect()/disconnect() 按设备统计当前连接数，设备重连后旧连接才超时断开时，
+    只有最后一个连接断开才会将设备标记为离线。
+
+    服务器停止时调用 begin_shutdown()，之后断开的设备不再逐个保存，而是在 close() 时批量标记为离线；
+    这类离线是部署重启造成的，不触发策略引擎的设备状态策略。
+    """
+
+    def __init__(self, executor, flush_interval=5.0):
+        self.executor = executor
+        self.flush_interval = flush_interval
+        self._seen = set()
+        self._desired_status = {}
+        self._connections = {}  # 设备ID -> 当前连接数
+        self._task = None
+        self._closing = False
+        self._wakeup = None
+        self._shutting_down = False
+
+    async def start(self):
+        """启动后台写入任务"""
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        """停止后台任务并写入剩余的状态"""
+        self._closing = True
+        if self._task:
+            self._wakeup.set()
+            await self._task
+            self._task = None
+        await self.flush()
+
+    def begin_shutdown(self):
+        """服务器开始停止，之后的离线状态留到 close() 时批量写入"""
+        self._shutting_down = True
+
+    def seen(self, device_id):
+        """记录设备在线（收到认证、数据、心跳或状态消息）"""
+        key = str(device_id)
+        self._seen.add(key)
+        self._desired_status[key] = 'online'
+
+    def connect(self, device_id):
+        """记录设备建立了一个已认证的连接"""
+        key = str(device_id)
+        self._connections[key] = self._connections.get(key, 0) + 1
+        self.seen(key)
+
+    def disconnect(self, device_id):
+        """记录设备断开一个连接，没有剩余连接时标记为离线"""
+        key = str(device_id)
+        remaining = self._connections.get(key, 0) - 1
+        if remaining > 0:
+            self._connections[key] = remaining
+            return
+        self._connections.pop(key, None)
+        self.set_status(key, 'offline')
+
+    def set_status(self, device_id, status):
+        """记录设备的期望状态，如断开连接时的'offline'"""
+        self._desired_status[str(device_id)] = status
+
+    @property
+    def pending_count(self):
+        """等待写入的设备数"""
+        return len(self._seen | set(self._desired_status))
+
+    async def _run(self):
+        """后台循环：按固定周期写入"""
+        while not self._closing:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            await self.flush()
+
+    async def flush(self):
+        """将当前周期内的状态写入数据库"""
+        if not self._seen and not self._desired_status:
+            return
+        if self._shutting_down and not self._closing:
+            # 等待所有连接关闭后由 close() 一次性写入
+            return
+
+        seen_ids = list(self._seen)
+        desired_status = self._desired_status
+        self._seen = set()
+        self._desired_status = {}
+
+        try:
+            transitions = await self.executor.run(
+                write_device_presence, seen_ids, desired_status, timezone.now(), self._shutting_down
+            )
+            logger.debug(f"已更新 {len(seen_ids)} 个设备的最后在线时间，{transitions} 个设备状态变化")
+        except Exception as e:
+            logger.error(f"批量更新设备在线状态时出错: {str(e)}")
+            # 写入失败时保留状态，等待下一周期重试（新的变化优先）
+            self._seen |= set(seen_ids)
+            for device_id, status in desired_status.items():
+                self._desired_status.setdefault(device_id, status)
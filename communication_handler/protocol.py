@@ -0,0 +1,232 @@
+"""
+设备协议选项模块 - 认证阶段协商的连接级选项（确认模式、帧格式等）及其处理
+"""
+
+import asyncio
+import logging
+import time
+
+from .framing import BINARY_FRAMING_CLASSES, FRAMING_JSON, MAX_FRAME_SIZE, LineFraming
+
+# 配置日志记录器
+logger = logging.getLogger(__name__)
+
+# 确认模式：all 每条消息确认（默认，兼容旧设备）；batch 累计确认；none 不发送成功确认
+ACK_MODE_ALL = 'all'
+ACK_MODE_BATCH = 'batch'
+ACK_MODE_NONE = 'none'
+ACK_MODES = (ACK_MODE_ALL, ACK_MODE_BATCH, ACK_MODE_NONE)
+
+DEFAULT_ACK_EVERY = 10
+MAX_ACK_EVERY = 1000
+DEFAULT_ACK_INTERVAL_MS = 1000
+MIN_ACK_INTERVAL_MS = 10
+MAX_ACK_INTERVAL_MS = 60000
+
+
+class ProtocolNegotiationError(ValueError):
+    """认证消息中的协议选项无效，错误信息会回复给设备"""
+
+
+def _clamp_int(value, default, minimum, maximum, field):
+    """将协商参数转换为整数并限制在允许范围内"""
+    if value is None:
+        return default
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        raise ProtocolNegotiationError(f"{field} 必须是数字")
+    return max(minimum, min(int(value), maximum))
+
+
+def negotiate_ack_options(auth_payload):
+    """
+    从认证消息中解析确认模式
+
+    Args:
+        auth_payload: 认证消息字典，可包含 ack、ack_every、ack_interval_ms
+
+    Returns:
+        dict: 协商结果，会原样回复给设备
+
+    Raises:
+        ProtocolNegotiationError: 参数无效
+    """
+    mode = auth_payload.get('ack', ACK_MODE_ALL)
+    if mode not in ACK_MODES:
+        raise ProtocolNegotiationError(f"不支持的确认模式: {mode}")
+
+    options = {'ack': mode}
+    if mode == ACK_MODE_BATCH:
+        options['ack_every'] = _clamp_int(
+            auth_payload.get('ack_every'), DEFAULT_ACK_EVERY, 1, MAX_ACK_EVERY, 'ack_every'
+        )
+        options['ack_interval_ms'] = _clamp_int(
+            auth_payload.get('ack_interval_ms'), DEFAULT_ACK_INTERVAL_MS,
+            MIN_ACK_INTERVAL_MS, MAX_ACK_INTERVAL_MS, 'ack_interval_ms'
+        )
+    return options
+
+
+def negotiate_framing(auth_payload, codec, max_frame_size=MAX_FRAME_SIZE):
+    """
+    从认证消息中解析认证之后使用的帧格式
+
+    Args:
+        auth_payload: 认证消息字典，可包含 framing
+        codec: JSON帧使用的编解码器
+        max_frame_size: 二进制帧的最大长度
+
+    Returns:
+        LineFraming 或 LengthPrefixedFraming
+
+    Raises:
+        ProtocolNegotiationError: 帧格式未知或服务器未安装对应的库
+    """
+    name = auth_payload.get('framing', FRAMING_JSON)
+    if name == FRAMING_JSON:
+        return LineFraming(codec)
+    framing_class = BINARY_FRAMING_CLASSES.get(name)
+    if framing_class is None:
+        raise ProtocolNegotiationError(f"不支持的帧格式: {name}")
+    try:
+        return framing_class(max_frame_size)
+    except ImportError:
+        raise ProtocolNegotiationError(f"服务器不支持帧格式: {name}")
+
+
+def negotiate_read_timeout(auth_payload, idle_timeout, heartbeat_misses):
+    """
+    根据设备在认证消息中声明的心跳间隔确定读取超时
+
+    Args:
+        auth_payload: 认证消息字典，可包含 heartbeat_interval（秒）
+        idle_timeout: 服务器配置的空闲超时，0表示不限制
+        heartbeat_misses: 连续错过多少次心跳后断开，0表示不按心跳间隔断开
+
+    Returns:
+        float: 读取超时秒数，0表示不超时
+
+    Raises:
+        ProtocolNegotiationError: 心跳间隔无效
+    """
+    interval = auth_payload.get('heartbeat_interval')
+    if interval is None or not heartbeat_misses:
+        return idle_timeout
+    if isinstance(interval, bool) or not isinstance(interval, (int, float)) or interval <= 0:
+        raise ProtocolNegotiationError("heartbeat_interval 必须是正数")
+    heartbeat_timeout = interval * heartbeat_misses
+    return min(idle_timeout, heartbeat_timeout) if idle_timeout else heartbeat_timeout
+
+
+def resolve_sensor_keys(payload, sensor_keys):
+    """
+    将以传感器序号为键的读数转换为以 value_key 为键，之后与JSON路径共用存储逻辑
+
+    Args:
+        payload: 读数字典，键为传感器序号或 value_key
+        sensor_keys: 认证时下发给设备的 value_key 列表，序号即列表下标
+
+    Returns:
+        dict: 以 value_key 为键的读数；超出范围的序号转换为 "#序号"，存储时作为未知键忽略
+    """
+    resolved = {}
+    for key, value in payload.items():
+        if isinstance(key, int) and not isinstance(key, bool):
+            key = sensor_keys[key] if 0 <= key < len(sensor_keys) else f"#{key}"
+        resolved[key] = value
+    return resolved
+
+
+def resolve_batch_samples(samples, sensor_keys):
+    """对 data_batch 中每个样本的 payload 做 resolve_sensor_keys 转换，格式错误的样本原样保留"""
+    resolved = []
+    for sample in samples:
+        if isinstance(sample, dict) and isinstance(sample.get("payload"), dict):
+            sample = dict(sample, payload=resolve_sensor_keys(sample["payload"], sensor_keys))
+        resolved.append(sample)
+    return resolved
+
+
+class ConnectionAcker:
+    """
+    单个连接的确认发送器
+
+    - all：每条成功处理的消息立即回复原有的确认
+    - batch：每累计 ack_every 条消息，或距第一条未确认消息超过 ack_interval_ms 毫秒，
+      发送一条累计确认 {"type": "ack", "status": "ok", "seq": 最后序号, "count": 条数}
+    - none：不发送成功确认
+
+    序号优先使用设备在消息中携带的 seq，否则为认证后服务器收到的消息计数。
+    错误响应不受确认模式影响，始终立即发送。
+
+    指定了 stats 时，从 mark_received() 到消息被确认的耗时记录到 ack_latency；
+    batch 和 none 模式下统计到消息计入累计确认为止，不包括累计确认本身的等待时间。
+    """
+
+    def __init__(self, send, options, stats=None):
+        self._send = send
+        self.mode = options['ack']
+        self.ack_every = options.get('ack_every', 1)
+        self.ack_interval = options.get('ack_interval_ms', 0) / 1000
+        self.stats = stats
+        self._received = 0
+        self._received_at = None
+        self._last_seq = None
+        self._pending = 0
+        self._timer = None
+
+    def mark_received(self):
+        """收到一条消息时调用，作为确认延迟的起点"""
+        self._received_at = time.monotonic()
+
+    async def ack(self, response, seq=None):
+        """确认一条成功处理的消息"""
+        self._received += 1
+        if self.mode == ACK_MODE_ALL:
+            await self._send(response)
+            self._observe()
+            return
+
+        self._last_seq = seq if seq is not None else self._received
+        if self.mode == ACK_MODE_NONE:
+            self._observe()
+            return
+
+        self._pending += 1
+        if self._pending >= self.ack_every:
+            await self.flush()
+        elif self._timer is None:
+            self._timer = asyncio.create_task(self._flush_later())
+        self._observe()
+
+    def _observe(self):
+        if self.stats is not None and self._received_at is not None:
+            self.stats.observe('ack_latency', time.monotonic() - self._received_at)
+            self._received_at = None
+
+    async def flush(self):
+        """发送累计确认"""
+        if self._timer is not None and self._timer is not asyncio.current_task():
+            self._timer.cancel()
+        self._timer = None
+        if not self._pending:
+            return
+        count, self._pending = self._pending, 0
+        await self._send({"type": "ack", "status": "ok", "seq": self._last_seq, "count": count})
+
+    async def close(self):
+        """连接结束时尽量发送剩余的累计确认"""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if self._pending:
+            try:
+                await self.flush()
+            except (OSError, RuntimeError):
+                pass
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.ack_interval)
+        try:
+            await self.flush()
+        except (OSError, RuntimeError) as e:
+            logger.debug(f"发送累计确认失败: {e}")
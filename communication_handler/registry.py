@@ -0,0 +1,137 @@
+"""
+设备注册表模块 - 在TCP服务器进程内缓存设备及其传感器映射，避免数据消息逐条查询数据库
+"""
+
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+
+from iot_devices.models import Device
+
+# 配置日志记录器
+logger = logging.getLogger(__name__)
+
+
+class DeviceEntry:
+    """
+    注册表中的单个设备条目
+
+    Attributes:
+        device: Device实例
+        sensors: value_key -> Sensor 映射
+        sensor_keys: 按传感器主键排序的 value_key 元组，下标即二进制帧中使用的传感器序号
+        loaded_at: 加载时间（time.monotonic）
+    """
+
+    __slots__ = ('device', 'sensors', 'sensor_keys', 'loaded_at')
+
+    def __init__(self, device, sensors):
+        self.device = device
+        self.sensors = sensors
+        self.sensor_keys = tuple(sorted(sensors, key=lambda value_key: sensors[value_key].pk))
+        self.loaded_at = time.monotonic()
+
+
+class DeviceRegistry:
+    """
+    进程内的设备注册表
+
+    设备认证时加载，Device/Sensor 的 post_save/post_delete 信号会使对应条目失效。
+    信号只能覆盖本进程内的修改，Web进程中的修改依靠 ttl 过期后重新加载。
+    """
+
+    def __init__(self, ttl=60):
+        self.ttl = ttl
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def load(self, device_id):
+        """
+        从数据库加载设备及其全部传感器，并写入注册表
+
+        Args:
+            device_id: 设备UUID（字符串或UUID）
+
+        Returns:
+            DeviceEntry: 设备不存在时返回None
+        """
+        key = str(device_id)
+        try:
+            device = Device.objects.select_related('project').get(device_id=key)
+        except (Device.DoesNotExist, ValidationError, ValueError):
+            self.invalidate(key)
+            return None
+        return self.register(device)
+
+    def register(self, device):
+        """使用已查询到的Device实例加载条目，仅额外查询一次传感器"""
+        # 传感器回指同一个Device实例，避免 sensor.device 再次查询
+        sensors = {}
+        for sensor in device.sensors.all():
+            sensor.device = device
+            sensors[sensor.value_key] = sensor
+
+        entry = DeviceEntry(device, sensors)
+        with self._lock:
+            self._entries[str(device.device_id)] = entry
+        return entry
+
+    def preload(self, queryset=None, chunk_size=2000):
+        """
+        批量加载设备及其传感器，用于服务器启动时应对大量设备同时重连
+
+        Args:
+            queryset: 要加载的设备，默认为全部设备
+            chunk_size: 每次从数据库读取的设备数
+
+        Returns:
+            int: 加载的设备数
+        """
+        queryset = Device.objects.all() if queryset is None else queryset
+        queryset = queryset.select_related('project').prefetch_related('sensors')
+        count = 0
+        for device in queryset.iterator(chunk_size=chunk_size):
+            self.register(device)
+            count += 1
+        return count
+
+    def get(self, device_id):
+        """
+        获取已缓存的条目，不访问数据库
+
+        Returns:
+            DeviceEntry: 未缓存或已过期时返回None
+        """
+        key = str(device_id)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if self.ttl and time.monotonic() - entry.loaded_at > self.ttl:
+                del self._entries[key]
+                return None
+            return entry
+
+    def get_or_load(self, device_id):
+        """获取条目，未命中时从数据库加载"""
+        return self.get(device_id) or self.load(device_id)
+
+    def invalidate(self, device_id):
+        """使单个设备的条目失效"""
+        with self._lock:
+            self._entries.pop(str(device_id), None)
+
+    def clear(self):
+        """清空注册表"""
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+# 进程级单例，供TCP服务器和信号处理器共享
+device_registry = DeviceRegistry(ttl=getattr(settings, 'NOVA_TCP_REGISTRY_TTL', 60))
@@ -0,0 +1,161 @@
+"""
+TCP服务器日志模块 - 非阻塞日志输出、原始数据采样、限频告警和按设备汇总的活动日志
+"""
+
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import sys
+import time
+
+# TCP服务器相关代码都记录到此日志记录器下
+SERVER_LOGGER_NAME = 'communication_handler'
+
+# 结构化输出时附加到日志中的额外字段
+STRUCTURED_FIELDS = ('event', 'device_id', 'addr', 'msg_type', 'count')
+
+
+class JsonLineFormatter(logging.Formatter):
+    """将日志记录格式化为单行JSON，便于日志系统采集"""
+
+    def format(self, record):
+        data = {
+            'time': self.formatTime(record, '%Y-%m-%dT%H:%M:%S'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for field in STRUCTURED_FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                data[field] = value if isinstance(value, (int, float, bool)) else str(value)
+        if record.exc_info:
+            data['exc_info'] = self.formatException(record.exc_info)
+        return json.dumps(data, ensure_ascii=False)
+
+
+def setup_server_logging(level='INFO', log_format='text', stream=None):
+    """
+    为TCP服务器配置非阻塞日志
+
+    事件循环中只把日志记录放入队列，由后台线程格式化并写出，避免同步I/O阻塞事件循环。
+    如果项目的 LOGGING 配置已经为 communication_handler 设置了处理器，则保持原配置不变。
+
+    Args:
+        level: 日志级别名称
+        log_format: 'text' 或 'json'
+        stream: 输出流，默认为标准输出
+
+    Returns:
+        QueueListener: 需要在退出时调用 stop()；未安装处理器时返回None
+    """
+    server_logger = logging.getLogger(SERVER_LOGGER_NAME)
+    server_logger.setLevel(level.upper())
+    if server_logger.handlers:
+        return None
+
+    output_handler = logging.StreamHandler(stream or sys.stdout)
+    if log_format == 'json':
+        output_handler.setFormatter(JsonLineFormatter())
+    else:
+        output_handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(message)s', '%Y-%m-%d %H:%M:%S'))
+
+    log_queue = queue.SimpleQueue()
+    listener = logging.handlers.QueueListener(log_queue, output_handler, respect_handler_level=True)
+    server_logger.addHandler(logging.handlers.QueueHandler(log_queue))
+    server_logger.propagate = False
+    listener.start()
+    return listener
+
+
+class PayloadSampler:
+    """
+    原始数据采样器
+
+    rate 为记录原始数据的比例，0 表示从不记录，1 表示全部记录。
+    """
+
+    def __init__(self, rate=0.0):
+        self.rate = rate
+
+    def should_log(self):
+        if self.rate <= 0:
+            return False
+        return self.rate >= 1 or random.random() < self.rate
+
+
+class LogRateLimiter:
+    """同一个键在 interval 秒内最多允许记录一次，用于限制重复告警"""
+
+    def __init__(self, interval=60.0, max_keys=10000):
+        self.interval = interval
+        self.max_keys = max_keys
+        self._last_logged = {}
+
+    def allow(self, key):
+        now = time.monotonic()
+        last = self._last_logged.get(key)
+        if last is not None and now - last < self.interval:
+            return False
+        if len(self._last_logged) >= self.max_keys:
+            # 防止异常设备制造大量不同的键导致内存增长
+            self._last_logged.clear()
+        self._last_logged[key] = now
+        return True
+
+
+class DeviceActivitySummary:
+    """
+    按设备汇总的活动日志
+
+    热路径上只累加计数，每个周期输出一条汇总日志（INFO），
+    以及每个活跃设备各一条明细日志（DEBUG）。
+    """
+
+    def __init__(self, logger, interval=60.0, top_n=5):
+        self.logger = logger
+        self.interval = interval
+        self.top_n = top_n
+        self._messages = {}
+        self._readings = {}
+
+    def record(self, device_id, readings=0):
+        """记录一条消息及其存储的读数数量"""
+        self._messages[device_id] = self._messages.get(device_id, 0) + 1
+        if readings:
+            self._readings[device_id] = self._readings.get(device_id, 0) + readings
+
+    def emit(self, top_n=None):
+        """
+        输出当前周期的汇总并清空计数
+
+        Args:
+            top_n: 返回的设备数，默认与日志中列出的最活跃设备数相同
+
+        Returns:
+            list: 本周期消息最多的设备及其消息速率 [(device_id, 条/秒), ...]
+        """
+        messages, readings = self._messages, self._readings
+        self._messages, self._readings = {}, {}
+        if not messages:
+            return []
+
+        total_messages = sum(messages.values())
+        total_readings = sum(readings.values())
+        ranked = sorted(messages.items(), key=lambda item: item[1], reverse=True)
+        busiest = ranked[:self.top_n]
+        busiest_str = ', '.join(f"{device_id}({count})" for device_id, count in busiest)
+        self.logger.info(
+            f"过去 {self.interval:g} 秒: 活跃设备 {len(messages)} 个，消息 {total_messages} 条，"
+            f"已存储读数 {total_readings} 条；最活跃: {busiest_str}",
+            extra={'event': 'activity_summary', 'count': total_messages}
+        )
+        if self.logger.isEnabledFor(logging.DEBUG):
+            for device_id, count in messages.items():
+                self.logger.debug(
+                    f"设备 {device_id}: 消息 {count} 条，已存储读数 {readings.get(device_id, 0)} 条",
+                    extra={'event': 'device_summary', 'device_id': device_id, 'count': count}
+                )
+        return [(device_id, round(count / self.interval, 3)) for device_id, count in ranked[:top_n or self.top_n]]
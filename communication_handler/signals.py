@@ -0,0 +1,37 @@
+"""
+通信处理信号模块 - 监听Device和Sensor的变化，使TCP服务器的设备注册表和认证缓存失效
+"""
+
+import logging
+from django.dispatch import receiver
+from django.db.models.signals import post_save, post_delete
+
+from iot_devices.models import Device, Sensor
+from .auth_cache import auth_cache
+from .registry import device_registry
+
+# 配置日志记录器
+logger = logging.getLogger(__name__)
+
+# TCP服务器自身维护的设备字段，更新这些字段不需要使注册表失效
+PRESENCE_FIELDS = frozenset({'status', 'last_seen'})
+
+
+@receiver(post_save, sender=Device)
+@receiver(post_delete, sender=Device)
+def invalidate_device_entry(sender, instance, **kwargs):
+    """设备变化时使其注册表条目和认证缓存失效（包括新建设备，以清除"设备不存在"的缓存）"""
+    update_fields = kwargs.get('update_fields')
+    if update_fields and set(update_fields) <= PRESENCE_FIELDS:
+        return
+    device_registry.invalidate(instance.device_id)
+    auth_cache.invalidate(instance.device_id)
+    logger.debug(f"设备 {instance.device_id} 已变化，注册表条目和认证缓存失效")
+
+
+@receiver(post_save, sender=Sensor)
+@receiver(post_delete, sender=Sensor)
+def invalidate_sensor_device_entry(sender, instance, **kwargs):
+    """传感器变化时使其所属设备的注册表条目失效"""
+    device_registry.invalidate(instance.device_id)
+    logger.debug(f"传感器 {instance.pk} 已变化，设备 {instance.device_id} 的注册表条目失效")
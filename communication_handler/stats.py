@@ -0,0 +1,235 @@
+"""
+TCP服务器运行统计模块 - 记录连接、认证、消息和写入计数、队列深度以及延迟分布，支持多个工作进程汇总
+"""
+
+import bisect
+import time
+
+
+class LatencyHistogram:
+    """
+    延迟直方图
+
+    按固定的毫秒桶计数，记录开销为O(log 桶数)，且多个进程的直方图可以直接相加。
+    百分位数在所在桶内线性插值估算。
+    """
+
+    BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000)
+
+    def __init__(self, counts=None, sum_ms=0.0):
+        self.counts = list(counts) if counts else [0] * (len(self.BUCKETS_MS) + 1)
+        self.sum_ms = sum_ms
+
+    def record(self, seconds):
+        """记录一次耗时（秒）"""
+        ms = seconds * 1000
+        self.counts[bisect.bisect_left(self.BUCKETS_MS, ms)] += 1
+        self.sum_ms += ms
+
+    @property
+    def count(self):
+        return sum(self.counts)
+
+    def percentile(self, q):
+        """
+        估算百分位数
+
+        Args:
+            q: 0~1之间的分位
+
+        Returns:
+            float: 毫秒；没有样本时返回None，落在最后一个桶时返回最大的桶边界
+        """
+        total = self.count
+        if not total:
+            return None
+        target = q * total
+        cumulative = 0
+        for index, bucket_count in enumerate(self.counts):
+            if cumulative + bucket_count >= target and bucket_count:
+                if index == len(self.BUCKETS_MS):
+                    return float(self.BUCKETS_MS[-1])
+                lower = self.BUCKETS_MS[index - 1] if index else 0
+                upper = self.BUCKETS_MS[index]
+                return lower + (upper - lower) * (target - cumulative) / bucket_count
+            cumulative += bucket_count
+        return float(self.BUCKETS_MS[-1])
+
+    def snapshot(self):
+        return {'counts': list(self.counts), 'sum_ms': round(self.sum_ms, 3)}
+
+    @classmethod
+    def merge(cls, snapshots):
+        """合并多个直方图快照"""
+        merged = cls()
+        for snapshot in snapshots:
+            if not snapshot:
+                continue
+            merged.counts = [a + b for a, b in zip(merged.counts, snapshot['counts'])]
+            merged.sum_ms += snapshot['sum_ms']
+        return merged
+
+
+class ServerStats:
+    """
+    TCP服务器运行统计
+
+    计数器只在事件循环线程中修改，不需要加锁；多进程模式下各工作进程
+    定期将 snapshot() 发送给主进程，由 aggregate() 汇总。
+    """
+
+    COUNTERS = (
+        'connections_total',
+        'connections_active',
+        'connections_rejected',
+        'auth_success',
+        'auth_failed',
+        'handshake_rejected',
+        'messages',
+        'messages_data',
+        'messages_data_batch',
+        'messages_heartbeat',
+        'messages_status',
+        'messages_command_response',
+        'messages_other',
+        'messages_throttled',
+        'readings_stored',
+        'readings_suppressed',
+        'bus_published',
+        'bus_dropped',
+        'bus_backpressure',
+        'commands_pushed',
+        'commands_retried',
+        'commands_expired',
+        'command_responses',
+        'timeouts',
+        'errors',
+    )
+
+    # 按类型计数的消息，其他类型计入 messages_other
+    MESSAGE_TYPES = ('data', 'data_batch', 'heartbeat', 'status', 'command_response')
+
+    HISTOGRAMS = (
+        'handshake_latency',
+        'db_write_latency',
+        'ack_latency',
+    )
+
+    # 队列深度等当前值，由 gauge() 登记的函数在 snapshot() 时读取
+    GAUGES = (
+        'db_pending',
+        'ingest_pending',
+        'bus_backlog',
+        'commands_queued',
+        'commands_in_flight',
+        'presence_pending',
+        'handshake_waiting',
+    )
+
+    # 汇总时保留的消息速率最高的设备数
+    TOP_DEVICES = 10
+
+    def __init__(self):
+        self.counters = dict.fromkeys(self.COUNTERS, 0)
+        self.histograms = {name: LatencyHistogram() for name in self.HISTOGRAMS}
+        self.gauges = {}
+        self.device_rates = []  # 最近一个汇总周期内消息速率最高的设备 [(device_id, 条/秒), ...]
+        self.throttled = []  # 最近一个汇总周期内被限流最多的设备和项目 [(范围, ID, 消息数), ...]
+        self.started_at = time.time()
+
+    def incr(self, name, amount=1):
+        """增加计数"""
+        self.counters[name] += amount
+
+    def decr(self, name, amount=1):
+        """减少计数（仅用于连接数等当前值）"""
+        self.counters[name] -= amount
+
+    def count_message(self, msg_type):
+        """按消息类型计数"""
+        key = 'messages_' + msg_type if msg_type in self.MESSAGE_TYPES else 'messages_other'
+        self.counters[key] += 1
+
+    def observe(self, name, seconds):
+        """记录一次耗时到对应的直方图"""
+        self.histograms[name].record(seconds)
+
+    def gauge(self, name, func):
+        """登记读取当前值的函数，只在 snapshot() 时调用，不占用热路径"""
+        self.gauges[name] = func
+
+    def snapshot(self):
+        """返回当前计数、直方图和当前值的副本"""
+        data = dict(self.counters)
+        for name, histogram in self.histograms.items():
+            data[name] = histogram.snapshot()
+        for name in self.GAUGES:
+            func = self.gauges.get(name)
+            data[name] = func() if func else 0
+        data['device_rates'] = [list(item) for item in self.device_rates]
+        data['throttled'] = [list(item) for item in self.throttled]
+        data['uptime'] = round(time.time() - self.started_at, 1)
+        return data
+
+    @classmethod
+    def retire(cls, snapshot):
+        """将已退出进程的快照中的当前值清零，只保留累计计数"""
+        snapshot['connections_active'] = 0
+        for name in cls.GAUGES:
+            snapshot[name] = 0
+        snapshot['device_rates'] = []
+        snapshot['throttled'] = []
+        return snapshot
+
+    @classmethod
+    def aggregate(cls, snapshots):
+        """
+        汇总多个进程的统计快照
+
+        Args:
+            snapshots: 快照字典的可迭代对象
+
+        Returns:
+            dict: 各计数器和当前值之和，合并后的直方图快照，以及消息速率最高的设备
+        """
+        snapshots = list(snapshots)
+        total = dict.fromkeys(cls.COUNTERS + cls.GAUGES, 0)
+        device_rates = []
+        throttled = {}
+        for snapshot in snapshots:
+            for name in cls.COUNTERS + cls.GAUGES:
+                total[name] += snapshot.get(name, 0)
+            device_rates.extend(snapshot.get('device_rates', ()))
+            # 同一项目的设备可能分布在多个工作进程中
+            for scope, key, count in snapshot.get('throttled', ()):
+                throttled[scope, key] = throttled.get((scope, key), 0) + count
+        for name in cls.HISTOGRAMS:
+            total[name] = LatencyHistogram.merge(snapshot.get(name) for snapshot in snapshots).snapshot()
+        total['device_rates'] = sorted(device_rates, key=lambda item: item[1], reverse=True)[:cls.TOP_DEVICES]
+        total['throttled'] = [
+            [scope, key, count]
+            for (scope, key), count in sorted(throttled.items(), key=lambda item: item[1], reverse=True)[:cls.TOP_DEVICES]
+        ]
+        return total
+
+    @classmethod
+    def format(cls, counters):
+        """格式化为单行文本"""
+        text = (
+            f"活跃连接={counters['connections_active']} 累计连接={counters['connections_total']} "
+            f"拒绝连接={counters['connections_rejected']} 超时断开={counters['timeouts']} "
+            f"认证成功={counters['auth_success']} 认证失败={counters['auth_failed']} "
+            f"消息={counters['messages']} 限流={counters['messages_throttled']} 已存储读数={counters['readings_stored']} 压缩读数={counters['readings_suppressed']} 总线丢弃={counters['bus_dropped']} "
+            f"推送命令={counters['commands_pushed']} 命令重发={counters['commands_retried']} "
+            f"命令超时={counters['commands_expired']} 命令响应={counters['command_responses']} 错误={counters['errors']}"
+        )
+        handshake = LatencyHistogram.merge([counters.get('handshake_latency')])
+        if handshake.count:
+            text += (
+                f" 握手延迟(ms) p50={handshake.percentile(0.5):.1f} p90={handshake.percentile(0.9):.1f} "
+                f"p99={handshake.percentile(0.99):.1f} 握手拒绝={counters['handshake_rejected']}"
+            )
+        ack = LatencyHistogram.merge([counters.get('ack_latency')])
+        if ack.count:
+            text += f" 确认延迟(ms) p50={ack.percentile(0.5):.1f} p99={ack.percentile(0.99):.1f}"
+        return text
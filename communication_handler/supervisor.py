@@ -0,0 +1,246 @@
+"""
+多进程TCP服务器模块 - 主进程启动并守护多个事件循环工作进程，工作进程共享同一监听端口
+"""
+
+import logging
+import multiprocessing
+import queue
+import signal
+import socket
+import threading
+import time
+
+from django.core.management.base import CommandError
+from django.db import connections
+
+from .metrics import MetricsServer
+from .stats import ServerStats
+
+# 配置日志记录器
+logger = logging.getLogger(__name__)
+
+# 工作进程在启动后这段时间内退出视为启动失败，重启间隔按指数退避
+MIN_WORKER_UPTIME = 5.0
+MAX_RESTART_DELAY = 30.0
+
+
+def reuse_port_supported():
+    """当前平台是否支持 SO_REUSEPORT"""
+    return hasattr(socket, 'SO_REUSEPORT')
+
+
+def create_listening_socket(host, port, reuse_port=False, backlog=1024):
+    """
+    创建并绑定一个非阻塞的监听套接字
+
+    Args:
+        host: 监听地址
+        port: 监听端口
+        reuse_port: 是否设置 SO_REUSEPORT，使多个进程各自绑定同一端口
+        backlog: 监听队列长度
+
+    Returns:
+        socket.socket: 已开始监听的套接字
+    """
+    family = socket.AF_INET6 if ':' in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    try:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if reuse_port:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        sock.bind((host, port))
+        sock.listen(backlog)
+        sock.setblocking(False)
+    except OSError:
+        sock.close()
+        raise
+    return sock
+
+
+def _raise_keyboard_interrupt(signum, frame):
+    """将SIGTERM转换为KeyboardInterrupt，复用Ctrl+C的停止流程；之后的SIGTERM会被忽略，避免打断退出过程"""
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    raise KeyboardInterrupt
+
+
+def _worker_main(command, index, options, listen_sock, stats_queue):
+    """工作进程入口"""
+    # 由主进程统一处理Ctrl+C，工作进程只响应主进程发送的SIGTERM
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, _raise_keyboard_interrupt)
+    command.run_worker(options, index, listen_sock, stats_queue)
+
+
+class WorkerSupervisor:
+    """
+    TCP服务器多进程守护者
+
+    支持 SO_REUSEPORT 的平台上每个工作进程各自绑定端口，由内核在进程间分配连接；
+    否则主进程预先绑定套接字，通过fork交给所有工作进程共同accept。
+    工作进程异常退出后自动重启，并定期汇总各进程上报的统计数据；
+    配置了指标地址时，由主进程对外提供汇总后的Prometheus指标。
+    """
+
+    def __init__(self, command, options):
+        self.command = command
+        self.options = options
+        self.workers = options['workers']
+        self.stats_interval = options['stats_interval']
+        self.reuse_port = options['reuse_port'] and reuse_port_supported()
+        self.listen_sock = None
+        self._processes = {}  # index -> Process
+        self._started_at = {}  # index -> 启动时间
+        self._restart_delay = {}  # index -> 下次重启前的等待时间
+        self._restart_at = {}  # index -> 计划重启时间
+        self._latest_stats = {}  # index -> 最近一次统计快照
+        self._retired_stats = {}  # 已退出进程最后快照之和，用于保留累计计数
+        self._stats_lock = threading.Lock()  # 指标HTTP线程与守护循环同时访问统计快照
+
+        try:
+            self._context = multiprocessing.get_context('fork')
+        except ValueError:
+            raise CommandError('多进程模式需要支持fork的平台，请使用 --workers 1')
+        self._stats_queue = self._context.Queue()
+
+    def run(self):
+        """启动所有工作进程并进入守护循环，直到收到Ctrl+C或SIGTERM"""
+        host, port = self.options['host'], self.options['port']
+        if self.reuse_port:
+            # 先在主进程中试绑定一次，尽早发现端口占用等问题
+            create_listening_socket(host, port, reuse_port=True).close()
+            mode = 'SO_REUSEPORT'
+        else:
+            self.listen_sock = create_listening_socket(host, port)
+            mode = '共享监听套接字'
+        self.command.stdout.write(self.command.style.SUCCESS(
+            f'正在以 {self.workers} 个工作进程启动TCP服务器 ({mode})，监听地址: {host}:{port}'
+        ))
+
+        # fork前关闭数据库连接，避免子进程共享同一连接
+        connections.close_all()
+
+        metrics_server = None
+        if self.options['metrics_address']:
+            metrics_server = MetricsServer(self.collect_metrics)
+            try:
+                endpoint = metrics_server.start(self.options['metrics_address'])
+                self.command.stdout.write(self.command.style.SUCCESS(f'指标服务已启动 - http://{endpoint}/metrics'))
+            except (OSError, ValueError) as e:
+                metrics_server = None
+                self.command.stderr.write(self.command.style.ERROR(f'启动指标服务时出错，指标不可用: {e}'))
+
+        previous_sigterm = signal.signal(signal.SIGTERM, _raise_keyboard_interrupt)
+        try:
+            for index in range(self.workers):
+                self._spawn(index)
+
+            next_report = time.monotonic() + self.stats_interval
+            while True:
+                self._collect_stats(timeout=1.0)
+                self._reap_and_restart()
+                if self.stats_interval and time.monotonic() >= next_report:
+                    self._report()
+                    next_report = time.monotonic() + self.stats_interval
+        except KeyboardInterrupt:
+            self.command.stdout.write(self.command.style.WARNING('\n正在停止所有工作进程...'))
+        finally:
+            signal.signal(signal.SIGTERM, previous_sigterm)
+            # 工作进程需要时间处理完已收到的数据并关闭连接
+            self._stop_all(timeout=self.options['drain_timeout'] + 10.0)
+            if metrics_server is not None:
+                metrics_server.close()
+            if self.listen_sock is not None:
+                self.listen_sock.close()
+
+    def _spawn(self, index):
+        """启动指定序号的工作进程"""
+        process = self._context.Process(
+            target=_worker_main,
+            args=(self.command, index, self.options, self.listen_sock, self._stats_queue),
+            name=f'nova-tcp-worker-{index}',
+        )
+        process.start()
+        self._processes[index] = process
+        self._started_at[index] = time.monotonic()
+        self.command.stdout.write(self.command.style.SUCCESS(f'工作进程 #{index} 已启动 (PID: {process.pid})'))
+
+    def _collect_stats(self, timeout):
+        """接收工作进程上报的统计数据"""
+        deadline = time.monotonic() + timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            try:
+                index, pid, snapshot = self._stats_queue.get(timeout=remaining)
+            except queue.Empty:
+                return
+            process = self._processes.get(index)
+            if process is not None and process.pid == pid:
+                with self._stats_lock:
+                    self._latest_stats[index] = snapshot
+
+    def _reap_and_restart(self):
+        """检查退出的工作进程，按退避间隔重启"""
+        now = time.monotonic()
+        for index, process in list(self._processes.items()):
+            if process is None:
+                if now >= self._restart_at[index]:
+                    self._spawn(index)
+                continue
+            if process.is_alive():
+                continue
+
+            process.join()
+            uptime = now - self._started_at[index]
+            with self._stats_lock:
+                retired = self._latest_stats.pop(index, None)
+                if retired:
+                    ServerStats.retire(retired)
+                    self._retired_stats = ServerStats.aggregate([self._retired_stats, retired])
+
+            # 启动后很快退出的进程按指数退避重启，避免崩溃循环占满CPU
+            if uptime < MIN_WORKER_UPTIME:
+                delay = min(self._restart_delay.get(index, 0.5) * 2, MAX_RESTART_DELAY)
+            else:
+                delay = 0.5
+            self._restart_delay[index] = delay
+            self._restart_at[index] = now + delay
+            self._processes[index] = None
+            self.command.stderr.write(self.command.style.ERROR(
+                f'工作进程 #{index} (PID: {process.pid}) 已退出，退出码 {process.exitcode}，{delay:.1f} 秒后重启'
+            ))
+
+    def aggregate_stats(self):
+        """汇总所有工作进程（包括已退出进程的累计计数）的统计数据"""
+        with self._stats_lock:
+            return ServerStats.aggregate(list(self._latest_stats.values()) + [self._retired_stats])
+
+    def collect_metrics(self):
+        """指标HTTP线程调用，返回汇总统计和运行中的工作进程数"""
+        snapshot = self.aggregate_stats()
+        # 不在HTTP线程中检查进程状态，已退出的进程在守护循环下一轮（约1秒内）被移除
+        snapshot['workers_alive'] = sum(1 for process in list(self._processes.values()) if process is not None)
+        return snapshot
+
+    def _report(self):
+        """输出汇总统计"""
+        alive = sum(1 for process in self._processes.values() if process is not None and process.is_alive())
+        self.command.stdout.write(
+            f'[汇总] 工作进程={alive}/{self.workers} {ServerStats.format(self.aggregate_stats())}'
+        )
+
+    def _stop_all(self, timeout=10.0):
+        """向所有工作进程发送SIGTERM，等待其优雅停止后退出，超时后强制结束"""
+        alive = [process for process in self._processes.values() if process is not None and process.is_alive()]
+        for process in alive:
+            process.terminate()
+        deadline = time.monotonic() + timeout
+        for process in alive:
+            process.join(max(0.0, deadline - time.monotonic()))
+            if process.is_alive():
+                self.command.stderr.write(self.command.style.ERROR(f'工作进程 PID {process.pid} 未能按时退出，强制结束'))
+                process.kill()
+                process.join()
+        self._processes.clear()
+        self.command.stdout.write(self.command.style.WARNING('所有工作进程已停止'))
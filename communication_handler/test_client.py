@@ -5,10 +5,13 @@ NovaCloud TCP客户端测试脚本
 
 使用方法:
 python test_client.py --device_id <设备UUID> --device_key <设备密钥> [--host HOST] [--port PORT] [--auto] [--heartbeat]
+                      [--ack {all,batch,none}] [--ack-every N] [--ack-interval-ms T]
 """
 
 import socket
 import argparse
+import itertools
+import select
 import time
 import sys
 import json
@@ -33,8 +36,17 @@ def parse_args():
                         help='启用心跳机制 (每30秒发送一次心跳)')
     parser.add_argument('--heartbeat-interval', type=int, default=30,
                         help='心跳间隔，单位为秒 (默认: 30)')
+    parser.add_argument('--ack', choices=['all', 'batch', 'none'], default='all',
+                        help='确认模式：all 每条消息确认，batch 累计确认，none 不确认 (默认: all)')
+    parser.add_argument('--ack-every', type=int, default=10,
+                        help='batch 模式下每多少条消息确认一次 (默认: 10)')
+    parser.add_argument('--ack-interval-ms', type=int, default=1000,
+                        help='batch 模式下最长多少毫秒确认一次 (默认: 1000)')
     return parser.parse_args()
 
+# 非 all 确认模式下为每条消息附加的序号
+message_seq = itertools.count(1)
+
 def format_json_message(data):
     """将数据格式化为JSON消息，添加换行符作为消息结束标记"""
     return json.dumps(data) + '\n'
@@ -72,17 +84,58 @@ def generate_heartbeat():
         "timestamp": int(time.time())
     }
 
-def heartbeat_thread(sock, interval):
+def send_message(sock, data, ack_mode):
+    """发送一条消息，非 all 确认模式下附加序号"""
+    if ack_mode != 'all':
+        data["seq"] = next(message_seq)
+    sock.sendall(format_json_message(data).encode())
+
+def print_responses(response_raw, label="收到响应"):
+    """逐行打印服务器响应，一次可能收到多条"""
+    for response_str in response_raw.decode().splitlines():
+        if not response_str.strip():
+            continue
+        try:
+            response = json.loads(response_str)
+            if response.get("type") == "ack":
+                print(f"收到累计确认: 截至序号 {response.get('seq')}，共 {response.get('count')} 条")
+            else:
+                print(f"{label}: {response}")
+        except json.JSONDecodeError:
+            print(f"收到非JSON响应: {response_str}")
+
+def receive_responses(sock, ack_mode):
+    """
+    接收服务器响应
+
+    all 模式下阻塞等待一条响应；batch/none 模式下服务器不逐条回复，
+    只读取已经到达的累计确认和错误响应，不等待
+    """
+    if ack_mode == 'all':
+        print_responses(sock.recv(1024))
+        return
+    readable, _, _ = select.select([sock], [], [], 0)
+    if readable:
+        response_raw = sock.recv(4096)
+        if not response_raw:
+            raise ConnectionError("服务器已关闭连接")
+        print_responses(response_raw)
+
+def heartbeat_thread(sock, interval, ack_mode):
     """心跳线程函数"""
     print(f"\n心跳线程已启动，间隔: {interval}秒")
     try:
         while True:
             # 生成并发送心跳包
             heartbeat = generate_heartbeat()
-            heartbeat_message = format_json_message(heartbeat)
-            sock.sendall(heartbeat_message.encode())
+            send_message(sock, heartbeat, ack_mode)
             print(f"\n已发送心跳: {heartbeat}")
             
+            # batch/none 模式下心跳没有单独的确认，由主循环读取累计确认
+            if ack_mode != 'all':
+                time.sleep(interval)
+                continue
+
             # 接收响应
             try:
                 sock.settimeout(5)  # 设置5秒超时
@@ -149,6 +202,12 @@ def main():
             "device_id": args.device_id,
             "device_key": args.device_key
         }
+        if args.ack != 'all':
+            # 在认证时协商确认模式
+            auth_frame["ack"] = args.ack
+            if args.ack == 'batch':
+                auth_frame["ack_every"] = args.ack_every
+                auth_frame["ack_interval_ms"] = args.ack_interval_ms
         
         auth_message = format_json_message(auth_frame)
         sock.sendall(auth_message.encode())
@@ -172,7 +231,7 @@ def main():
                     # 创建并启动心跳线程
                     heartbeat_thread_instance = threading.Thread(
                         target=heartbeat_thread,
-                        args=(sock, args.heartbeat_interval),
+                        args=(sock, args.heartbeat_interval, args.ack),
                         daemon=True  # 设为守护线程，主线程结束时自动结束
                     )
                     heartbeat_thread_instance.start()
@@ -190,19 +249,11 @@ def main():
                             data_frame = generate_mock_sensor_data()
                             
                             # 发送数据
-                            data_message = format_json_message(data_frame)
-                            sock.sendall(data_message.encode())
+                            send_message(sock, data_frame, args.ack)
                             print(f"已发送数据: {data_frame}")
                             
                             # 接收响应
-                            response_raw = sock.recv(1024)
-                            response_str = response_raw.decode().strip()
-                            
-                            try:
-                                response = json.loads(response_str)
-                                print(f"收到响应: {response}")
-                            except json.JSONDecodeError:
-                                print(f"收到非JSON响应: {response_str}")
+                            receive_responses(sock, args.ack)
                             
                             # 等待2秒
                             time.sleep(2)
@@ -285,19 +336,11 @@ def main():
                             continue
                         
                         # 发送数据
-                        data_message = format_json_message(data_frame)
-                        sock.sendall(data_message.encode())
+                        send_message(sock, data_frame, args.ack)
                         print(f"已发送数据: {data_frame}")
                         
                         # 接收响应
-                        response_raw = sock.recv(1024)
-                        response_str = response_raw.decode().strip()
-                        
-                        try:
-                            response = json.loads(response_str)
-                            print(f"收到响应: {response}")
-                        except json.JSONDecodeError:
-                            print(f"收到非JSON响应: {response_str}")
+                        receive_responses(sock, args.ack)
             else:
                 print(f"认证失败: {response.get('message', '未知错误')}")
                 
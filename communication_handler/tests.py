@@ -1,3 +1,835 @@
-from django.test import TestCase
+import asyncio
+import datetime
+import importlib.util
+import json
+import unittest
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.test import SimpleTestCase, TestCase, override_settings
+
+from iot_devices.models import Device, Project, Sensor, SensorData
+from .admission import HandshakeAdmission, HandshakeRejected
+from .auth_cache import AuthCache, auth_cache, key_digest
+from .bus import BusConsumer, MessageBus, SensorEvent
+from .codec import JsonCodec
+from .control import PUSH_SUBMITTED, register_local_dispatcher, submit_local_command, unregister_local_dispatcher
+from .dedup import DeadbandFilter
+from .dispatcher import CommandDispatcher
+from .framing import (
+    FRAME_HEADER, CborFraming, FrameDecodeError, FrameTooLargeError, LengthPrefixedFraming, LineFraming,
+    MsgpackFraming,
+)
+from .ingest import (
+    LATE_SAMPLE_SECONDS, MAX_CLOCK_SKEW, SensorDataBatchWriter, SignalConsumer, build_batch_sensor_records,
+    build_sensor_data, build_sensor_records, dispatch_sensor_data_signals,
+)
+from .limits import SCOPE_DEVICE, SCOPE_PROJECT, IngestRateLimiter, TokenBucket
+from .management.commands.run_tcp_server import Command
+from .protocol import ProtocolNegotiationError, negotiate_framing, resolve_batch_samples, resolve_sensor_keys
+from .registry import DeviceEntry, device_registry
+from .stats import ServerStats
+
+NOW = datetime.datetime(2026, 6, 15, 12, 0, tzinfo=datetime.timezone.utc)
+
+
+def unix(seconds_before_now):
+    return int(NOW.timestamp()) - seconds_before_now
+
+
+class BuildBatchSensorRecordsTests(SimpleTestCase):
+
+    def setUp(self):
+        self.sensors = {
+            'temperature': Sensor(pk=1, value_key='temperature'),
+            'humidity': Sensor(pk=2, value_key='humidity'),
+        }
+
+    def build(self, samples):
+        return build_batch_sensor_records('device', self.sensors, samples, now=NOW)
+
+    def readings(self, records):
+        return [(record.sensor.value_key, int(record.timestamp.timestamp()), record.value_float) for record in records]
+
+    def test_out_of_order_samples_are_written_in_time_order(self):
+        records, _, rejected = self.build([
+            {'timestamp': unix(10), 'payload': {'temperature': 3}},
+            {'timestamp': unix(30), 'payload': {'temperature': 1}},
+            {'timestamp': unix(20), 'payload': {'temperature': 2}},
+        ])
+
+        self.assertEqual(rejected, 0)
+        self.assertEqual(
+            self.readings(records),
+            [('temperature', unix(30), 1.0), ('temperature', unix(20), 2.0), ('temperature', unix(10), 3.0)]
+        )
+
+    def test_duplicate_key_and_timestamp_keeps_last_reported_value(self):
+        records, signal_records, _ = self.build([
+            {'timestamp': unix(10), 'payload': {'temperature': 1, 'humidity': 50}},
+            {'timestamp': unix(10), 'payload': {'temperature': 2}},
+        ])
+
+        self.assertEqual(
+            sorted(self.readings(records)), [('humidity', unix(10), 50.0), ('temperature', unix(10), 2.0)]
+        )
+        self.assertEqual(len(signal_records), 2)
+
+    def test_samples_outside_clock_skew_window_are_rejected(self):
+        records, _, rejected = self.build([
+            {'timestamp': unix(-(MAX_CLOCK_SKEW + 1)), 'payload': {'temperature': 1}},
+            {'timestamp': unix(-MAX_CLOCK_SKEW), 'payload': {'temperature': 2}},
+            {'timestamp': 'yesterday', 'payload': {'temperature': 3}},
+            {'payload': {'temperature': 4}},
+        ])
+
+        self.assertEqual(rejected, 3)
+        self.assertEqual(self.readings(records), [('temperature', unix(-MAX_CLOCK_SKEW), 2.0)])
+
+    def test_signals_only_for_newest_non_late_value_per_sensor(self):
+        records, signal_records, _ = self.build([
+            {'timestamp': unix(LATE_SAMPLE_SECONDS + 60), 'payload': {'temperature': 1, 'humidity': 40}},
+            {'timestamp': unix(20), 'payload': {'temperature': 2}},
+            {'timestamp': unix(10), 'payload': {'temperature': 3}},
+        ])
+
+        self.assertEqual(len(records), 4)
+        # humidity 只有补传的历史值，不触发策略引擎；temperature 只为最新值派发信号
+        self.assertEqual(self.readings(signal_records), [('temperature', unix(10), 3.0)])
+
+    def test_unknown_value_keys_are_ignored(self):
+        records, _, rejected = self.build([{'timestamp': unix(10), 'payload': {'pressure': 1, 'temperature': 2}}])
+
+        self.assertEqual(rejected, 0)
+        self.assertEqual(self.readings(records), [('temperature', unix(10), 2.0)])
+
+
+class TokenBucketTests(SimpleTestCase):
+
+    def test_starts_full_and_allows_burst(self):
+        bucket = TokenBucket(rate=1, burst=3, now=0)
+        for _ in range(3):
+            self.assertEqual(bucket.delay(0), 0)
+            bucket.tokens -= 1
+        self.assertAlmostEqual(bucket.delay(0), 1.0)
+
+    def test_refills_at_rate_up_to_burst(self):
+        bucket = TokenBucket(rate=2, burst=4, now=0)
+        bucket.tokens = 0
+        self.assertAlmostEqual(bucket.delay(0.25), 0.25)
+        self.assertEqual(bucket.delay(0.5), 0)
+        self.assertEqual(bucket.tokens, 1)
+        bucket.delay(100)
+        self.assertEqual(bucket.tokens, 4)
+
+    def test_burst_defaults_to_rate(self):
+        self.assertEqual(TokenBucket(rate=5, burst=0, now=0).burst, 5)
+        self.assertEqual(TokenBucket(rate=0.5, burst=0, now=0).burst, 1)
+
+
+class IngestRateLimiterTests(SimpleTestCase):
+
+    def setUp(self):
+        self.clock = 0.0
+        patcher = mock.patch('communication_handler.limits.time.monotonic', side_effect=lambda: self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.project = Project(pk='p1')
+
+    def consume(self, limiter, device_id, count):
+        """连续发送 count 条消息，返回第一次被限流的结果"""
+        for _ in range(count):
+            throttle = limiter.check(device_id)
+            if throttle is not None:
+                return throttle
+        return None
+
+    def test_project_settings_override_server_defaults(self):
+        limiter = IngestRateLimiter(device_rate=100, device_burst=200, project_rate=0, project_burst=0)
+        self.project.device_rate_limit = 0
+        self.project.project_rate_limit = 10
+        self.assertEqual(limiter.limits_for(self.project), (0, 200, 10, 0))
+        self.assertEqual(limiter.limits_for(Project(pk='p2')), (100, 200, 0, 0))
+
+    def test_device_limit_is_checked_before_project_limit(self):
+        limiter = IngestRateLimiter(device_rate=1, device_burst=2, project_rate=1, project_burst=2)
+        limiter.attach('a', self.project)
+
+        throttle = self.consume(limiter, 'a', 3)
+
+        self.assertEqual((throttle.scope, throttle.key), (SCOPE_DEVICE, 'a'))
+
+    def test_project_limit_is_shared_by_its_devices(self):
+        limiter = IngestRateLimiter(device_rate=10, device_burst=10, project_rate=1, project_burst=3)
+        limiter.attach('a', self.project)
+        limiter.attach('b', self.project)
+
+        self.assertIsNone(self.consume(limiter, 'a', 2))
+        self.assertIsNone(limiter.check('b'))
+        throttle = limiter.check('b')
+
+        self.assertEqual((throttle.scope, throttle.key), (SCOPE_PROJECT, 'p1'))
+        self.clock = 1.0
+        self.assertIsNone(limiter.check('a'))
+
+    def test_project_throttle_does_not_consume_device_tokens(self):
+        limiter = IngestRateLimiter(device_rate=1, device_burst=2, project_rate=1, project_burst=1)
+        limiter.attach('a', self.project)
+        limiter.check('a')
+
+        self.assertEqual(limiter.check('a').scope, SCOPE_PROJECT)
+        device_bucket, _ = limiter._devices['a']
+        self.assertEqual(device_bucket.tokens, 1)
+
+    def test_refresh_applies_changed_project_limit_to_connected_devices(self):
+        limiter = IngestRateLimiter(device_rate=0, project_rate=1, project_burst=1)
+        limiter.attach('a', self.project)
+        limiter.attach('b', self.project)
+        limiter.check('a')
+        self.assertEqual(limiter.check('b').scope, SCOPE_PROJECT)
+
+        # 项目取消限额后，只有 a 的注册表条目重新加载，b 也不再受项目限额限制
+        self.project.project_rate_limit = 0
+        limiter.refresh('a', self.project)
+
+        self.assertIsNone(self.consume(limiter, 'b', 10))
+
+    def test_refresh_applies_new_project_limit_to_unlimited_devices(self):
+        limiter = IngestRateLimiter()
+        limiter.attach('a', self.project)
+        limiter.attach('b', self.project)
+        self.assertIsNone(self.consume(limiter, 'b', 10))
+
+        self.project.project_rate_limit = 1
+        limiter.refresh('a', self.project)
+
+        self.assertEqual(self.consume(limiter, 'b', 2).scope, SCOPE_PROJECT)
+
+    def test_refresh_ignores_disconnected_devices(self):
+        limiter = IngestRateLimiter(device_rate=1)
+        limiter.attach('a', self.project)
+        limiter.detach('a')
+
+        limiter.refresh('a', self.project)
+
+        self.assertIsNone(self.consume(limiter, 'a', 10))
+
+
+class DeadbandFilterTests(SimpleTestCase):
+
+    def setUp(self):
+        self.filter = DeadbandFilter()
+        self.sensor = Sensor(pk=1, value_key='temperature', deadband=0.5, max_store_interval=60)
+
+    def reading(self, seconds, value, sensor=None):
+        return build_sensor_data(sensor or self.sensor, value, NOW + datetime.timedelta(seconds=seconds))
+
+    def stored(self, *readings):
+        kept, _ = self.filter.filter(list(readings))
+        return [(int((record.timestamp - NOW).total_seconds()), record.get_value(), record.compressed) for record in kept]
+
+    def test_first_sample_is_always_stored(self):
+        self.assertEqual(self.stored(self.reading(0, 20.0)), [(0, 20.0, False)])
+
+    def test_deadband_boundary(self):
+        self.assertEqual(
+            self.stored(self.reading(0, 20.0), self.reading(1, 20.5), self.reading(2, 19.5), self.reading(3, 20.51)),
+            [(0, 20.0, False), (3, 20.51, True)]
+        )
+
+    def test_max_store_interval_forces_write(self):
+        self.assertEqual(
+            self.stored(self.reading(0, 20.0), self.reading(59, 20.0), self.reading(60, 20.0), self.reading(61, 20.0)),
+            [(0, 20.0, False), (60, 20.0, True)]
+        )
+
+    def test_change_after_nothing_suppressed_is_not_compressed(self):
+        self.assertEqual(
+            self.stored(self.reading(0, 20.0), self.reading(1, 21.0)), [(0, 20.0, False), (1, 21.0, False)]
+        )
+
+    def test_non_numeric_values_are_suppressed_only_when_equal(self):
+        self.assertEqual(
+            self.stored(self.reading(0, 'on'), self.reading(1, 'on'), self.reading(2, 'off')),
+            [(0, 'on', False), (2, 'off', True)]
+        )
+
+    def test_late_samples_are_stored_without_changing_state(self):
+        self.assertEqual(
+            self.stored(self.reading(10, 20.0), self.reading(5, 20.0), self.reading(11, 20.0)),
+            [(10, 20.0, False), (5, 20.0, False)]
+        )
+
+    def test_sensor_without_deadband_stores_everything(self):
+        sensor = Sensor(pk=2, value_key='humidity')
+        kept, suppressed = self.filter.filter([self.reading(0, 50.0, sensor), self.reading(1, 50.0, sensor)])
+        self.assertEqual((len(kept), suppressed), (2, 0))
+
+    def test_forget_stores_next_sample(self):
+        self.stored(self.reading(0, 20.0))
+        self.filter.forget([self.sensor.pk])
+        self.assertEqual(self.stored(self.reading(1, 20.0)), [(1, 20.0, False)])
+
+
+class FakeConnection:
+    """记录发送内容的设备连接"""
+
+    def __init__(self):
+        self.sent = []
+
+    async def send(self, message):
+        self.sent.append(message)
+
+
+class FakeExecutor:
+    """不访问数据库的执行器，命令状态的写入直接返回"""
+
+    async def run(self, func, *args):
+        return 0, 0, 0
+
+
+class LocalCommandSubmitTests(SimpleTestCase):
+
+    async def start_dispatcher(self):
+        self.connection = FakeConnection()
+        # ttl=0 时不清理数据库中的过期命令
+        self.dispatcher = CommandDispatcher(FakeExecutor(), {'online': self.connection}, ttl=0, flush_interval=60)
+        await self.dispatcher.start()
+        register_local_dispatcher(self.dispatcher, '127.0.0.1:8101')
+
+    async def stop_dispatcher(self):
+        unregister_local_dispatcher()
+        await self.dispatcher.close()
+
+    async def submit_from_thread(self, device_id, command_id, until):
+        """在其他线程中提交命令（如数据库执行器中运行的策略引擎），等待 until() 成立"""
+        result = await asyncio.to_thread(submit_local_command, device_id, command_id, {'on': True})
+        for _ in range(100):
+            if until():
+                break
+            await asyncio.sleep(0.01)
+        return result
+
+    async def test_command_for_local_device_is_sent_without_control_channel(self):
+        await self.start_dispatcher()
+        try:
+            with mock.patch('communication_handler.control.push_command') as push_command:
+                result = await self.submit_from_thread('online', 1, lambda: self.connection.sent)
+            self.assertEqual(result, PUSH_SUBMITTED)
+            self.assertEqual(self.connection.sent, [{'type': 'command', 'command_id': 1, 'payload': {'on': True}}])
+            push_command.assert_not_called()
+        finally:
+            await self.stop_dispatcher()
+
+    async def test_command_for_other_device_asks_other_workers(self):
+        await self.start_dispatcher()
+        try:
+            with mock.patch('communication_handler.control.push_command') as push_command:
+                result = await self.submit_from_thread('elsewhere', 2, lambda: push_command.called)
+            self.assertEqual(result, PUSH_SUBMITTED)
+            self.assertEqual(self.connection.sent, [])
+            push_command.assert_called_once_with('elsewhere', 2, {'on': True}, None, exclude='127.0.0.1:8101')
+        finally:
+            await self.stop_dispatcher()
+
+    def test_other_processes_use_control_channel(self):
+        self.assertIsNone(submit_local_command('online', 3, {}))
+
+
+class CollectingConsumer(BusConsumer):
+    """记录收到的事件，每批处理前让出一次事件循环"""
+
+    batch_size = 5
+
+    def __init__(self, lossless):
+        self.lossless = lossless
+        self.name = 'lossless' if lossless else 'lossy'
+        self.received = []
+
+    async def handle(self, events):
+        await asyncio.sleep(0)
+        self.received.extend(event.value for event in events)
+
+
+class SlowSignalExecutor:
+    """写入直接返回，信号派发比写入慢得多，模拟策略引擎跟不上数据写入"""
+
+    def __init__(self):
+        self.signalled = []
+
+    async def run(self, func, records):
+        if func is dispatch_sensor_data_signals:
+            await asyncio.sleep(0.005)
+            self.signalled.extend(records)
+
+
+def reading(value):
+    return SensorData(sensor_id=1, timestamp=NOW, value_float=float(value))
+
+
+class MessageBusTests(SimpleTestCase):
+
+    async def test_only_lossy_consumers_drop_events_on_overflow(self):
+        stats = ServerStats()
+        bus = MessageBus(max_queue=10, stats=stats)
+        lossy, lossless = CollectingConsumer(lossless=False), CollectingConsumer(lossless=True)
+        bus.subscribe(lossy)
+        bus.subscribe(lossless)
+        await bus.start()
+
+        bus.publish([SensorEvent(1, NOW, value) for value in range(50)])
+        await bus.close()
+
+        self.assertEqual(lossy.received, list(range(40, 50)))
+        self.assertEqual(lossless.received, list(range(50)))
+        self.assertEqual(stats.counters['bus_dropped'], 40)
+
+    async def test_wait_for_capacity_blocks_until_lossless_backlog_drains(self):
+        stats = ServerStats()
+        bus = MessageBus(max_queue=10, stats=stats)
+        consumer = CollectingConsumer(lossless=True)
+        bus.subscribe(consumer)
+        await bus.start()
+        bus.publish([SensorEvent(1, NOW, value) for value in range(25)])
+
+        await bus.wait_for_capacity()
+
+        self.assertLess(bus.backlog, 10)
+        self.assertGreaterEqual(len(consumer.received), 15)
+        self.assertEqual(stats.counters['bus_backpressure'], 1)
+        await bus.close()
+        self.assertEqual(consumer.received, list(range(25)))
+
+    async def test_writer_does_not_lose_live_signals_when_bus_is_full(self):
+        stats = ServerStats()
+        executor = SlowSignalExecutor()
+        bus = MessageBus(max_queue=5, stats=stats)
+        bus.subscribe(SignalConsumer(executor))
+        await bus.start()
+        writer = SensorDataBatchWriter(executor, batch_size=3, flush_interval=0.001, bus=bus, stats=stats)
+        await writer.start()
+
+        # 每次提交单独写入一批，信号派发处理一批的时间内会有多批写入完成
+        stored = [await writer.submit([reading(3 * i + j) for j in range(3)]) for i in range(20)]
+        await writer.close()
+        await bus.close()
+
+        self.assertEqual(sum(stored), 60)
+        self.assertEqual(sorted(record.value_float for record in executor.signalled), list(range(60)))
+        self.assertEqual(stats.counters['bus_dropped'], 0)
+        self.assertGreater(stats.counters['bus_backpressure'], 0)
+
+
+class AuthCacheTests(SimpleTestCase):
+
+    def setUp(self):
+        self.clock = 0.0
+        patcher = mock.patch('communication_handler.auth_cache.time.monotonic', side_effect=lambda: self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.cache = AuthCache(ttl=300, negative_ttl=30, max_negative=2)
+
+    def test_verify_compares_digests(self):
+        self.assertIsNone(self.cache.verify('a', 'secret'))
+        self.cache.store('a', 'secret')
+
+        self.assertTrue(self.cache.verify('a', 'secret'))
+        self.assertFalse(self.cache.verify('a', 'other'))
+        # 缓存中只有摘要，没有明文密钥
+        self.assertEqual(self.cache._digests['a'][0], key_digest('secret'))
+        self.assertNotIn(b'secret', self.cache._digests['a'][0])
+
+    def test_digest_depends_on_secret_key(self):
+        digest = key_digest('secret')
+        with override_settings(SECRET_KEY='another-secret-key'):
+            self.assertNotEqual(key_digest('secret'), digest)
+
+    def test_entries_expire_after_ttl(self):
+        self.cache.store('a', 'secret')
+        self.clock = 300
+        self.assertTrue(self.cache.verify('a', 'secret'))
+        self.clock = 300.5
+        self.assertIsNone(self.cache.verify('a', 'secret'))
+        self.assertEqual(len(self.cache), 0)
+
+    def test_zero_ttl_never_expires(self):
+        cache = AuthCache(ttl=0)
+        cache.store('a', 'secret')
+        self.clock = 10 ** 6
+        self.assertTrue(cache.verify('a', 'secret'))
+
+    def test_unknown_device_is_cached_briefly(self):
+        self.cache.store_missing('ghost')
+        self.clock = 30
+        self.assertFalse(self.cache.verify('ghost', 'anything'))
+        self.clock = 31
+        self.assertIsNone(self.cache.verify('ghost', 'anything'))
+
+    def test_store_replaces_missing_entry(self):
+        self.cache.store_missing('a')
+        self.cache.store('a', 'secret')
+        self.assertTrue(self.cache.verify('a', 'secret'))
+
+    def test_negative_entries_are_bounded(self):
+        for device_id in ('x', 'y', 'z'):
+            self.cache.store_missing(device_id)
+        self.assertIsNone(self.cache.verify('x', 'anything'))
+        self.assertFalse(self.cache.verify('z', 'anything'))
+
+    def test_invalidate(self):
+        self.cache.store('a', 'secret')
+        self.cache.store_missing('ghost')
+        self.cache.invalidate('a')
+        self.cache.invalidate('ghost')
+        self.assertIsNone(self.cache.verify('a', 'secret'))
+        self.assertIsNone(self.cache.verify('ghost', 'anything'))
+
+
+class AuthCacheInvalidationTests(TestCase):
+
+    def setUp(self):
+        owner = User.objects.create_user('owner', password='secret')
+        self.project = Project.objects.create(name='项目', owner=owner)
+        self.device = Device.objects.create(name='设备', project=self.project)
+        self.device_id = str(self.device.device_id)
+        self.addCleanup(auth_cache.clear)
+
+    def test_key_change_invalidates_entry(self):
+        old_key = self.device.device_key
+        auth_cache.store(self.device_id, old_key)
+
+        self.device.device_key = 'regenerated'
+        self.device.save()
+
+        self.assertIsNone(auth_cache.verify(self.device_id, old_key))
+
+    def test_presence_update_keeps_entry(self):
+        auth_cache.store(self.device_id, self.device.device_key)
+
+        self.device.status = 'online'
+        self.device.save(update_fields=['status'])
+
+        self.assertTrue(auth_cache.verify(self.device_id, self.device.device_key))
+
+    def test_delete_invalidates_entry(self):
+        auth_cache.store(self.device_id, self.device.device_key)
+        self.device.delete()
+        self.assertIsNone(auth_cache.verify(self.device_id, self.device.device_key))
+
+    def test_created_device_clears_missing_entry(self):
+        device = Device(name='新设备', project=self.project)
+        auth_cache.store_missing(device.device_id)
+
+        device.save()
+
+        self.assertIsNone(auth_cache.verify(device.device_id, device.device_key))
+
+    def test_preload_stores_every_device(self):
+        other = Device.objects.create(name='其他设备', project=self.project)
+        cache = AuthCache()
+
+        self.assertEqual(cache.preload(), 2)
+        self.assertTrue(cache.verify(self.device_id, self.device.device_key))
+        self.assertTrue(cache.verify(other.device_id, other.device_key))
+
+
+class InlineExecutor:
+    """在事件循环中直接调用函数的执行器"""
+
+    async def run(self, func, *args):
+        return func(*args)
+
+
+class AuthenticateDeviceTests(SimpleTestCase):
+    """认证缓存命中但注册表条目已过期时，按重新加载的设备密钥验证"""
+
+    def setUp(self):
+        self.device = Device(name='设备', device_key='new-key')
+        self.device_id = str(self.device.device_id)
+        self.command = Command()
+        self.command.db_executor = InlineExecutor()
+        self.command.handshake_admission = HandshakeAdmission(max_concurrent=1)
+        self.command.load_device_entry_orm = lambda device_id: DeviceEntry(self.device, {})
+        device_registry.invalidate(self.device_id)
+        self.addCleanup(auth_cache.clear)
+
+    async def test_revoked_key_is_rejected_after_registry_reload(self):
+        auth_cache.store(self.device_id, 'old-key')
+
+        self.assertIsNone(await self.command.authenticate_device(self.device_id, 'old-key'))
+        self.assertFalse(auth_cache.verify(self.device_id, 'old-key'))
+
+    async def test_current_key_is_accepted_after_registry_reload(self):
+        auth_cache.store(self.device_id, 'new-key')
+
+        self.assertIs(await self.command.authenticate_device(self.device_id, 'new-key'), self.device)
+
+
+class FailingExecutor:
+
+    async def run(self, func, *args):
+        raise RuntimeError('数据库不可用')
+
+
+class HandshakeAdmissionTests(SimpleTestCase):
+
+    async def hold_slot(self, admission):
+        """占用一个名额直到 release 被设置"""
+        entered, release = asyncio.Event(), asyncio.Event()
+
+        async def holder():
+            async with admission.slot():
+                entered.set()
+                await release.wait()
+
+        task = asyncio.create_task(holder())
+        await entered.wait()
+        return task, release
+
+    async def assert_slot_free(self, admission):
+        async def enter():
+            async with admission.slot():
+                pass
+
+        await asyncio.wait_for(enter(), 1)
+
+    async def wait_until_waiting(self, admission, count):
+        for _ in range(100):
+            if admission.waiting == count:
+                return
+            await asyncio.sleep(0)
+        self.fail(f'排队数为 {admission.waiting}，预期 {count}')
+
+    async def test_rejects_when_wait_queue_is_full(self):
+        admission = HandshakeAdmission(max_concurrent=1, max_wait=5, max_waiting=1, retry_after_ms=1000)
+        holder, release = await self.hold_slot(admission)
+        waiter = asyncio.create_task(self.assert_slot_free(admission))
+        await self.wait_until_waiting(admission, 1)
+
+        with self.assertRaises(HandshakeRejected) as rejected:
+            async with admission.slot():
+                pass
+
+        self.assertTrue(1000 <= rejected.exception.retry_after_ms <= 2000)
+        self.assertEqual(admission.waiting, 1)
+        release.set()
+        await asyncio.gather(holder, waiter)
+        self.assertEqual(admission.waiting, 0)
+
+    async def test_times_out_waiting_for_slot(self):
+        admission = HandshakeAdmission(max_concurrent=1, max_wait=0.01)
+        holder, release = await self.hold_slot(admission)
+
+        with self.assertRaises(HandshakeRejected):
+            async with admission.slot():
+                pass
+
+        self.assertEqual(admission.waiting, 0)
+        release.set()
+        await holder
+        await self.assert_slot_free(admission)
+
+    async def test_slot_is_released_on_exception(self):
+        admission = HandshakeAdmission(max_concurrent=1, max_wait=0.01)
+
+        with self.assertRaises(ValueError):
+            async with admission.slot():
+                raise ValueError
+
+        await self.assert_slot_free(admission)
+
+    async def test_slot_is_released_after_failed_authentication(self):
+        command = Command()
+        command.handshake_admission = admission = HandshakeAdmission(max_concurrent=1, max_wait=0.01)
+        command.db_executor = InlineExecutor()
+        command.authenticate_device_orm = lambda device_id, device_key: None
+
+        self.assertIsNone(await command.authenticate_device('unknown-device', 'key'))
+        await self.assert_slot_free(admission)
+
+        command.db_executor = FailingExecutor()
+        with self.assertRaises(RuntimeError):
+            await command.authenticate_device('unknown-device', 'key')
+        await self.assert_slot_free(admission)
+
+    async def test_waiting_gauge(self):
+        stats = ServerStats()
+        admission = HandshakeAdmission(max_concurrent=1, max_wait=5)
+        stats.gauge('handshake_waiting', lambda: admission.waiting)
+        holder, release = await self.hold_slot(admission)
+        waiters = [asyncio.create_task(self.assert_slot_free(admission)) for _ in range(3)]
+        await self.wait_until_waiting(admission, 3)
+
+        self.assertEqual(stats.snapshot()['handshake_waiting'], 3)
+        release.set()
+        await asyncio.gather(holder, *waiters)
+        self.assertEqual(stats.snapshot()['handshake_waiting'], 0)
+
+    async def test_zero_concurrency_is_unlimited(self):
+        admission = HandshakeAdmission(max_concurrent=0, max_waiting=0)
+        holder, release = await self.hold_slot(admission)
+        await self.assert_slot_free(admission)
+        release.set()
+        await holder
+
+
+class JsonBodyFraming(LengthPrefixedFraming):
+    """消息体为JSON的长度前缀帧，用于在未安装 msgpack/cbor2 时测试帧边界的处理"""
+
+    name = 'json-body'
+
+    def loads(self, raw):
+        return json.loads(raw)
+
+    def dumps(self, obj):
+        return json.dumps(obj).encode()
+
+
+def stream(*chunks, eof=True, limit=2 ** 16):
+    reader = asyncio.StreamReader(limit=limit)
+    for chunk in chunks:
+        reader.feed_data(chunk)
+    if eof:
+        reader.feed_eof()
+    return reader
+
+
+class LineFramingTests(SimpleTestCase):
+
+    def setUp(self):
+        self.framing = LineFraming(JsonCodec())
+
+    async def test_round_trip(self):
+        messages = [{'type': 'data', 'payload': {'temperature': 21.5}}, {'type': 'heartbeat'}]
+        reader = stream(b''.join(self.framing.encode(message) for message in messages))
+
+        received = [self.framing.decode(await self.framing.read(reader)) for _ in messages]
+
+        self.assertEqual(received, messages)
+        self.assertEqual(await self.framing.read(reader), b'')
+
+    async def test_message_split_across_reads(self):
+        raw = self.framing.encode({'type': 'heartbeat'})
+        reader = stream(raw[:5], eof=False)
+        read = asyncio.create_task(self.framing.read(reader))
+        await asyncio.sleep(0)
+        self.assertFalse(read.done())
+
+        reader.feed_data(raw[5:])
+
+        self.assertEqual(self.framing.decode(await read), {'type': 'heartbeat'})
+
+    async def test_line_longer_than_limit(self):
+        reader = stream(b'{"type": "data", "payload": {}}\n', limit=8)
+        with self.assertRaises(FrameTooLargeError):
+            await self.framing.read(reader)
+
+
+class LengthPrefixedFramingTests(SimpleTestCase):
+
+    def setUp(self):
+        self.framing = JsonBodyFraming(max_frame_size=64)
+
+    async def test_round_trip(self):
+        messages = [{'type': 'data', 'payload': {'0': 1.5}}, {'type': 'heartbeat'}]
+        reader = stream(b''.join(self.framing.encode(message) for message in messages))
+
+        received = [self.framing.decode(await self.framing.read(reader)) for _ in messages]
+
+        self.assertEqual(received, messages)
+        self.assertEqual(await self.framing.read(reader), b'')
+
+    async def test_frame_split_inside_header_and_body(self):
+        raw = self.framing.encode({'type': 'heartbeat'})
+        reader = stream(raw[:2], eof=False)
+        read = asyncio.create_task(self.framing.read(reader))
+        for chunk in (raw[2:FRAME_HEADER.size + 3], raw[FRAME_HEADER.size + 3:]):
+            await asyncio.sleep(0)
+            self.assertFalse(read.done())
+            reader.feed_data(chunk)
+
+        self.assertEqual(self.framing.decode(await read), {'type': 'heartbeat'})
+
+    async def test_empty_frames_are_keepalives(self):
+        reader = stream(FRAME_HEADER.pack(0), FRAME_HEADER.pack(0), self.framing.encode({'type': 'heartbeat'}))
+        self.assertEqual(self.framing.decode(await self.framing.read(reader)), {'type': 'heartbeat'})
+
+    async def test_oversized_length_prefix_is_rejected_before_reading_body(self):
+        reader = stream(FRAME_HEADER.pack(65), eof=False)
+        with self.assertRaises(FrameTooLargeError):
+            await self.framing.read(reader)
+
+    async def test_truncated_frame(self):
+        raw = self.framing.encode({'type': 'heartbeat'})
+        with self.assertRaises(asyncio.IncompleteReadError):
+            await self.framing.read(stream(raw[:-1]))
+        with self.assertRaises(asyncio.IncompleteReadError):
+            await self.framing.read(stream(raw[:2]))
+
+    def test_invalid_body(self):
+        with self.assertRaises(FrameDecodeError):
+            self.framing.decode(b'\xff')
+        self.assertIsInstance(FrameDecodeError(), ValueError)
+
+
+@unittest.skipUnless(importlib.util.find_spec('msgpack'), '未安装 msgpack')
+class MsgpackFramingTests(SimpleTestCase):
+
+    async def test_round_trip_with_sensor_indexes(self):
+        framing = MsgpackFraming()
+        message = {'type': 'data', 'payload': {0: 21.5, 1: True}}
+        reader = stream(framing.encode(message))
+        self.assertEqual(framing.decode(await framing.read(reader)), message)
+
+
+@unittest.skipUnless(importlib.util.find_spec('cbor2'), '未安装 cbor2')
+class CborFramingTests(SimpleTestCase):
+
+    async def test_round_trip_with_sensor_indexes(self):
+        framing = CborFraming()
+        message = {'type': 'data', 'payload': {0: 21.5, 1: True}}
+        reader = stream(framing.encode(message))
+        self.assertEqual(framing.decode(await framing.read(reader)), message)
+
+
+class NegotiateFramingTests(SimpleTestCase):
+
+    def test_json_is_default(self):
+        self.assertIsInstance(negotiate_framing({}, JsonCodec()), LineFraming)
+
+    def test_unknown_framing_is_rejected(self):
+        with self.assertRaises(ProtocolNegotiationError):
+            negotiate_framing({'framing': 'protobuf'}, JsonCodec())
+
+    @unittest.skipIf(importlib.util.find_spec('msgpack'), '已安装 msgpack')
+    def test_framing_without_library_is_rejected(self):
+        with self.assertRaises(ProtocolNegotiationError):
+            negotiate_framing({'framing': 'msgpack'}, JsonCodec())
+
+
+class ResolveSensorKeysTests(SimpleTestCase):
+
+    def test_indexes_map_to_value_keys(self):
+        self.assertEqual(
+            resolve_sensor_keys({0: 21.5, 1: 40, 'switch': True}, ('temperature', 'humidity')),
+            {'temperature': 21.5, 'humidity': 40, 'switch': True}
+        )
+
+    def test_unknown_indexes_become_unknown_keys(self):
+        self.assertEqual(
+            resolve_sensor_keys({2: 1.0, -1: 2.0, True: 3.0}, ('temperature', 'humidity')),
+            {'#2': 1.0, '#-1': 2.0, True: 3.0}
+        )
+
+    def test_unknown_indexes_are_ignored_when_stored(self):
+        sensor = Sensor(pk=1, value_key='temperature')
+        payload = resolve_sensor_keys({0: 1.0, 5: 2.0}, ('temperature',))
+        records = build_sensor_records('device', {'temperature': sensor}, payload, NOW)
+        self.assertEqual([(record.sensor, record.value_float) for record in records], [(sensor, 1.0)])
+
+    def test_batch_samples(self):
+        samples = [{'timestamp': 1, 'payload': {0: 1.0}}, 'invalid', {'timestamp': 2}]
+        self.assertEqual(
+            resolve_batch_samples(samples, ('temperature',)),
+            [{'timestamp': 1, 'payload': {'temperature': 1.0}}, 'invalid', {'timestamp': 2}]
+        )
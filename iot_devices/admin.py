@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Project, Device, Sensor, Actuator, SensorData, ActuatorCommandLog
+from .models import Project, Device, Sensor, Actuator, SensorData, SensorDataRollup, ActuatorCommandLog
 
 
 class SensorInline(admin.TabularInline):
@@ -38,13 +38,25 @@ class DeviceAdmin(admin.ModelAdmin):
 @admin.register(SensorData)
 class SensorDataAdmin(admin.ModelAdmin):
     """传感器数据管理界面"""
-    list_display = ('sensor', 'timestamp', 'value_float', 'value_string', 'value_boolean')
+    list_display = ('sensor', 'timestamp', 'value_float', 'value_string', 'value_boolean', 'compressed')
     search_fields = ('sensor__name', 'sensor__device__name')
     list_filter = ('sensor__device', 'sensor', 'timestamp')
     readonly_fields = ('timestamp',)
     date_hierarchy = 'timestamp'
 
 
+@admin.register(SensorDataRollup)
+class SensorDataRollupAdmin(admin.ModelAdmin):
+    """传感器数据汇总管理界面"""
+    list_display = ('sensor', 'resolution', 'bucket', 'count', 'min_value', 'max_value', 'avg_value')
+    search_fields = ('sensor__name', 'sensor__device__name')
+    list_filter = ('resolution', 'sensor__device')
+    readonly_fields = (
+        'sensor', 'resolution', 'bucket', 'count', 'min_value', 'max_value', 'sum_value', 'first_value', 'last_value'
+    )
+    date_hierarchy = 'bucket'
+
+
 @admin.register(ActuatorCommandLog)
 class ActuatorCommandLogAdmin(admin.ModelAdmin):
     """执行器命令日志管理界面"""
@@ -0,0 +1 @@
+# 初始化management包
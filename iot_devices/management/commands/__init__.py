@@ -0,0 +1 @@
+# 初始化commands包 
\ No newline at end of file
@@ -0,0 +1,69 @@
+import logging
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from iot_devices.partitions import PARTITION_INTERVALS, DEFAULT_TABLE, PartitionError, get_partitioner
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = 'SensorData分区管理 - 启用分区、创建未来分区（仅PostgreSQL，过期分区由保留策略删除）'
+
+    def add_arguments(self, parser):
+        """添加命令行参数"""
+        parser.add_argument(
+            'action',
+            choices=['enable', 'create', 'list'],
+            help='enable: 将SensorData表转换为分区表; create: 创建未来的分区; list: 列出分区'
+        )
+        parser.add_argument(
+            '--interval',
+            choices=PARTITION_INTERVALS,
+            default=getattr(settings, 'NOVA_SENSOR_DATA_PARTITION_INTERVAL', 'month'),
+            help='新建分区的时间粒度 (默认: settings.NOVA_SENSOR_DATA_PARTITION_INTERVAL 或 month)'
+        )
+        parser.add_argument(
+            '--ahead',
+            type=int,
+            default=getattr(settings, 'NOVA_SENSOR_DATA_PARTITIONS_AHEAD', 3),
+            help='在当前周期之后预先创建的分区数 (默认: settings.NOVA_SENSOR_DATA_PARTITIONS_AHEAD 或 3)'
+        )
+        parser.add_argument(
+            '--database',
+            default='default',
+            help='数据库别名 (默认: default)'
+        )
+
+    def handle(self, *args, **options):
+        try:
+            partitioner = get_partitioner(options['database'])
+            getattr(self, f'handle_{options["action"]}')(partitioner, options)
+        except PartitionError as e:
+            raise CommandError(str(e))
+
+    def handle_enable(self, partitioner, options):
+        boundary = partitioner.enable(options['interval'], options['ahead'])
+        self.stdout.write(self.style.SUCCESS(
+            f'已启用按{options["interval"]}分区，启用前的数据保存在 _legacy 分区中，截止 {boundary:%Y-%m-%d %H:%M} UTC'
+        ))
+        self.handle_list(partitioner, options)
+
+    def handle_create(self, partitioner, options):
+        created = partitioner.create_partitions(options['interval'], options['ahead'])
+        if created:
+            for name in created:
+                self.stdout.write(self.style.SUCCESS(f'已创建分区 {name}'))
+        else:
+            self.stdout.write('分区已存在，无需创建')
+
+    def handle_list(self, partitioner, options):
+        if not partitioner.is_partitioned():
+            self.stdout.write('SensorData 尚未启用分区')
+            return
+        for partition in partitioner.partitions():
+            start = f'{partition.start:%Y-%m-%d}' if partition.start is not None else '-'
+            self.stdout.write(f'{partition.name:<40} {start:>10} ~ {partition.end:%Y-%m-%d}')
+        self.stdout.write(f'{DEFAULT_TABLE:<40} 其余记录')
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('iot_devices', '0004_restore_device_uuid'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='project',
+            name='device_rate_burst',
+            field=models.PositiveIntegerField(blank=True, help_text='设备短时间内可以超出速率上限连续发送的消息数，为空时使用TCP服务器的默认值', null=True, verbose_name='单设备突发消息数'),
+        ),
+        migrations.AddField(
+            model_name='project',
+            name='device_rate_limit',
+            field=models.FloatField(blank=True, help_text='每个设备每秒最多处理的消息数，为空时使用TCP服务器的默认值，0表示不限制', null=True, verbose_name='单设备消息速率上限'),
+        ),
+        migrations.AddField(
+            model_name='project',
+            name='project_rate_burst',
+            field=models.PositiveIntegerField(blank=True, help_text='项目内所有设备短时间内可以超出速率上限连续发送的消息数，为空时使用TCP服务器的默认值', null=True, verbose_name='项目突发消息数'),
+        ),
+        migrations.AddField(
+            model_name='project',
+            name='project_rate_limit',
+            field=models.FloatField(blank=True, help_text='项目内所有设备合计每秒最多处理的消息数（每个TCP服务器工作进程分别计算），为空时使用TCP服务器的默认值，0表示不限制', null=True, verbose_name='项目消息速率上限'),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('iot_devices', '0005_project_rate_limits'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='sensor',
+            name='deadband',
+            field=models.FloatField(blank=True, help_text='数值读数与上一条已存储读数之差不超过该值时不存储，非数值读数与上一条相同时不存储；为空表示存储所有读数', null=True, verbose_name='死区'),
+        ),
+        migrations.AddField(
+            model_name='sensor',
+            name='max_store_interval',
+            field=models.PositiveIntegerField(blank=True, help_text='启用死区时，距上一条已存储读数超过该秒数的读数即使没有变化也会存储；为空表示不限制', null=True, verbose_name='最长存储间隔(秒)'),
+        ),
+        migrations.AddField(
+            model_name='sensordata',
+            name='compressed',
+            field=models.BooleanField(default=False, help_text='此前有与上一条记录相差不超过死区的读数被省略，上一条记录的值一直保持到本条记录', verbose_name='死区压缩'),
+        ),
+    ]
@@ -0,0 +1,64 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:39
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('iot_devices', '0006_sensor_deadband'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='project',
+            name='hour_rollup_retention_days',
+            field=models.PositiveIntegerField(blank=True, help_text='超过该天数的小时汇总会被删除，为空时使用全局配置，0表示永久保留', null=True, verbose_name='小时汇总保留天数'),
+        ),
+        migrations.AddField(
+            model_name='project',
+            name='minute_rollup_retention_days',
+            field=models.PositiveIntegerField(blank=True, help_text='超过该天数且已汇总为小时数据的分钟汇总会被删除，为空时使用全局配置，0表示永久保留', null=True, verbose_name='分钟汇总保留天数'),
+        ),
+        migrations.AddField(
+            model_name='project',
+            name='raw_retention_days',
+            field=models.PositiveIntegerField(blank=True, help_text='超过该天数且已汇总的原始读数会被删除，为空时使用全局配置，0表示永久保留', null=True, verbose_name='原始数据保留天数'),
+        ),
+        migrations.AddField(
+            model_name='sensor',
+            name='hour_rollup_retention_days',
+            field=models.PositiveIntegerField(blank=True, help_text='为空时使用项目的配置，0表示永久保留', null=True, verbose_name='小时汇总保留天数'),
+        ),
+        migrations.AddField(
+            model_name='sensor',
+            name='minute_rollup_retention_days',
+            field=models.PositiveIntegerField(blank=True, help_text='为空时使用项目的配置，0表示永久保留', null=True, verbose_name='分钟汇总保留天数'),
+        ),
+        migrations.AddField(
+            model_name='sensor',
+            name='raw_retention_days',
+            field=models.PositiveIntegerField(blank=True, help_text='为空时使用项目的配置，0表示永久保留', null=True, verbose_name='原始数据保留天数'),
+        ),
+        migrations.CreateModel(
+            name='SensorDataRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('resolution', models.CharField(choices=[('1m', '1分钟'), ('1h', '1小时')], max_length=4, verbose_name='时间粒度')),
+                ('bucket', models.DateTimeField(verbose_name='时间段开始')),
+                ('count', models.PositiveIntegerField(verbose_name='读数数量')),
+                ('min_value', models.FloatField(verbose_name='最小值')),
+                ('max_value', models.FloatField(verbose_name='最大值')),
+                ('sum_value', models.FloatField(verbose_name='总和')),
+                ('sensor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='rollups', to='iot_devices.sensor', verbose_name='传感器')),
+            ],
+            options={
+                'verbose_name': '传感器数据汇总',
+                'verbose_name_plural': '传感器数据汇总',
+                'ordering': ['-bucket'],
+                'indexes': [models.Index(fields=['resolution', 'bucket'], name='iot_devices_resolut_37c0e4_idx')],
+                'constraints': [models.UniqueConstraint(fields=('sensor', 'resolution', 'bucket'), name='unique_rollup_bucket_per_sensor')],
+            },
+        ),
+    ]
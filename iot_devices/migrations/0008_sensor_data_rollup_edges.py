@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('iot_devices', '0007_sensor_data_retention'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='sensordatarollup',
+            name='first_value',
+            field=models.FloatField(blank=True, null=True, verbose_name='首个值'),
+        ),
+        migrations.AddField(
+            model_name='sensordatarollup',
+            name='last_value',
+            field=models.FloatField(blank=True, null=True, verbose_name='最后值'),
+        ),
+        migrations.AlterField(
+            model_name='sensordatarollup',
+            name='resolution',
+            field=models.CharField(choices=[('1m', '1分钟'), ('1h', '1小时'), ('1d', '1天')], max_length=4, verbose_name='时间粒度'),
+        ),
+    ]
@@ -29,6 +29,50 @@ class Project(models.Model):
         related_name='projects',
         verbose_name="所有者"
     )
+    # TCP服务器的消息速率限制，为空时使用服务器的默认配置，速率为0表示不限制
+    device_rate_limit = models.FloatField(
+        null=True,
+        blank=True,
+        verbose_name="单设备消息速率上限",
+        help_text="每个设备每秒最多处理的消息数，为空时使用TCP服务器的默认值，0表示不限制"
+    )
+    device_rate_burst = models.PositiveIntegerField(
+        null=True,
+        blank=True,
+        verbose_name="单设备突发消息数",
+        help_text="设备短时间内可以超出速率上限连续发送的消息数，为空时使用TCP服务器的默认值"
+    )
+    project_rate_limit = models.FloatField(
+        null=True,
+        blank=True,
+        verbose_name="项目消息速率上限",
+        help_text="项目内所有设备合计每秒最多处理的消息数（每个TCP服务器工作进程分别计算），为空时使用TCP服务器的默认值，0表示不限制"
+    )
+    project_rate_burst = models.PositiveIntegerField(
+        null=True,
+        blank=True,
+        verbose_name="项目突发消息数",
+        help_text="项目内所有设备短时间内可以超出速率上限连续发送的消息数，为空时使用TCP服务器的默认值"
+    )
+    # 传感器数据保留策略，为空时使用全局配置，0表示永久保留，传感器中的配置优先
+    raw_retention_days = models.PositiveIntegerField(
+        null=True,
+        blank=True,
+        verbose_name="原始数据保留天数",
+        help_text="超过该天数且已汇总的原始读数会被删除，为空时使用全局配置，0表示永久保留"
+    )
+    minute_rollup_retention_days = models.PositiveIntegerField(
+        null=True,
+        blank=True,
+        verbose_name="分钟汇总保留天数",
+        help_text="超过该天数且已汇总为小时数据的分钟汇总会被删除，为空时使用全局配置，0表示永久保留"
+    )
+    hour_rollup_retention_days = models.PositiveIntegerField(
+        null=True,
+        blank=True,
+        verbose_name="小时汇总保留天数",
+        help_text="超过该天数的小时汇总会被删除，为空时使用全局配置，0表示永久保留"
+    )
     created_at = models.DateTimeField(
         auto_now_add=True,
         verbose_name="创建时间"
@@ -162,6 +206,38 @@ class Sensor(models.Model):
         related_name='sensors',
         verbose_name="所属设备"
     )
+    # 死区压缩：与上一条已存储读数相差不超过死区、且间隔小于最长存储间隔的读数不再存储
+    deadband = models.FloatField(
+        null=True,
+        blank=True,
+        verbose_name="死区",
+        help_text="数值读数与上一条已存储读数之差不超过该值时不存储，非数值读数与上一条相同时不存储；为空表示存储所有读数"
+    )
+    max_store_interval = models.PositiveIntegerField(
+        null=True,
+        blank=True,
+        verbose_name="最长存储间隔(秒)",
+        help_text="启用死区时，距上一条已存储读数超过该秒数的读数即使没有变化也会存储；为空表示不限制"
+    )
+    # 传感器数据保留策略，为空时使用项目的配置
+    raw_retention_days = models.PositiveIntegerField(
+        null=True,
+        blank=True,
+        verbose_name="原始数据保留天数",
+        help_text="为空时使用项目的配置，0表示永久保留"
+    )
+    minute_rollup_retention_days = models.PositiveIntegerField(
+        null=True,
+        blank=True,
+        verbose_name="分钟汇总保留天数",
+        help_text="为空时使用项目的配置，0表示永久保留"
+    )
+    hour_rollup_retention_days = models.PositiveIntegerField(
+        null=True,
+        blank=True,
+        verbose_name="小时汇总保留天数",
+        help_text="为空时使用项目的配置，0表示永久保留"
+    )
     created_at = models.DateTimeField(
         auto_now_add=True,
         verbose_name="创建时间"
@@ -283,6 +359,11 @@ class SensorData(models.Model):
         blank=True,
         verbose_name="JSON值"
     )
+    compressed = models.BooleanField(
+        default=False,
+        verbose_name="死区压缩",
+        help_text="此前有与上一条记录相差不超过死区的读数被省略，上一条记录的值一直保持到本条记录"
+    )
 
     class Meta:
         verbose_name = "传感器数据"
@@ -308,6 +389,79 @@ class SensorData(models.Model):
         return f"{self.sensor} - {self.timestamp}: {self.get_value()}"
 
 
+class SensorDataRollup(models.Model):
+    """
+    传感器数据汇总模型，按固定时间粒度汇总数值读数，原始数据过期删除后仍可查询长期趋势
+    """
+    RESOLUTION_MINUTE = '1m'
+    RESOLUTION_HOUR = '1h'
+    RESOLUTION_DAY = '1d'
+    RESOLUTION_CHOICES = [
+        (RESOLUTION_MINUTE, '1分钟'),
+        (RESOLUTION_HOUR, '1小时'),
+        (RESOLUTION_DAY, '1天'),
+    ]
+
+    sensor = models.ForeignKey(
+        Sensor,
+        on_delete=models.CASCADE,
+        related_name='rollups',
+        verbose_name="传感器"
+    )
+    resolution = models.CharField(
+        max_length=4,
+        choices=RESOLUTION_CHOICES,
+        verbose_name="时间粒度"
+    )
+    bucket = models.DateTimeField(
+        verbose_name="时间段开始"
+    )
+    count = models.PositiveIntegerField(
+        verbose_name="读数数量"
+    )
+    min_value = models.FloatField(
+        verbose_name="最小值"
+    )
+    max_value = models.FloatField(
+        verbose_name="最大值"
+    )
+    # 保存总和而不是平均值，汇总为更粗的粒度时可以直接相加
+    sum_value = models.FloatField(
+        verbose_name="总和"
+    )
+    first_value = models.FloatField(
+        null=True,
+        blank=True,
+        verbose_name="首个值"
+    )
+    last_value = models.FloatField(
+        null=True,
+        blank=True,
+        verbose_name="最后值"
+    )
+
+    class Meta:
+        verbose_name = "传感器数据汇总"
+        verbose_name_plural = "传感器数据汇总"
+        ordering = ['-bucket']
+        constraints = [
+            models.UniqueConstraint(
+                fields=['sensor', 'resolution', 'bucket'],
+                name='unique_rollup_bucket_per_sensor'
+            )
+        ]
+        indexes = [
+            models.Index(fields=['resolution', 'bucket']),
+        ]
+
+    @property
+    def avg_value(self):
+        return self.sum_value / self.count if self.count else None
+
+    def __str__(self):
+        return f"{self.sensor} - {self.resolution} {self.bucket}: {self.avg_value}"
+
+
 class ActuatorCommandLog(models.Model):
     """
     执行器命令日志模型，记录控制命令的发送和执行状态
@@ -0,0 +1,291 @@
+"""
+SensorData分区存储模块 - 按天或按月将传感器数据拆分到多个分区表，过期数据按分区整体删除
+
+只支持PostgreSQL，使用原生的声明式分区（PARTITION BY RANGE）。启用分区后仍按原表名访问数据，
+SensorData.objects 的查询和写入不需要修改，按时间范围查询时只扫描相关分区。
+过期分区由保留策略（iot_devices.retention）删除，删除前会确认分区中的数据已经汇总且全部过期。
+
+分区按UTC划分，表名为 iot_devices_sensordata_pYYYYMM（按月）或 iot_devices_sensordata_pYYYYMMDD（按天），
+范围由表名决定。启用分区前的数据保留在 _legacy 分区中，范围截止到最早的按期分区；
+不属于任何分区的记录（如设备时钟错误、未提前创建分区）写入 _default 分区，创建对应分区时移入新分区。
+"""
+
+import datetime
+import logging
+import re
+from typing import NamedTuple, Optional
+
+from django.db import connections, transaction
+from django.utils import timezone
+
+from .models import Sensor, SensorData
+
+# 配置日志记录器
+logger = logging.getLogger(__name__)
+
+PARTITION_DAY = 'day'
+PARTITION_MONTH = 'month'
+PARTITION_INTERVALS = (PARTITION_DAY, PARTITION_MONTH)
+
+TABLE = SensorData._meta.db_table
+LEGACY_TABLE = f'{TABLE}_legacy'
+DEFAULT_TABLE = f'{TABLE}_default'
+
+_PARTITION_NAME = re.compile(rf'^{TABLE}_p(\d{{6}}|\d{{8}})$')
+
+
+class PartitionError(Exception):
+    """分区状态不满足操作要求，如重复启用或未启用分区"""
+
+
+class Partition(NamedTuple):
+    """一个范围分区，start 为None表示没有下限（_legacy 分区）"""
+
+    name: str
+    start: Optional[datetime.datetime]
+    end: datetime.datetime
+
+
+def period_start(moment, interval):
+    """返回 moment 所在分区周期的开始时间（UTC）"""
+    moment = moment.astimezone(datetime.timezone.utc)
+    day = 1 if interval == PARTITION_MONTH else moment.day
+    return datetime.datetime(moment.year, moment.month, day, tzinfo=datetime.timezone.utc)
+
+
+def next_period(start, interval):
+    """返回从 start 开始的分区周期的结束时间"""
+    if interval == PARTITION_DAY:
+        return start + datetime.timedelta(days=1)
+    if start.month == 12:
+        return start.replace(year=start.year + 1, month=1)
+    return start.replace(month=start.month + 1)
+
+
+def partition_name(start, interval):
+    return f'{TABLE}_p{start:%Y%m%d}' if interval == PARTITION_DAY else f'{TABLE}_p{start:%Y%m}'
+
+
+def parse_partition(name):
+    """
+    从分区表名解析分区范围
+
+    Returns:
+        Partition: 不是按期分区的表名返回None
+    """
+    match = _PARTITION_NAME.match(name)
+    if match is None:
+        return None
+    digits = match.group(1)
+    if len(digits) == 8:
+        start = datetime.datetime.strptime(digits, '%Y%m%d').replace(tzinfo=datetime.timezone.utc)
+        return Partition(name, start, next_period(start, PARTITION_DAY))
+    start = datetime.datetime.strptime(digits, '%Y%m').replace(tzinfo=datetime.timezone.utc)
+    return Partition(name, start, next_period(start, PARTITION_MONTH))
+
+
+class PostgresPartitioner:
+    """
+    SensorData分区管理，使用PostgreSQL原生声明式分区
+
+    所有操作都在事务中执行。
+    """
+
+    def __init__(self, using='default'):
+        self.using = using
+        self.connection = connections[using]
+
+    def quote(self, name):
+        return self.connection.ops.quote_name(name)
+
+    def is_partitioned(self):
+        with self.connection.cursor() as cursor:
+            cursor.execute('SELECT relkind FROM pg_class WHERE oid = to_regclass(%s)', [TABLE])
+            row = cursor.fetchone()
+        return row is not None and row[0] == 'p'
+
+    def partitions(self):
+        """
+        当前的范围分区，按时间排序，不包括 _default 分区
+
+        Returns:
+            list: Partition 列表，存在 _legacy 分区时排在第一个
+        """
+        tables = self._partition_tables()
+        periodic = sorted(
+            (partition for partition in map(parse_partition, tables) if partition is not None),
+            key=lambda partition: partition.start
+        )
+        if LEGACY_TABLE in tables and periodic:
+            return [Partition(LEGACY_TABLE, None, periodic[0].start)] + periodic
+        return periodic
+
+    def enable(self, interval, ahead, now=None):
+        """
+        将SensorData表转换为分区表
+
+        原表改名为 _legacy 分区，范围截止到当前周期（原表中有更晚的记录时截止到其所在周期之后），
+        然后创建 _default 分区和从截止时间开始的分区。
+
+        Returns:
+            datetime: _legacy 分区的截止时间
+        """
+        now = now or timezone.now()
+        with transaction.atomic(using=self.using):
+            if self.is_partitioned():
+                raise PartitionError(f'{TABLE} 已经是分区表')
+            self._lock()
+            max_timestamp, max_id = self._table_bounds()
+            boundary = period_start(now, interval)
+            if max_timestamp is not None and max_timestamp >= boundary:
+                boundary = next_period(period_start(max_timestamp, interval), interval)
+            self._convert(boundary, max_id or 0)
+            first = Partition(partition_name(boundary, interval), boundary, next_period(boundary, interval))
+            self._create(first)
+            self.create_partitions(interval, ahead, now)
+        logger.info(f"{TABLE} 已转换为按{interval}分区，启用前的数据保存在 {LEGACY_TABLE}，截止 {boundary.isoformat()}")
+        return boundary
+
+    def create_partitions(self, interval, ahead, now=None):
+        """
+        创建从当前周期起 ahead 个未来周期内缺少的分区
+
+        从已有分区的结束时间接着创建，不会与已有分区重叠；按月分区的起点不在月初时先按天补齐到月初。
+
+        Returns:
+            list: 新建的分区表名
+        """
+        now = now or timezone.now()
+        created = []
+        with transaction.atomic(using=self.using):
+            if not self.is_partitioned():
+                raise PartitionError(f'{TABLE} 尚未启用分区')
+            horizon = period_start(now, interval)
+            for _ in range(ahead + 1):
+                horizon = next_period(horizon, interval)
+            existing = self.partitions()
+            cursor = period_start(now, interval)
+            if existing and existing[-1].end > cursor:
+                cursor = existing[-1].end
+            while cursor < horizon:
+                step = interval
+                if interval == PARTITION_MONTH and cursor.day != 1:
+                    step = PARTITION_DAY
+                partition = Partition(partition_name(cursor, step), cursor, next_period(cursor, step))
+                self._create(partition)
+                created.append(partition.name)
+                cursor = partition.end
+        if created:
+            logger.info(f"已创建 {len(created)} 个SensorData分区: {', '.join(created)}")
+        return created
+
+    def drop_partition(self, partition):
+        """
+        删除一个分区
+
+        删除整张分区表，耗时与分区中的记录数无关。调用方负责确认分区中的数据都可以删除，
+        见 iot_devices.retention.purge_expired_data。
+        """
+        with transaction.atomic(using=self.using):
+            if not self.is_partitioned():
+                raise PartitionError(f'{TABLE} 尚未启用分区')
+            self._drop(partition)
+        logger.info(f"已删除过期的SensorData分区: {partition.name}")
+
+    def _partition_tables(self):
+        with self.connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid '
+                'WHERE i.inhparent = to_regclass(%s)', [TABLE]
+            )
+            return [row[0] for row in cursor.fetchall()]
+
+    def _literal(self, moment):
+        return f"'{moment.astimezone(datetime.timezone.utc):%Y-%m-%d %H:%M:%S}+00'"
+
+    def _lock(self):
+        """转换期间阻止其他连接写入原表"""
+        with self.connection.cursor() as cursor:
+            cursor.execute(f'LOCK TABLE {self.quote(TABLE)} IN ACCESS EXCLUSIVE MODE')
+
+    def _table_bounds(self):
+        with self.connection.cursor() as cursor:
+            cursor.execute(f'SELECT MAX({self.quote("timestamp")}), MAX({self.quote("id")}) FROM {self.quote(TABLE)}')
+            max_timestamp, max_id = cursor.fetchone()
+        if max_timestamp is not None and timezone.is_naive(max_timestamp):
+            max_timestamp = max_timestamp.replace(tzinfo=datetime.timezone.utc)
+        return max_timestamp, max_id
+
+    def _convert(self, boundary, max_id):
+        q = self.quote
+        table, legacy = q(TABLE), q(LEGACY_TABLE)
+        sequence = f'{TABLE}_part_id_seq'
+        statements = [
+            f'ALTER TABLE {table} RENAME TO {legacy}',
+            # 原表的自增序列随 _legacy 分区一起删除，分区表使用独立的序列
+            f'ALTER TABLE {legacy} ALTER COLUMN id DROP IDENTITY IF EXISTS',
+            f'ALTER TABLE {legacy} ALTER COLUMN id DROP DEFAULT',
+            f'CREATE TABLE {table} (LIKE {legacy} INCLUDING DEFAULTS) PARTITION BY RANGE ({q("timestamp")})',
+            f'CREATE SEQUENCE {q(sequence)} OWNED BY {table}.id',
+            f"ALTER TABLE {table} ALTER COLUMN id SET DEFAULT nextval('{sequence}')",
+            # 分区表的主键必须包含分区键
+            f'ALTER TABLE {table} ADD CONSTRAINT {q(TABLE + "_part_pkey")} PRIMARY KEY (id, {q("timestamp")})',
+            f'ALTER TABLE {table} ADD CONSTRAINT {q(TABLE + "_part_sensor_fk")} FOREIGN KEY (sensor_id) '
+            f'REFERENCES {q(Sensor._meta.db_table)} (id) DEFERRABLE INITIALLY DEFERRED',
+            f'CREATE INDEX {q(TABLE + "_part_sensor_ts")} ON {table} (sensor_id, {q("timestamp")} DESC)',
+            f'CREATE INDEX {q(TABLE + "_part_ts")} ON {table} ({q("timestamp")})',
+            f'ALTER TABLE {table} ATTACH PARTITION {legacy} FOR VALUES FROM (MINVALUE) TO ({self._literal(boundary)})',
+            f'CREATE TABLE {q(DEFAULT_TABLE)} PARTITION OF {table} DEFAULT',
+        ]
+        with self.connection.cursor() as cursor:
+            for statement in statements:
+                cursor.execute(statement)
+            if max_id:
+                cursor.execute('SELECT setval(%s, %s)', [sequence, max_id])
+
+    def _create(self, partition):
+        q = self.quote
+        table, name = q(TABLE), q(partition.name)
+        with self.connection.cursor() as cursor:
+            cursor.execute(f'CREATE TABLE {name} (LIKE {table} INCLUDING DEFAULTS)')
+            # 先把 _default 分区中属于新分区范围的记录移过去，否则无法挂载
+            cursor.execute(
+                f'WITH moved AS (DELETE FROM {q(DEFAULT_TABLE)} WHERE {q("timestamp")} >= %s AND {q("timestamp")} < %s '
+                f'RETURNING *) INSERT INTO {name} SELECT * FROM moved',
+                [partition.start, partition.end]
+            )
+            cursor.execute(
+                f'ALTER TABLE {table} ATTACH PARTITION {name} '
+                f'FOR VALUES FROM ({self._literal(partition.start)}) TO ({self._literal(partition.end)})'
+            )
+
+    def _drop(self, partition):
+        with self.connection.cursor() as cursor:
+            cursor.execute(f'DROP TABLE {self.quote(partition.name)}')
+
+
+def get_partitioner(using='default'):
+    """
+    按数据库类型返回分区管理器
+
+    Raises:
+        PartitionError: 数据库不是PostgreSQL
+    """
+    vendor = connections[using].vendor
+    if vendor == 'postgresql':
+        return PostgresPartitioner(using)
+    raise PartitionError(f'SensorData分区只支持PostgreSQL，当前数据库为 {vendor}')
+
+
+def get_active_partitioner(using='default'):
+    """
+    返回已启用分区的分区管理器
+
+    Returns:
+        PostgresPartitioner: 数据库不支持分区或尚未启用分区时返回None
+    """
+    try:
+        partitioner = get_partitioner(using)
+    except PartitionError:
+        return None
+    return partitioner if partitioner.is_partitioned() else None
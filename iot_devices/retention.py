@@ -0,0 +1,338 @@
+"""
+传感器数据保留模块 - 将原始读数逐级汇总为分钟、小时和天数据，并按保留策略分批删除过期数据
+
+汇总是增量的：每次从已有汇总的最后一个时间段回溯 NOVA_SENSOR_DATA_ROLLUP_LOOKBACK 秒开始，
+按窗口重新计算已经结束的时间段并覆盖写入，回溯范围内补传的读数也会被计入。小时汇总由分钟汇总合并得到，
+天汇总由小时汇总合并得到，天汇总永久保留。
+只汇总数值读数（value_float），非数值读数过期后直接删除。
+汇总只统计已存储的读数，不按读数的持续时间加权：传感器启用了死区压缩（Sensor.deadband）时，被省略的读数不计入
+count，avg（sum/count）偏向变化较多的时段；min、max、first、last 不受影响。
+
+删除只涉及已经汇总到下一级的数据：原始读数不晚于分钟汇总完整覆盖的时间，分钟汇总不晚于小时汇总完整覆盖的时间，
+小时汇总不晚于天汇总完整覆盖的时间，因此汇总落后时（如任务停止了一段时间）不会丢失数据。
+每级汇总只计算源数据已经完整覆盖的时间段：分钟汇总按窗口分批进行、停在一小时中间时，这一小时的小时汇总等分钟汇总追上后才计算。保留天数按 传感器 > 项目 > 全局配置 的顺序确定。
+SensorData启用了分区时（iot_devices.partitions），整个分区都已过期的原始读数按分区整张删除，其余的按记录分批删除。
+"""
+
+import collections
+import datetime
+import logging
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Max, Min, Sum
+from django.db.models.functions import TruncDay, TruncHour, TruncMinute
+from django.utils import timezone
+
+from .models import Sensor, SensorData, SensorDataRollup
+from .partitions import get_active_partitioner
+
+# 配置日志记录器
+logger = logging.getLogger(__name__)
+
+RAW = 'raw'
+
+# 数据层级 -> (保留天数字段, 全局配置)
+RETENTION_FIELDS = {
+    RAW: ('raw_retention_days', 'NOVA_SENSOR_DATA_RAW_RETENTION_DAYS'),
+    SensorDataRollup.RESOLUTION_MINUTE: ('minute_rollup_retention_days', 'NOVA_SENSOR_DATA_MINUTE_ROLLUP_RETENTION_DAYS'),
+    SensorDataRollup.RESOLUTION_HOUR: ('hour_rollup_retention_days', 'NOVA_SENSOR_DATA_HOUR_ROLLUP_RETENTION_DAYS'),
+}
+
+
+class RollupLevel:
+    """一级汇总：从 source（RAW或更细的汇总粒度）按 step 汇总，每个窗口计算 window 长度的数据"""
+
+    def __init__(self, resolution, source, step, trunc, window):
+        self.resolution = resolution
+        self.source = source
+        self.step = step
+        self.trunc = trunc
+        self.window = window
+        self.time_field = 'timestamp' if source == RAW else 'bucket'
+
+    def source_queryset(self, start, end):
+        if self.source == RAW:
+            return SensorData.objects.filter(timestamp__gte=start, timestamp__lt=end, value_float__isnull=False)
+        return SensorDataRollup.objects.filter(resolution=self.source, bucket__gte=start, bucket__lt=end)
+
+    def aggregate(self, start, end):
+        """
+        按传感器和时间段汇总 [start, end) 内的源数据
+
+        Returns:
+            list: 字典列表，键为 sensor_id、slot、n、lo、hi、total、first、last
+        """
+        if self.source == RAW:
+            stats = dict(n=Count('id'), lo=Min('value_float'), hi=Max('value_float'), total=Sum('value_float'))
+        else:
+            stats = dict(n=Sum('count'), lo=Min('min_value'), hi=Max('max_value'), total=Sum('sum_value'))
+        rows = list(
+            self.source_queryset(start, end)
+            .annotate(slot=self.trunc(self.time_field, tzinfo=datetime.timezone.utc))
+            .order_by().values('sensor_id', 'slot')
+            .annotate(first_at=Min(self.time_field), last_at=Max(self.time_field), **stats)
+        )
+        # 首尾值无法在同一个分组查询中取得，按首尾时间再查一次
+        edges = self._edge_values(start, end, {row['first_at'] for row in rows} | {row['last_at'] for row in rows})
+        for row in rows:
+            row['first'] = edges.get((row['sensor_id'], row['first_at']), (None, None))[0]
+            row['last'] = edges.get((row['sensor_id'], row['last_at']), (None, None))[1]
+        return rows
+
+    def _edge_values(self, start, end, moments):
+        """返回 (传感器ID, 时间) -> (首值, 尾值)，原始读数的首值和尾值相同"""
+        edges = {}
+        moments = sorted(moments)
+        # 分组查询，避免SQLite的参数数量限制
+        for i in range(0, len(moments), 500):
+            queryset = self.source_queryset(start, end).filter(**{f'{self.time_field}__in': moments[i:i + 500]})
+            if self.source == RAW:
+                # 同一传感器同一时刻有多条读数时取最后写入的一条
+                for sensor_id, moment, value in queryset.order_by('id').values_list('sensor_id', 'timestamp', 'value_float'):
+                    edges[(sensor_id, moment)] = (value, value)
+            else:
+                for sensor_id, moment, first, last in queryset.values_list('sensor_id', 'bucket', 'first_value', 'last_value'):
+                    edges[(sensor_id, moment)] = (first, last)
+        return edges
+
+    def next_source_time(self, start, end):
+        """[start, end) 内最早一条源数据所在时间段的开始，没有数据时返回None"""
+        earliest = self.source_queryset(start, end).aggregate(earliest=Min(self.time_field))['earliest']
+        return floor_time(earliest, self.step) if earliest is not None else None
+
+
+ROLLUP_LEVELS = [
+    RollupLevel(SensorDataRollup.RESOLUTION_MINUTE, RAW, datetime.timedelta(minutes=1), TruncMinute,
+                datetime.timedelta(hours=1)),
+    RollupLevel(SensorDataRollup.RESOLUTION_HOUR, SensorDataRollup.RESOLUTION_MINUTE, datetime.timedelta(hours=1),
+                TruncHour, datetime.timedelta(days=1)),
+    RollupLevel(SensorDataRollup.RESOLUTION_DAY, SensorDataRollup.RESOLUTION_HOUR, datetime.timedelta(days=1),
+                TruncDay, datetime.timedelta(days=30)),
+]
+LEVELS_BY_RESOLUTION = {level.resolution: level for level in ROLLUP_LEVELS}
+
+# 最早的时间，用于首次汇总时查找第一条数据
+_EPOCH = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+
+
+def floor_time(moment, step):
+    """将时间向下取整到 step 的整数倍（UTC）"""
+    seconds = int((moment - _EPOCH).total_seconds())
+    return _EPOCH + datetime.timedelta(seconds=seconds - seconds % int(step.total_seconds()))
+
+
+def retention_days(sensor, tier):
+    """
+    传感器某一层级数据的保留天数
+
+    Args:
+        sensor: Sensor实例，应已 select_related('device__project')
+        tier: RAW 或汇总粒度
+
+    Returns:
+        int: 保留天数，永久保留时返回None
+    """
+    field, setting = RETENTION_FIELDS[tier]
+    for value in (getattr(sensor, field), getattr(sensor.device.project, field)):
+        if value is not None:
+            return value or None
+    return getattr(settings, setting, 0) or None
+
+
+def compute_rollups(now=None, max_windows=48):
+    """
+    增量计算各级汇总
+
+    count、sum 只统计已存储的读数，启用死区压缩的传感器的平均值不按持续时间加权，见模块说明。
+
+    Args:
+        now: 当前时间，只汇总在此之前已经结束的时间段
+        max_windows: 每级最多计算的窗口数，积压较多时分多次完成
+
+    Returns:
+        dict: 汇总粒度 -> 写入的汇总记录数
+    """
+    now = now or timezone.now()
+    lookback = datetime.timedelta(seconds=getattr(settings, 'NOVA_SENSOR_DATA_ROLLUP_LOOKBACK', 3600))
+    written = {}
+    for level in ROLLUP_LEVELS:
+        written[level.resolution] = _compute_level(level, now, lookback, max_windows)
+    return written
+
+
+def _compute_level(level, now, lookback, max_windows):
+    if level.source == RAW:
+        closed_end = floor_time(now, level.step)
+    else:
+        # 只汇总源数据已经完整覆盖的时间段，最后一个汇总时间段不会只包含部分源数据
+        closed_end = floor_time(_covered_until(LEVELS_BY_RESOLUTION[level.source], now), level.step)
+    last = SensorDataRollup.objects.filter(resolution=level.resolution).aggregate(last=Max('bucket'))['last']
+    if last is None:
+        start = level.next_source_time(_EPOCH, closed_end)
+    else:
+        start = floor_time(last - lookback, level.step)
+
+    written = 0
+    for _ in range(max_windows):
+        if start is None or start >= closed_end:
+            break
+        end = min(start + level.window, closed_end)
+        rows = level.aggregate(start, end)
+        if not rows:
+            # 窗口内没有数据时直接跳到下一条数据所在的时间段
+            start = level.next_source_time(end, closed_end)
+            continue
+        with transaction.atomic():
+            SensorDataRollup.objects.bulk_create(
+                [
+                    SensorDataRollup(
+                        sensor_id=row['sensor_id'], resolution=level.resolution, bucket=row['slot'],
+                        count=row['n'], min_value=row['lo'], max_value=row['hi'], sum_value=row['total'],
+                        first_value=row['first'], last_value=row['last']
+                    )
+                    for row in rows
+                ],
+                batch_size=1000,
+                update_conflicts=True,
+                unique_fields=['sensor', 'resolution', 'bucket'],
+                update_fields=['count', 'min_value', 'max_value', 'sum_value', 'first_value', 'last_value'],
+            )
+        written += len(rows)
+        start = end
+    return written
+
+
+def _covered_until(level, now):
+    """
+    level 级汇总已经完整计算到的时间
+
+    源数据覆盖到的时间（原始读数为 now）按本级步长向下取整后，减去还没有汇总的部分：
+    最后一个汇总时间段之后还有源数据时，截止到其中最早一条所在的时间段。
+    因此只汇总了部分源数据的时间段不算作已覆盖。
+    """
+    if level.source == RAW:
+        source_until = now
+    else:
+        source_until = _covered_until(LEVELS_BY_RESOLUTION[level.source], now)
+    closed_end = floor_time(source_until, level.step)
+    last = SensorDataRollup.objects.filter(resolution=level.resolution).aggregate(last=Max('bucket'))['last']
+    pending = level.next_source_time(_EPOCH if last is None else last + level.step, closed_end)
+    return closed_end if pending is None else pending
+
+
+def _rolled_up_until(tier, now):
+    """
+    tier 层级的数据已经汇总到下一级的截止时间
+
+    Returns:
+        datetime: 没有下一级时返回None，表示不限制
+    """
+    level = next((level for level in ROLLUP_LEVELS if level.source == tier), None)
+    if level is None:
+        return None
+    return _covered_until(level, now)
+
+
+def purge_expired_data(now=None, batch_size=None, max_batches=100):
+    """
+    按保留策略删除过期的原始读数和汇总
+
+    Args:
+        now: 当前时间
+        batch_size: 每批删除的最大记录数，默认为 settings.NOVA_SENSOR_DATA_PURGE_BATCH_SIZE
+        max_batches: 本次最多执行的删除批数，未删完的数据留到下次
+
+    Returns:
+        dict: 层级 -> 删除的记录数；SensorData启用了分区时另有 'partitions' -> 删除的分区数，
+            按分区删除的原始读数不计入 raw
+    """
+    now = now or timezone.now()
+    batch_size = batch_size or getattr(settings, 'NOVA_SENSOR_DATA_PURGE_BATCH_SIZE', 5000)
+    sensors = list(Sensor.objects.select_related('device__project'))
+    remaining = max_batches
+    deleted = dict.fromkeys(RETENTION_FIELDS, 0)
+    for tier in RETENTION_FIELDS:
+        groups = collections.defaultdict(list)
+        for sensor in sensors:
+            days = retention_days(sensor, tier)
+            if days:
+                groups[days].append(sensor.pk)
+        if not groups:
+            continue
+        limit = _rolled_up_until(tier, now)
+        cutoffs = {}
+        for days, sensor_ids in groups.items():
+            cutoff = now - datetime.timedelta(days=days)
+            if limit is not None:
+                cutoff = min(cutoff, limit)
+            cutoffs[days] = cutoff
+        if tier == RAW:
+            partitioner = get_active_partitioner()
+            if partitioner is not None:
+                sensor_cutoffs = {
+                    sensor_id: cutoffs[days] for days, sensor_ids in groups.items() for sensor_id in sensor_ids
+                }
+                deleted['partitions'] = len(_drop_expired_partitions(partitioner, sensor_cutoffs))
+        for days, sensor_ids in sorted(groups.items()):
+            cutoff = cutoffs[days]
+            # 分组查询，避免SQLite的参数数量限制
+            for i in range(0, len(sensor_ids), 500):
+                if tier == RAW:
+                    queryset = SensorData.objects.filter(sensor_id__in=sensor_ids[i:i + 500], timestamp__lt=cutoff)
+                else:
+                    queryset = SensorDataRollup.objects.filter(
+                        sensor_id__in=sensor_ids[i:i + 500], resolution=tier, bucket__lt=cutoff
+                    )
+                count, remaining = _delete_in_batches(queryset, batch_size, remaining)
+                deleted[tier] += count
+                if remaining <= 0:
+                    logger.info(f"本次删除已达到 {max_batches} 批的上限，剩余的过期数据留到下次删除")
+                    return deleted
+    return deleted
+
+
+def _drop_expired_partitions(partitioner, cutoffs):
+    """
+    删除其中的原始读数全部过期的SensorData分区
+
+    分区的结束时间不晚于其中每条读数所属传感器的截止时间时才删除，永久保留的传感器在分区中有读数时不删除。
+
+    Args:
+        partitioner: 已启用分区的分区管理器
+        cutoffs: 传感器ID -> 原始读数的删除截止时间，不包括永久保留的传感器
+
+    Returns:
+        list: 删除的分区
+    """
+    latest = max(cutoffs.values())
+    dropped = []
+    for partition in partitioner.partitions():
+        if partition.end > latest:
+            break
+        records = SensorData.objects.filter(timestamp__lt=partition.end)
+        if partition.start is not None:
+            records = records.filter(timestamp__gte=partition.start)
+        expired = [sensor_id for sensor_id, cutoff in cutoffs.items() if cutoff >= partition.end]
+        # 按时间范围查询只访问这一个分区
+        if records.exclude(sensor_id__in=expired).exists():
+            continue
+        partitioner.drop_partition(partition)
+        dropped.append(partition)
+    return dropped
+
+
+def _delete_in_batches(queryset, batch_size, remaining):
+    """每批按主键删除最多 batch_size 条记录，返回 (删除数, 剩余批数)"""
+    deleted = 0
+    while remaining > 0:
+        ids = list(queryset.order_by().values_list('pk', flat=True)[:batch_size])
+        if not ids:
+            break
+        # 保留原有的时间条件，分区表可以只访问相关的分区
+        count, _ = queryset.filter(pk__in=ids).delete()
+        deleted += count
+        remaining -= 1
+        if len(ids) < batch_size:
+            break
+    return deleted, remaining
@@ -0,0 +1,140 @@
+"""
+传感器时间序列查询模块 - 按查询范围和数据点上限自动选择原始读数或汇总数据
+
+选择能提供至少 max_points 个时间段的最粗汇总粒度，再把相邻时间段合并为不超过 max_points 个点，
+例如30天的图表读取约720条小时汇总而不是全部原始读数；范围太短、分钟汇总也不足 max_points 个时间段时
+直接读取原始读数。只有数值读数会被汇总，没有汇总数据的传感器同样读取原始读数。
+汇总任务尚未覆盖的最近一段时间依次由更细的汇总和原始读数补齐，图表最新的部分不会缺失。
+"""
+
+import math
+from typing import Any, NamedTuple
+
+from django.db.models import Max
+from django.utils import timezone
+
+from .models import SensorData, SensorDataRollup
+from .retention import RAW, ROLLUP_LEVELS, floor_time
+
+
+class SeriesPoint(NamedTuple):
+    """一个时间段的汇总值"""
+
+    timestamp: Any  # datetime，时间段开始
+    count: int
+    min: float
+    max: float
+    avg: float
+    first: Any  # float，旧的汇总记录可能没有首尾值
+    last: Any
+
+
+class Series(NamedTuple):
+    """查询结果"""
+
+    resolution: str  # RAW 或汇总粒度
+    points: list  # resolution 为 RAW 时是按时间排序的SensorData记录，否则是 SeriesPoint
+    rows_read: int  # 从数据库读取的记录数
+
+
+def choose_level(start, end, max_points):
+    """
+    选择能提供至少 max_points 个时间段的最粗汇总粒度
+
+    Returns:
+        RollupLevel: 范围太短时返回None，表示读取原始读数
+    """
+    span = end - start
+    for level in reversed(ROLLUP_LEVELS):
+        if span / level.step >= max_points:
+            return level
+    return None
+
+
+def query_series(sensor, start, end, max_points=200):
+    """
+    查询传感器在 [start, end] 内的时间序列
+
+    Args:
+        sensor: Sensor实例或ID
+        start: 开始时间，不带时区时按 settings.TIME_ZONE 解释
+        end: 结束时间
+        max_points: 数据点上限，只对汇总数据生效，原始读数由调用方自行采样
+
+    Returns:
+        Series
+    """
+    if timezone.is_naive(start):
+        start = timezone.make_aware(start)
+    if timezone.is_naive(end):
+        end = timezone.make_aware(end)
+
+    level = choose_level(start, end, max_points)
+    if level is not None:
+        aligned = floor_time(start, level.step)
+        pieces = _pieces(sensor, ROLLUP_LEVELS.index(level), aligned, end)
+        # 只汇总数值读数，没有汇总数据（如字符串和布尔传感器）时读取原始读数
+        if pieces:
+            buckets = math.ceil((end - aligned) / level.step)
+            width = level.step * max(1, math.ceil(buckets / max_points))
+            return Series(level.resolution, _merge(pieces, aligned, width), len(pieces))
+
+    records = list(
+        SensorData.objects.filter(sensor=sensor, timestamp__gte=start, timestamp__lte=end).order_by('timestamp')
+    )
+    return Series(RAW, records, len(records))
+
+
+def _merge(pieces, aligned, width):
+    """将按时间排序的汇总片段合并为宽度为 width 的数据点"""
+    merged = []
+    for moment, count, low, high, total, first, last in pieces:
+        key = aligned + ((moment - aligned) // width) * width
+        if merged and merged[-1][0] == key:
+            point = merged[-1]
+            point[1] += count
+            point[2] = min(point[2], low)
+            point[3] = max(point[3], high)
+            point[4] += total
+            if point[5] is None:
+                point[5] = first
+            if last is not None:
+                point[6] = last
+        else:
+            merged.append([key, count, low, high, total, first, last])
+    return [
+        SeriesPoint(key, count, low, high, total / count, first, last)
+        for key, count, low, high, total, first, last in merged
+    ]
+
+
+def _pieces(sensor, index, start, end):
+    """
+    [start, end) 内按时间排序的 (时间, 数量, 最小值, 最大值, 总和, 首值, 尾值)
+
+    先读取 ROLLUP_LEVELS[index] 粒度的汇总，汇总尚未覆盖的部分递归读取更细的粒度，最后是原始读数。
+    """
+    if index < 0:
+        rows = (
+            SensorData.objects.filter(sensor=sensor, timestamp__gte=start, timestamp__lt=end, value_float__isnull=False)
+            .order_by('timestamp').values_list('timestamp', 'value_float')
+        )
+        return [(moment, 1, value, value, value, value, value) for moment, value in rows]
+
+    level = ROLLUP_LEVELS[index]
+    pieces = []
+    # 汇总按时间窗口对所有传感器统一计算，最后一个时间段之前的数据都已汇总
+    last = SensorDataRollup.objects.filter(resolution=level.resolution).aggregate(last=Max('bucket'))['last']
+    if last is not None and last + level.step > start:
+        covered = min(last + level.step, end)
+        pieces.extend(
+            SensorDataRollup.objects.filter(
+                sensor=sensor, resolution=level.resolution, bucket__gte=start, bucket__lt=covered
+            ).order_by('bucket').values_list(
+                'bucket', 'count', 'min_value', 'max_value', 'sum_value', 'first_value', 'last_value'
+            )
+        )
+        start = covered
+    if start < end:
+        pieces.extend(_pieces(sensor, index - 1, start, end))
+    return pieces
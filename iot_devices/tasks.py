@@ -0,0 +1,41 @@
+"""
+设备数据Celery任务模块 - 用于传感器数据的定期汇总和过期数据清理
+"""
+
+import logging
+from celery import shared_task
+
+from .retention import compute_rollups, purge_expired_data
+
+# 配置日志记录器
+logger = logging.getLogger(__name__)
+
+
+@shared_task
+def compact_sensor_data(max_windows=48, batch_size=None, max_batches=100):
+    """
+    增量汇总传感器数据，并按保留策略分批删除过期的原始读数和汇总
+
+    这个任务应该被设置为定期运行，如每5分钟运行一次；积压较多时每次只处理一部分，多次运行后追上
+
+    Args:
+        max_windows: 每级汇总最多计算的窗口数（分钟汇总每个窗口1小时，小时汇总每个窗口1天）
+        batch_size: 每批删除的最大记录数，默认为 settings.NOVA_SENSOR_DATA_PURGE_BATCH_SIZE
+        max_batches: 每次最多执行的删除批数
+
+    Returns:
+        dict: {'rollups': 各粒度写入的汇总数, 'deleted': 各层级删除的记录数}
+    """
+    try:
+        written = compute_rollups(max_windows=max_windows)
+        deleted = purge_expired_data(batch_size=batch_size, max_batches=max_batches)
+    except Exception as e:
+        logger.error(f"汇总和清理传感器数据时出错: {str(e)}")
+        return None
+
+    if any(written.values()) or any(deleted.values()):
+        logger.info(
+            f"传感器数据汇总: {', '.join(f'{k}={v}' for k, v in written.items())}; "
+            f"已删除过期数据: {', '.join(f'{k}={v}' for k, v in deleted.items())}"
+        )
+    return {'rollups': written, 'deleted': deleted}
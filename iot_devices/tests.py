@@ -1,3 +1,560 @@
-from django.test import TestCase
+import datetime
+import re
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from .models import Device, Project, Sensor, SensorData, SensorDataRollup
+from .partitions import (
+    DEFAULT_TABLE, LEGACY_TABLE, PARTITION_DAY, PARTITION_MONTH, TABLE, Partition, PartitionError,
+    PostgresPartitioner, get_active_partitioner, get_partitioner, parse_partition, partition_name, period_start,
+)
+from .retention import RAW, _drop_expired_partitions, compute_rollups, purge_expired_data, retention_days
+from .series import choose_level, query_series
+
+NOW = datetime.datetime(2026, 6, 15, 12, 0, tzinfo=datetime.timezone.utc)
+MINUTE = SensorDataRollup.RESOLUTION_MINUTE
+HOUR = SensorDataRollup.RESOLUTION_HOUR
+DAY = SensorDataRollup.RESOLUTION_DAY
+
+
+def days_ago(days):
+    return NOW - datetime.timedelta(days=days)
+
+
+class SensorDataTestCase(TestCase):
+    """创建项目、设备和传感器的公共方法"""
+
+    def setUp(self):
+        self.user = User.objects.create_user('owner', password='secret')
+        self.project = self.create_project()
+        self.device = Device.objects.create(name='设备', project=self.project)
+
+    def create_project(self, name='项目', **kwargs):
+        return Project.objects.create(name=name, owner=self.user, **kwargs)
+
+    def create_sensor(self, key='temperature', device=None, **kwargs):
+        return Sensor.objects.create(
+            name=key, sensor_type='temperature', value_key=key, device=device or self.device, **kwargs
+        )
+
+    def create_reading(self, sensor, timestamp, value=1.0):
+        return SensorData.objects.create(sensor=sensor, timestamp=timestamp, value_float=value)
+
+    def create_rollup(self, sensor, resolution, bucket, value=1.0, count=1):
+        return SensorDataRollup.objects.create(
+            sensor=sensor, resolution=resolution, bucket=bucket, count=count, min_value=value,
+            max_value=value, sum_value=value * count, first_value=value, last_value=value
+        )
+
+
+class RetentionDaysTests(SensorDataTestCase):
+
+    @override_settings(NOVA_SENSOR_DATA_RAW_RETENTION_DAYS=30)
+    def test_sensor_overrides_project_overrides_global(self):
+        self.project.raw_retention_days = 10
+        self.project.save()
+        other_project = self.create_project(name='其他项目')
+        other_device = Device.objects.create(name='其他设备', project=other_project)
+
+        own = self.create_sensor('own', raw_retention_days=2)
+        inherited = self.create_sensor('inherited')
+        global_default = self.create_sensor('global', device=other_device)
+
+        self.assertEqual(retention_days(own, RAW), 2)
+        self.assertEqual(retention_days(inherited, RAW), 10)
+        self.assertEqual(retention_days(global_default, RAW), 30)
+
+    @override_settings(NOVA_SENSOR_DATA_RAW_RETENTION_DAYS=30)
+    def test_zero_keeps_forever_and_overrides_lower_priority(self):
+        self.project.raw_retention_days = 0
+        self.project.save()
+        self.assertIsNone(retention_days(self.create_sensor('inherited'), RAW))
+        self.assertEqual(retention_days(self.create_sensor('own', raw_retention_days=5), RAW), 5)
+
+    @override_settings(NOVA_SENSOR_DATA_RAW_RETENTION_DAYS=30)
+    def test_purge_uses_each_sensors_retention(self):
+        self.project.raw_retention_days = 10
+        self.project.save()
+        own = self.create_sensor('own', raw_retention_days=2)
+        inherited = self.create_sensor('inherited')
+        for sensor in (own, inherited):
+            self.create_reading(sensor, days_ago(5))
+            self.create_rollup(sensor, MINUTE, NOW)
+
+        deleted = purge_expired_data(now=NOW)
+
+        self.assertEqual(deleted[RAW], 1)
+        self.assertFalse(SensorData.objects.filter(sensor=own).exists())
+        self.assertTrue(SensorData.objects.filter(sensor=inherited).exists())
+
+
+@override_settings(
+    NOVA_SENSOR_DATA_RAW_RETENTION_DAYS=1,
+    NOVA_SENSOR_DATA_MINUTE_ROLLUP_RETENTION_DAYS=1,
+    NOVA_SENSOR_DATA_HOUR_ROLLUP_RETENTION_DAYS=1,
+)
+class PurgeCutoffTests(SensorDataTestCase):
+    """过期数据只删除到已经汇总到下一级的时间为止"""
+
+    def setUp(self):
+        super().setUp()
+        self.sensor = self.create_sensor()
+
+    def test_raw_is_kept_until_minute_rollups_exist(self):
+        self.create_reading(self.sensor, days_ago(10))
+
+        purge_expired_data(now=NOW)
+
+        self.assertEqual(SensorData.objects.count(), 1)
+
+    def test_raw_is_not_purged_past_last_minute_bucket(self):
+        self.create_reading(self.sensor, days_ago(10))
+        self.create_reading(self.sensor, days_ago(5))
+        self.create_rollup(self.sensor, MINUTE, days_ago(7))
+
+        purge_expired_data(now=NOW)
+
+        self.assertQuerySetEqual(SensorData.objects.values_list('timestamp', flat=True), [days_ago(5)])
+
+    def test_raw_inside_last_minute_bucket_is_purged(self):
+        bucket = days_ago(7)
+        self.create_reading(self.sensor, bucket + datetime.timedelta(seconds=30))
+        self.create_reading(self.sensor, bucket + datetime.timedelta(minutes=1))
+        self.create_rollup(self.sensor, MINUTE, bucket)
+
+        purge_expired_data(now=NOW)
+
+        self.assertQuerySetEqual(
+            SensorData.objects.values_list('timestamp', flat=True), [bucket + datetime.timedelta(minutes=1)]
+        )
+
+    def test_minute_rollups_are_not_purged_past_last_hour_bucket(self):
+        self.create_rollup(self.sensor, MINUTE, days_ago(10))
+        self.create_rollup(self.sensor, MINUTE, days_ago(5))
+        self.create_rollup(self.sensor, HOUR, days_ago(7))
+
+        purge_expired_data(now=NOW)
+
+        self.assertQuerySetEqual(
+            SensorDataRollup.objects.filter(resolution=MINUTE).values_list('bucket', flat=True), [days_ago(5)]
+        )
+
+    def test_hour_rollups_are_not_purged_past_last_day_bucket(self):
+        self.create_rollup(self.sensor, HOUR, days_ago(10))
+        self.create_rollup(self.sensor, HOUR, days_ago(5))
+        self.create_rollup(self.sensor, DAY, days_ago(7))
+
+        purge_expired_data(now=NOW)
+
+        self.assertQuerySetEqual(
+            SensorDataRollup.objects.filter(resolution=HOUR).values_list('bucket', flat=True), [days_ago(5)]
+        )
+
+    def test_minute_rollups_in_partial_last_hour_are_kept(self):
+        hour = days_ago(10)
+        # 分钟汇总停在这一小时的中间，小时汇总只包含前30分钟
+        for minute in range(30):
+            self.create_rollup(self.sensor, MINUTE, hour + datetime.timedelta(minutes=minute))
+        self.create_reading(self.sensor, hour + datetime.timedelta(minutes=30))
+        self.create_rollup(self.sensor, MINUTE, hour - datetime.timedelta(hours=1))
+        self.create_rollup(self.sensor, HOUR, hour - datetime.timedelta(hours=1))
+        self.create_rollup(self.sensor, HOUR, hour, count=30)
+
+        purge_expired_data(now=NOW)
+
+        minutes = SensorDataRollup.objects.filter(resolution=MINUTE)
+        self.assertEqual(minutes.count(), 30)
+        self.assertFalse(minutes.filter(bucket__lt=hour).exists())
+        self.assertEqual(SensorData.objects.count(), 1)
+
+    def test_retention_applies_when_rollups_are_current(self):
+        self.create_reading(self.sensor, days_ago(2))
+        self.create_reading(self.sensor, NOW - datetime.timedelta(hours=1))
+        self.create_rollup(self.sensor, MINUTE, NOW)
+
+        deleted = purge_expired_data(now=NOW)
+
+        self.assertEqual(deleted[RAW], 1)
+        self.assertEqual(SensorData.objects.count(), 1)
+
+
+class ComputeRollupsTests(SensorDataTestCase):
+
+    def test_hour_is_not_rolled_up_from_partial_minutes(self):
+        sensor = self.create_sensor()
+        start = NOW - datetime.timedelta(hours=4)
+        SensorData.objects.bulk_create([
+            SensorData(sensor=sensor, timestamp=start + datetime.timedelta(minutes=i), value_float=1.0)
+            for i in range(180)
+        ])
+        # 已有的分钟汇总不在整点，之后的窗口也不在整点
+        self.create_rollup(sensor, MINUTE, start + datetime.timedelta(minutes=29))
+
+        compute_rollups(now=NOW, max_windows=2)
+
+        # 分钟汇总只完成到 start+89分钟，第二个小时还不完整
+        self.assertEqual(
+            SensorDataRollup.objects.filter(resolution=MINUTE).latest('bucket').bucket,
+            start + datetime.timedelta(minutes=88)
+        )
+        hours = SensorDataRollup.objects.filter(resolution=HOUR)
+        self.assertQuerySetEqual(hours.values_list('bucket', 'count'), [(start, 60)])
+
+        compute_rollups(now=NOW)
+
+        self.assertQuerySetEqual(
+            hours.order_by('bucket').values_list('bucket', 'count'),
+            [(start + datetime.timedelta(hours=hour), 60) for hour in range(3)]
+        )
+
+
+class FakePartitioner:
+    """记录删除操作的分区管理器，分区中的记录仍保存在普通的SensorData表中"""
+
+    def __init__(self, partitions):
+        self._partitions = partitions
+        self.dropped = []
+
+    def partitions(self):
+        return list(self._partitions)
+
+    def drop_partition(self, partition):
+        self.dropped.append(partition.name)
+
+
+class DropExpiredPartitionsTests(SensorDataTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.short = self.create_sensor('short')
+        self.long = self.create_sensor('long')
+        self.partitioner = FakePartitioner([
+            Partition('legacy', None, days_ago(30)),
+            Partition('p1', days_ago(30), days_ago(20)),
+            Partition('p2', days_ago(20), days_ago(10)),
+            Partition('p3', days_ago(10), NOW),
+        ])
+
+    def test_drops_only_partitions_whose_readings_are_all_expired(self):
+        self.create_reading(self.short, days_ago(35))
+        self.create_reading(self.long, days_ago(25))
+        self.create_reading(self.short, days_ago(15))
+        cutoffs = {self.short.pk: days_ago(10), self.long.pk: days_ago(25)}
+
+        _drop_expired_partitions(self.partitioner, cutoffs)
+
+        # p1 中 long 的读数未过期；p2 中只有 short 的读数；p3 结束时间晚于所有截止时间
+        self.assertEqual(self.partitioner.dropped, ['legacy', 'p2'])
+
+    def test_sensor_kept_forever_blocks_drop(self):
+        self.create_reading(self.long, days_ago(35))
+
+        _drop_expired_partitions(self.partitioner, {self.short.pk: days_ago(10)})
+
+        self.assertEqual(self.partitioner.dropped, ['p1', 'p2'])
+
+
+def utc(*args):
+    return datetime.datetime(*args, tzinfo=datetime.timezone.utc)
+
+
+class PartitionRangeTests(SimpleTestCase):
+
+    def test_month_partition_bounds(self):
+        self.assertEqual(partition_name(utc(2026, 12, 1), PARTITION_MONTH), f'{TABLE}_p202612')
+        self.assertEqual(
+            parse_partition(f'{TABLE}_p202612'), Partition(f'{TABLE}_p202612', utc(2026, 12, 1), utc(2027, 1, 1))
+        )
+        self.assertEqual(parse_partition(f'{TABLE}_p202602').end, utc(2026, 3, 1))
+
+    def test_day_partition_bounds(self):
+        self.assertEqual(partition_name(utc(2028, 2, 29), PARTITION_DAY), f'{TABLE}_p20280229')
+        self.assertEqual(parse_partition(f'{TABLE}_p20280228').end, utc(2028, 2, 29))
+        self.assertEqual(parse_partition(f'{TABLE}_p20280229').end, utc(2028, 3, 1))
+        self.assertEqual(parse_partition(f'{TABLE}_p20261231').end, utc(2027, 1, 1))
+
+    def test_periods_are_utc(self):
+        moment = datetime.datetime(2026, 3, 1, 1, 0, tzinfo=datetime.timezone(datetime.timedelta(hours=8)))
+        self.assertEqual(period_start(moment, PARTITION_MONTH), utc(2026, 2, 1))
+        self.assertEqual(period_start(moment, PARTITION_DAY), utc(2026, 2, 28))
+
+    def test_other_tables_are_not_periodic_partitions(self):
+        for name in (LEGACY_TABLE, DEFAULT_TABLE, f'{TABLE}_p2026', f'{TABLE}_p2026011', 'other_p202601'):
+            self.assertIsNone(parse_partition(name))
+
+
+class FakePostgresCursor:
+
+    def __init__(self, database):
+        self.database = database
+        self.rows = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def execute(self, sql, params=None):
+        database = self.database
+        database.executed.append((sql, params))
+        if sql.startswith('SELECT relkind'):
+            self.rows = [(database.relkind,)] if database.relkind else []
+        elif sql.startswith('SELECT MAX('):
+            self.rows = [database.bounds]
+        elif sql.startswith('SELECT c.relname'):
+            self.rows = [(table,) for table in database.tables]
+        elif 'PARTITION BY RANGE' in sql:
+            database.relkind = 'p'
+        elif 'ATTACH PARTITION' in sql or 'PARTITION OF' in sql:
+            database.tables.append(re.search(r'(?:ATTACH PARTITION|CREATE TABLE) "([^"]+)"', sql).group(1))
+        elif sql.startswith('DROP TABLE'):
+            database.tables.remove(re.search(r'"([^"]+)"', sql).group(1))
+
+    def fetchone(self):
+        return self.rows[0] if self.rows else None
+
+    def fetchall(self):
+        return self.rows
+
+
+class FakePostgres:
+    """记录执行的SQL并模拟PostgreSQL目录查询的连接"""
+
+    vendor = 'postgresql'
+
+    def __init__(self, relkind='r', tables=(), bounds=(None, None)):
+        self.ops = connection.ops
+        self.relkind = relkind
+        self.tables = list(tables)
+        self.bounds = bounds
+        self.executed = []
+
+    def cursor(self):
+        return FakePostgresCursor(self)
+
+    def statements(self, prefix):
+        return [sql for sql, _ in self.executed if sql.startswith(prefix)]
+
+
+class PostgresPartitionerTests(TestCase):
+
+    def partitioner(self, **kwargs):
+        partitioner = PostgresPartitioner()
+        partitioner.connection = self.database = FakePostgres(**kwargs)
+        return partitioner
+
+    def attached(self):
+        return [
+            re.search(r'ATTACH PARTITION "([^"]+)" FOR VALUES FROM \((.+)\) TO \((.+)\)', sql).groups()
+            for sql in self.database.statements(f'ALTER TABLE "{TABLE}" ATTACH PARTITION')
+        ]
+
+    def test_is_partitioned_checks_relkind(self):
+        self.assertTrue(self.partitioner(relkind='p').is_partitioned())
+        self.assertFalse(self.partitioner(relkind='r').is_partitioned())
+        self.assertFalse(self.partitioner(relkind=None).is_partitioned())
+
+    def test_enable_converts_table_and_creates_partitions(self):
+        partitioner = self.partitioner(bounds=(utc(2026, 12, 20, 8), 42))
+
+        boundary = partitioner.enable(PARTITION_MONTH, ahead=2, now=utc(2026, 12, 15))
+
+        # 原表中有当前周期的记录，_legacy 分区截止到下个月初
+        self.assertEqual(boundary, utc(2027, 1, 1))
+        executed = [sql for sql, _ in self.database.executed]
+        self.assertLess(
+            executed.index(f'LOCK TABLE "{TABLE}" IN ACCESS EXCLUSIVE MODE'),
+            executed.index(f'ALTER TABLE "{TABLE}" RENAME TO "{LEGACY_TABLE}"')
+        )
+        self.assertIn(
+            f'CREATE TABLE "{TABLE}" (LIKE "{LEGACY_TABLE}" INCLUDING DEFAULTS) PARTITION BY RANGE ("timestamp")',
+            executed
+        )
+        self.assertIn(f'ALTER TABLE "{TABLE}" ADD CONSTRAINT "{TABLE}_part_pkey" PRIMARY KEY (id, "timestamp")', executed)
+        self.assertIn(f'CREATE TABLE "{DEFAULT_TABLE}" PARTITION OF "{TABLE}" DEFAULT', executed)
+        self.assertIn(('SELECT setval(%s, %s)', [f'{TABLE}_part_id_seq', 42]), self.database.executed)
+        self.assertEqual(self.attached(), [
+            (LEGACY_TABLE, 'MINVALUE', "'2027-01-01 00:00:00+00'"),
+            (f'{TABLE}_p202701', "'2027-01-01 00:00:00+00'", "'2027-02-01 00:00:00+00'"),
+            (f'{TABLE}_p202702', "'2027-02-01 00:00:00+00'", "'2027-03-01 00:00:00+00'"),
+        ])
+
+    def test_enable_empty_table_starts_at_current_period(self):
+        partitioner = self.partitioner()
+
+        boundary = partitioner.enable(PARTITION_DAY, ahead=0, now=utc(2026, 6, 15, 12))
+
+        self.assertEqual(boundary, utc(2026, 6, 15))
+        self.assertEqual(self.database.statements('SELECT setval'), [])
+        self.assertEqual(self.attached()[1:], [
+            (f'{TABLE}_p20260615', "'2026-06-15 00:00:00+00'", "'2026-06-16 00:00:00+00'"),
+        ])
+
+    def test_enable_twice_is_rejected(self):
+        with self.assertRaises(PartitionError):
+            self.partitioner(relkind='p').enable(PARTITION_MONTH, ahead=1)
+        self.assertEqual(self.database.statements('ALTER TABLE'), [])
+
+    def test_month_partitions_continue_from_day_partition_by_day(self):
+        partitioner = self.partitioner(relkind='p', tables=[LEGACY_TABLE, DEFAULT_TABLE, f'{TABLE}_p20260130'])
+
+        created = partitioner.create_partitions(PARTITION_MONTH, ahead=1, now=utc(2026, 1, 30))
+
+        self.assertEqual(created, [f'{TABLE}_p20260131', f'{TABLE}_p202602'])
+        self.assertEqual(self.attached(), [
+            (f'{TABLE}_p20260131', "'2026-01-31 00:00:00+00'", "'2026-02-01 00:00:00+00'"),
+            (f'{TABLE}_p202602', "'2026-02-01 00:00:00+00'", "'2026-03-01 00:00:00+00'"),
+        ])
+
+    def test_day_partitions_across_leap_day(self):
+        partitioner = self.partitioner(relkind='p', tables=[f'{TABLE}_p20280227'])
+
+        created = partitioner.create_partitions(PARTITION_DAY, ahead=2, now=utc(2028, 2, 27, 23))
+
+        self.assertEqual(created, [f'{TABLE}_p20280228', f'{TABLE}_p20280229'])
+        self.assertEqual(self.attached()[-1], (
+            f'{TABLE}_p20280229', "'2028-02-29 00:00:00+00'", "'2028-03-01 00:00:00+00'"
+        ))
+
+    def test_create_moves_rows_out_of_default_partition(self):
+        partitioner = self.partitioner(relkind='p')
+
+        partitioner.create_partitions(PARTITION_MONTH, ahead=0, now=utc(2026, 6, 15))
+
+        (sql, params), = [(sql, params) for sql, params in self.database.executed if sql.startswith('WITH moved')]
+        self.assertEqual(
+            sql,
+            f'WITH moved AS (DELETE FROM "{DEFAULT_TABLE}" WHERE "timestamp" >= %s AND "timestamp" < %s '
+            f'RETURNING *) INSERT INTO "{TABLE}_p202606" SELECT * FROM moved'
+        )
+        self.assertEqual(params, [utc(2026, 6, 1), utc(2026, 7, 1)])
+
+    def test_partitions_lists_legacy_first_without_default(self):
+        partitioner = self.partitioner(
+            relkind='p', tables=[f'{TABLE}_p202602', DEFAULT_TABLE, LEGACY_TABLE, f'{TABLE}_p202601']
+        )
+
+        self.assertEqual(partitioner.partitions(), [
+            Partition(LEGACY_TABLE, None, utc(2026, 1, 1)),
+            Partition(f'{TABLE}_p202601', utc(2026, 1, 1), utc(2026, 2, 1)),
+            Partition(f'{TABLE}_p202602', utc(2026, 2, 1), utc(2026, 3, 1)),
+        ])
+
+    def test_drop_partition(self):
+        partitioner = self.partitioner(relkind='p', tables=[f'{TABLE}_p202601'])
+
+        partitioner.drop_partition(parse_partition(f'{TABLE}_p202601'))
+
+        self.assertEqual(self.database.statements('DROP TABLE'), [f'DROP TABLE "{TABLE}_p202601"'])
+        with self.assertRaises(PartitionError):
+            self.partitioner(relkind='r').drop_partition(parse_partition(f'{TABLE}_p202601'))
+
+    def test_other_databases_are_not_supported(self):
+        with self.assertRaises(PartitionError):
+            get_partitioner()
+        self.assertIsNone(get_active_partitioner())
+
+
+class ChooseLevelTests(SimpleTestCase):
+
+    def resolution(self, span, max_points=200):
+        level = choose_level(NOW - span, NOW, max_points)
+        return level.resolution if level is not None else RAW
+
+    def test_coarsest_level_with_enough_buckets(self):
+        self.assertEqual(self.resolution(datetime.timedelta(hours=1)), RAW)
+        self.assertEqual(self.resolution(datetime.timedelta(minutes=199)), RAW)
+        self.assertEqual(self.resolution(datetime.timedelta(minutes=200)), MINUTE)
+        self.assertEqual(self.resolution(datetime.timedelta(days=7)), MINUTE)
+        self.assertEqual(self.resolution(datetime.timedelta(hours=200)), HOUR)
+        self.assertEqual(self.resolution(datetime.timedelta(days=30)), HOUR)
+        self.assertEqual(self.resolution(datetime.timedelta(days=199)), HOUR)
+        self.assertEqual(self.resolution(datetime.timedelta(days=200)), DAY)
+
+    def test_point_budget_moves_cut_over(self):
+        self.assertEqual(self.resolution(datetime.timedelta(days=30), max_points=1000), MINUTE)
+        self.assertEqual(self.resolution(datetime.timedelta(days=30), max_points=30), DAY)
+
+
+class QuerySeriesTests(SensorDataTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.sensor = self.create_sensor()
+
+    def test_each_level_stays_within_point_budget(self):
+        start = NOW - datetime.timedelta(days=400)
+        for day in range(400):
+            self.create_rollup(self.sensor, DAY, start + datetime.timedelta(days=day), count=24)
+        for hour in range(24 * 30):
+            self.create_rollup(self.sensor, HOUR, NOW - datetime.timedelta(hours=hour + 1), count=60)
+
+        month = query_series(self.sensor, NOW - datetime.timedelta(days=30), NOW, max_points=200)
+        year = query_series(self.sensor, NOW - datetime.timedelta(days=365), NOW, max_points=200)
+
+        self.assertEqual((month.resolution, month.rows_read), (HOUR, 720))
+        self.assertLessEqual(len(month.points), 200)
+        self.assertEqual(sum(point.count for point in month.points), 720 * 60)
+        self.assertEqual((year.resolution, year.rows_read), (DAY, 365))
+        self.assertLessEqual(len(year.points), 200)
+
+    def test_range_crossing_rollup_boundary_counts_each_reading_once(self):
+        start = NOW - datetime.timedelta(minutes=300)
+        # 每30秒一条读数，值为所在的分钟序号
+        SensorData.objects.bulk_create([
+            SensorData(sensor=self.sensor, timestamp=start + datetime.timedelta(seconds=30 * i), value_float=i // 2)
+            for i in range(600)
+        ])
+        # 分钟汇总覆盖前151分钟，之后只有原始读数
+        compute_rollups(now=start + datetime.timedelta(minutes=151, seconds=10))
+
+        series = query_series(self.sensor, start, NOW, max_points=200)
+
+        self.assertEqual(series.resolution, MINUTE)
+        self.assertEqual(series.rows_read, 151 + 2 * 149)
+        self.assertEqual(len(series.points), 150)
+        self.assertEqual(sum(point.count for point in series.points), 600)
+        for index, point in enumerate(series.points):
+            # 每个点合并2分钟，分界处的点由1条分钟汇总和2条原始读数组成
+            self.assertEqual(point.timestamp, start + datetime.timedelta(minutes=2 * index))
+            self.assertEqual((point.count, point.min, point.max), (4, 2 * index, 2 * index + 1))
+            self.assertEqual(point.avg, 2 * index + 0.5)
+            self.assertEqual((point.first, point.last), (2 * index, 2 * index + 1))
+
+    def test_sensor_without_rollups_reads_raw(self):
+        self.create_rollup(self.create_sensor('humidity'), MINUTE, NOW)
+        SensorData.objects.create(sensor=self.sensor, timestamp=NOW - datetime.timedelta(hours=2), value_string='on')
+
+        series = query_series(self.sensor, NOW - datetime.timedelta(hours=6), NOW)
+
+        self.assertEqual(series.resolution, RAW)
+        self.assertEqual([record.value_string for record in series.points], ['on'])
+
+
+class SensorDataApiTests(SensorDataTestCase):
+
+    def test_step_points_use_value_held_before_sampled_record(self):
+        sensor = self.create_sensor()
+        start = timezone.now() - datetime.timedelta(minutes=50)
+        # 400条读数按2条采样1条；每条被采样的读数之前都省略了重复读数，保持的是前一条（未被采样的）读数的值
+        SensorData.objects.bulk_create([
+            SensorData(sensor=sensor, timestamp=start + datetime.timedelta(seconds=7 * i), value_float=i,
+                       compressed=i % 2 == 0 and i > 0)
+            for i in range(400)
+        ])
+        self.client.force_login(self.user)
+
+        response = self.client.get(reverse(
+            'iot_devices:sensor_data_api', args=[self.project.pk, self.device.pk, sensor.pk]
+        ), {'range': '1h'})
+
+        expected = [0.0]
+        for i in range(2, 400, 2):
+            expected.extend([i - 1, i])
+        self.assertEqual(response.json()['values'], expected)
+        self.assertEqual(response.json()['total_records'], 400)
@@ -8,7 +8,10 @@ import json
 import logging
 from .models import Project, Device, Sensor, Actuator, SensorData, ActuatorCommandLog
 from .forms import ProjectForm, DeviceForm, SensorForm, ActuatorForm
+from .retention import RAW
+from .series import query_series
 from django.utils.timezone import now, timedelta
+from communication_handler.control import PUSH_MESSAGES, PUSH_QUEUED, push_command
 
 # 创建logger
 logger = logging.getLogger(__name__)
@@ -375,24 +378,29 @@ def actuator_delete_view(request, project_id, device_id, actuator_id):
 
 def send_command_to_device_via_tcp(actuator_command):
     """
-    向TCP服务器发送执行器命令
+    通过TCP服务器的控制通道将执行器命令推送到设备
     
     Args:
         actuator_command: ActuatorCommandLog实例
     
     Returns:
-        bool: 是否成功将命令发送到TCP服务器
+        str: 推送结果，PUSH_QUEUED 表示命令已进入设备所在工作进程的发送队列；
+            其他结果下命令保持待发送状态，设备重新连接后发送
     """
-    # 当前仅打印日志，未来将实现与TCP服务器的实际通信
+    device = actuator_command.actuator.device
+    result = push_command(
+        device.device_id,
+        actuator_command.id,
+        actuator_command.command_payload,
+        created_at=actuator_command.created_at.timestamp()
+    )
     logger.info(
-        f"命令已准备发送 - ActuatorCommandLog ID: {actuator_command.id}, "
-        f"设备: {actuator_command.actuator.device.name}, "
+        f"命令推送结果: {result} - ActuatorCommandLog ID: {actuator_command.id}, "
+        f"设备: {device.name}, "
         f"执行器: {actuator_command.actuator.name}, "
         f"命令: {actuator_command.command_payload}"
     )
-    
-    # 模拟成功发送
-    return True
+    return result
 
 @login_required
 @require_POST
@@ -448,25 +456,22 @@ def actuator_command_api_view(request, project_id, device_id, actuator_id):
     
     # 尝试发送命令到TCP服务器
     try:
-        send_success = send_command_to_device_via_tcp(actuator_command)
+        send_result = send_command_to_device_via_tcp(actuator_command)
         
-        # 根据发送结果更新状态
-        if send_success:
-            actuator_command.status = 'sent'
-            actuator_command.save()
+        # 发送、确认和超时状态由TCP服务器的命令分发器写回命令日志
+        if send_result == PUSH_QUEUED:
             return JsonResponse({
                 "status": "success", 
-                "message": "命令已成功发送", 
+                "message": PUSH_MESSAGES[send_result], 
                 "command_id": actuator_command.id
             })
         else:
-            actuator_command.status = 'failed'
-            actuator_command.save()
+            # 设备不在线时命令保持待发送状态，设备在有效期内重新连接后发送
             return JsonResponse({
-                "status": "error", 
-                "message": "命令发送失败，请稍后重试", 
+                "status": "queued", 
+                "message": PUSH_MESSAGES[send_result], 
                 "command_id": actuator_command.id
-            }, status=500)
+            }, status=202)
             
     except Exception as e:
         actuator_command.status = 'failed'
@@ -518,32 +523,33 @@ def sensor_data_api_view(request, project_id, device_id, sensor_id):
         else:
             start_time = end_time - timedelta(hours=1)  # 默认1小时
     
-    # 查询数据记录
-    data_records = SensorData.objects.filter(
-        sensor=sensor, 
-        timestamp__gte=start_time, 
-        timestamp__lte=end_time
-    ).order_by('timestamp')
-    
-    # 针对数据集进行采样，避免图表过于密集
-    total_records = data_records.count()
+    # 查询数据：范围较长时读取汇总数据，较短时读取原始读数
     max_data_points = 200  # 最大数据点数
-    
-    # 根据记录数量和时间范围调整采样率
-    if total_records > max_data_points:
-        # 计算采样率，确保至少采样 max_data_points 个点
-        sample_rate = max(1, total_records // max_data_points)
-        # 使用列表切片进行采样
-        data_records = list(data_records)[::sample_rate]
+    series = query_series(sensor, start_time, end_time, max_data_points)
+    
+    if series.resolution == RAW:
+        data_records = series.points
+        total_records = len(data_records)
+        # 每条记录之前一直保持的值，即前一条原始读数的值；需要在采样前取得，采样后前一个点不一定是前一条读数
+        held_values = [None] + [record.get_value() for record in data_records[:-1]]
+        # 针对数据集进行采样，避免图表过于密集
+        if total_records > max_data_points:
+            # 计算采样率，确保至少采样 max_data_points 个点
+            sample_rate = max(1, total_records // max_data_points)
+            # 使用列表切片进行采样
+            data_records = data_records[::sample_rate]
+            held_values = held_values[::sample_rate]
     else:
-        # 记录数少于最大点数，全部使用
-        data_records = list(data_records)
+        # 汇总数据已合并到不超过 max_data_points 个点，每个点取时间段内的平均值
+        data_records = series.points
+        total_records = sum(point.count for point in data_records)
+        held_values = [None] * len(data_records)
     
     # 准备Chart.js所需的数据格式
     labels = []
     values = []
     
-    for record in data_records:
+    for record, held_value in zip(data_records, held_values):
         # 根据时间范围选择合适的时间戳格式
         if time_range == '1h':
             # 1小时显示时:分
@@ -564,9 +570,19 @@ def sensor_data_api_view(request, project_id, device_id, sensor_id):
             # 默认格式
             timestamp_str = record.timestamp.strftime('%Y-%m-%d %H:%M')
         
+        if series.resolution != RAW:
+            labels.append(timestamp_str)
+            values.append(record.avg)
+            continue
+        
         # 获取记录值
         value = record.get_value()
         
+        # 死区压缩省略了重复读数时，上一个值一直保持到本条记录，补一个同时刻的点使折线按阶梯绘制
+        if record.compressed and held_value is not None and held_value != value:
+            labels.append(timestamp_str)
+            values.append(held_value)
+        
         # 添加数据点
         labels.append(timestamp_str)
         values.append(value)
@@ -582,5 +598,6 @@ def sensor_data_api_view(request, project_id, device_id, sensor_id):
         'start_time': start_time.isoformat(),
         'end_time': end_time.isoformat(),
         'data_count': len(values),
-        'total_records': total_records
+        'total_records': total_records,
+        'resolution': series.resolution
     })
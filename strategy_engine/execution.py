@@ -14,6 +14,7 @@ from asgiref.sync import sync_to_async
 
 from .models import Strategy, ConditionGroup, Condition, Action, ExecutionLog
 from iot_devices.models import Device, Sensor, Actuator, SensorData, ActuatorCommandLog
+from communication_handler.control import PUSH_MESSAGES, PUSH_QUEUED, PUSH_SUBMITTED, push_command, submit_local_command
 
 # 配置日志记录器
 logger = logging.getLogger(__name__)
@@ -466,8 +467,8 @@ def update_execution_log(execution_log: ExecutionLog, status: str, action_result
 # 使用sync_to_async包装同步数据库操作，设置thread_sensitive=False避免死锁
 @sync_to_async(thread_sensitive=False)
 def get_actuator(actuator_id: int) -> Actuator:
-    """获取执行器对象"""
-    return Actuator.objects.get(id=actuator_id)
+    """获取执行器对象，同时加载所属设备用于推送命令"""
+    return Actuator.objects.select_related('device').get(id=actuator_id)
 
 @sync_to_async(thread_sensitive=False)
 def get_sensor(sensor_id: int) -> Sensor:
@@ -491,6 +492,9 @@ def update_command_log(command_log, status):
     command_log.status = status
     command_log.save(update_fields=['status'])
 
+# 控制通道客户端是阻塞的套接字调用，放到线程中执行
+push_command_async = sync_to_async(push_command, thread_sensitive=False)
+
 @sync_to_async(thread_sensitive=False)
 def get_actions(strategy):
     """获取策略的所有动作"""
@@ -498,22 +502,34 @@ def get_actions(strategy):
 
 # ============= 动作执行函数 =============
 
-# 占位函数，后续与TCP服务器集成
-async def send_command_to_tcp_server(actuator_id: int, command_payload: dict) -> dict:
+async def send_command_to_tcp_server(actuator: Actuator, command_log: ActuatorCommandLog) -> dict:
     """
-    将命令发送到TCP服务器的占位函数
+    将命令交给执行器所属设备的发送队列
+    
+    在TCP服务器工作进程内触发时（数据入库的信号在数据库执行器的线程中执行）直接交给本进程的命令分发器，
+    不等待控制通道，避免占用数据库线程；其他进程（Web、Celery）中通过控制通道推送。
+    设备不在线时命令保持待发送状态，设备在有效期内重新连接后发送；
+    发送、确认和超时状态由TCP服务器的命令分发器写回命令日志。
     
     Args:
-        actuator_id: 执行器ID
-        command_payload: 命令内容
+        actuator: 执行器对象（需已加载所属设备）
+        command_log: 命令日志，其ID作为命令ID发送给设备
         
     Returns:
         dict: 响应结果
     """
-    logger.info(f"向TCP服务器发送命令: 执行器ID={actuator_id}, 命令={command_payload}")
-    # TODO: 实现与TCP服务器的实际集成
-    # 占位实现，假设成功
-    return {"status": "success", "message": "命令已发送"}
+    logger.info(f"向TCP服务器发送命令: 执行器ID={actuator.id}, 命令={command_log.command_payload}")
+    created_at = command_log.created_at.timestamp()
+    result = submit_local_command(actuator.device.device_id, command_log.id, command_log.command_payload, created_at)
+    if result is None:
+        result = await push_command_async(
+            actuator.device.device_id,
+            command_log.id,
+            command_log.command_payload,
+            created_at=created_at
+        )
+    status = "success" if result in (PUSH_QUEUED, PUSH_SUBMITTED) else "queued"
+    return {"status": status, "message": PUSH_MESSAGES[result]}
 
 
 def render_template(template_str: str, context: Dict[str, Any]) -> str:
@@ -622,10 +638,7 @@ async def execute_strategy_actions(strategy: Strategy, trigger_context: Dict[str
                 # 发送命令到TCP服务器
                 logger.info(f"发送命令到执行器: 执行器ID={actuator.id}, 命令={command_payload}")
                 try:
-                    response = await send_command_to_tcp_server(actuator.id, command_payload)
-                    
-                    # 更新命令日志
-                    await update_command_log(command_log, 'sent')
+                    response = await send_command_to_tcp_server(actuator, command_log)
                     
                     # 记录动作结果
                     action_result.update({